@@ -272,6 +272,7 @@ CREATE TABLE `system` (
   `last_update` datetime NOT NULL DEFAULT '0000-00-00 00:00:00',
   `dataset_accesses_last_update` datetime NOT NULL DEFAULT '0000-00-00 00:00:00',
   `dataset_requests_last_update` datetime NOT NULL DEFAULT '0000-00-00 00:00:00',
+  `replicas_last_update` datetime NOT NULL DEFAULT '0000-00-00 00:00:00',
   UNIQUE KEY `lock` (`lock_host`,`lock_process`)
 ) ENGINE=MyISAM DEFAULT CHARSET=latin1;
 /*!40101 SET character_set_client = @saved_cs_client */;
@@ -0,0 +1,7 @@
+-- Adds the column system.replicas_last_update (time of the last full or incremental replica update) to a dynamo
+-- database created from an earlier dynamo.sql. Without the column, inventory.py update --incremental performs full
+-- updates.
+--
+-- Usage: mysql dynamo < upgrade_replicas_last_update.sql
+
+ALTER TABLE `system` ADD COLUMN `replicas_last_update` datetime NOT NULL DEFAULT '0000-00-00 00:00:00' AFTER `dataset_requests_last_update`;
@@ -43,6 +43,11 @@ webservice.cache_db_params = {
 
 mysql = Configuration()
 mysql.max_query_len = 100000 # allows up to 1M characters; allowing 90% safety margin
+mysql.insert_chunk_rows = 10000 # maximum number of rows in one INSERT
+mysql.bulk_load = True # use LOAD DATA LOCAL INFILE in load_many (connections of the inventory store and history)
+mysql.bulk_load_min_rows = 1000 # shorter lists are written with INSERT
+mysql.pool_size = 8 # idle connections kept per parameter set in the connection pool
+mysql.pool_ping_interval = 60 # pooled connections idle for longer (seconds) are checked before reuse
 
 mysqlstore = Configuration()
 mysqlstore.db_params = {
@@ -50,6 +55,14 @@ mysqlstore.db_params = {
     'config_group': 'mysql-dynamo',
     'db': 'dynamo'
 }
+# number of connections reading the inventory tables in parallel at load time (1 -> serial over the main connection)
+mysqlstore.load_connections = 4
+# dataset_id ranges per load connection (more ranges -> finer interleaving of the transfer and object construction)
+mysqlstore.load_ranges_per_connection = 4
+# snapshots share the tables with the store and copy rows only when they are modified
+mysqlstore.lazy_snapshots = True
+# dataset names missing in the id cache are looked up by name up to this number; above it the whole table is read
+mysqlstore.id_lookup_max = 1000
 
 phedex = Configuration()
 phedex.url_base = 'https://cmsweb.cern.ch/phedex/datasvc/json/prod'
@@ -140,7 +153,18 @@ inventory.included_groups = [
     'trigger',
     'upgrade'
 ]
+# load blocks of datasets with only full replicas on first access (InventoryManager.load(lazy_blocks = True))
+inventory.lazy_blocks = False
+inventory.lazy_block_batch = 100 # number of datasets loaded per store query
+inventory.lazy_block_max_datasets = 0 # maximum number of datasets with lazily loaded blocks in memory; 0 for no limit
+# binary image of the loaded inventory for fast startup (e.g. paths.data + '/inventory.img'); used while the store is not updated. '' to disable
+inventory.image_path = ''
+# keep block replicas in typed arrays (BlockReplicaStore) instead of one tuple per replica; trades attribute access speed for memory
+inventory.columnar_block_replicas = True
+# number of objects per store call when writing the inventory change journal
+inventory.journal_batch_size = 1000
 # list of (partition name, partitioning function)
+# partitioning functions must depend only on the replica group and the site storage type (results are cached per combination)
 inventory.partitions = [
     ('AnalysisOps', lambda r: r.group is not None and r.group.name == 'AnalysisOps'),
     ('DataOps', lambda r: r.group is not None and r.group.name == 'DataOps'),
@@ -2,10 +2,12 @@ from exceptions import IntegrityError, ObjectError
 from dataset import Dataset
 from block import Block
 from lfile import File
+from filecatalog import FileCatalog
 from site import Site
 from group import Group
 from datasetreplica import DatasetReplica
 from blockreplica import BlockReplica
+from blockreplicastore import BlockReplicaStore
 from history import HistoryRecord
 
 __all__ = [
@@ -14,9 +16,11 @@ __all__ = [
     'Dataset',
     'Block',
     'File',
+    'FileCatalog',
     'Site',
     'Group',
     'DatasetReplica',
     'BlockReplica',
+    'BlockReplicaStore',
     'HistoryRecord'
 ]
@@ -5,17 +5,16 @@ Block = collections.namedtuple('Block', ['name', 'dataset', 'size', 'num_files',
 
 def _Block_translate_name(name_str):
     # block name format: [8]-[4]-[4]-[4]-[12] where [n] is an n-digit hex.
-    return int(name_str.replace('-', ''), 16)
+    # The 128-bit number is kept as a long, which is smaller than the 36-character string.
+    return long(name_str.replace('-', ''), 16)
 
 def _Block___str__(self):
     return 'Block %s#%s (size=%d, num_files=%d, is_open=%s)' % (self.dataset.name, self.real_name(), self.size, self.num_files, self.is_open)
 
 def _Block_real_name(self):
-    full_string = hex(self.name).replace('0x', '')[:-1] # last character is 'L'
-    if len(full_string) < 32:
-        full_string = '0' * (32 - len(full_string)) + full_string
-
-    return full_string[:8] + '-' + full_string[8:12] + '-' + full_string[12:16] + '-' + full_string[16:20] + '-' + full_string[20:]
+    # called in bulk when saving and when matching against names from external sources; avoid hex() and string concatenation
+    full_string = '%032x' % self.name
+    return '%s-%s-%s-%s-%s' % (full_string[:8], full_string[8:12], full_string[12:16], full_string[16:20], full_string[20:])
 
 def _Block_clone(self, **kwd):
     return Block(
@@ -0,0 +1,182 @@
+import array
+import threading
+
+from blockreplica import BlockReplica
+
+class BlockReplicaStore(object):
+    """
+    Columnar storage of block replicas. Each replica is a row in a set of typed arrays (block, site index, group index,
+    flags, size). Rows are owned by the ReplicaList that created them (DatasetReplica.block_replicas) and are reused
+    once the list releases them. Reading a row creates a plain BlockReplica tuple; nothing refers back to the row, so
+    the replicas compare, hash, and behave exactly as in the list representation.
+    The store is owned by the inventory (InventoryManager.block_replica_store).
+    """
+
+    FLAG_COMPLETE = 1
+    FLAG_CUSTODIAL = 2
+
+    class ReplicaList(object):
+        """
+        List-like container of the rows of one dataset replica. Iteration and indexing return BlockReplica tuples.
+        Rows are released to the store when they are removed or when the list is deleted.
+        """
+
+        __slots__ = ['_store', '_rows']
+
+        def __init__(self, store, replicas = []):
+            self._store = store
+            self._rows = array.array('i')
+
+            for replica in replicas:
+                self.append(replica)
+
+        def __del__(self):
+            try:
+                self._store.release(self._rows)
+            except:
+                # interpreter shutdown
+                pass
+
+        def __len__(self):
+            return len(self._rows)
+
+        def __iter__(self):
+            get = self._store.get
+            return (get(row) for row in self._rows)
+
+        def __getitem__(self, index):
+            if type(index) is slice:
+                return map(self._store.get, self._rows[index])
+
+            return self._store.get(self._rows[index])
+
+        def __contains__(self, replica):
+            return self._index(replica) >= 0
+
+        def __repr__(self):
+            return repr(list(self))
+
+        def new(self, block, site, group, is_complete, is_custodial, size):
+            """
+            Create a row, append it, and return the block replica.
+            """
+
+            self._rows.append(self._store.add(block, site, group, is_complete, is_custodial, size))
+
+            return BlockReplica(block, site, group, is_complete, is_custodial, size)
+
+        def append(self, replica):
+            self._rows.append(self._store.add(*replica))
+
+        def extend(self, replicas):
+            for replica in replicas:
+                self.append(replica)
+
+        def remove(self, replica):
+            index = self._index(replica)
+            if index < 0:
+                raise ValueError('ReplicaList.remove(x): x not in list')
+
+            self._store.release((self._rows.pop(index),))
+
+        def find(self, block):
+            """
+            Return the replica of the block, or None.
+            """
+
+            blocks = self._store._block
+            for row in self._rows:
+                if blocks[row] == block:
+                    return self._store.get(row)
+
+            return None
+
+        def _index(self, replica):
+            # value comparison (same semantics as a list of BlockReplica tuples)
+            store = self._store
+            block = replica.block
+            for index, row in enumerate(self._rows):
+                if store._block[row] == block and store.get(row) == replica:
+                    return index
+
+            return -1
+
+
+    def __init__(self):
+        # block objects are shared with Dataset.blocks; None for released rows
+        self._block = []
+        self._site = array.array('H')
+        self._group = array.array('H')
+        self._flags = array.array('B')
+        self._size = array.array('l')
+
+        # released rows to be reused
+        self._free = array.array('i')
+
+        # site and group registries. Index 0 of groups is None
+        self._sites = []
+        self._site_ids = {}
+        self._groups = [None]
+        self._group_ids = {None: 0}
+
+        # ReplicaLists release their rows when they are deleted, which can happen in any thread
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._block) - len(self._free)
+
+    def new_list(self, replicas = []):
+        return BlockReplicaStore.ReplicaList(self, replicas)
+
+    def add(self, block, site, group, is_complete, is_custodial, size):
+        """
+        Fill a row and return its index.
+        """
+
+        try:
+            site_id = self._site_ids[site]
+        except KeyError:
+            site_id = self._site_ids[site] = len(self._sites)
+            self._sites.append(site)
+
+        try:
+            group_id = self._group_ids[group]
+        except KeyError:
+            group_id = self._group_ids[group] = len(self._groups)
+            self._groups.append(group)
+
+        flags = 0
+        if is_complete:
+            flags |= BlockReplicaStore.FLAG_COMPLETE
+        if is_custodial:
+            flags |= BlockReplicaStore.FLAG_CUSTODIAL
+
+        with self._lock:
+            if len(self._free) != 0:
+                row = self._free.pop()
+                self._block[row] = block
+                self._site[row] = site_id
+                self._group[row] = group_id
+                self._flags[row] = flags
+                self._size[row] = size
+            else:
+                row = len(self._block)
+                self._block.append(block)
+                self._site.append(site_id)
+                self._group.append(group_id)
+                self._flags.append(flags)
+                self._size.append(size)
+
+        return row
+
+    def get(self, row):
+        flags = self._flags[row]
+        return BlockReplica(self._block[row], self._sites[self._site[row]], self._groups[self._group[row]],
+            (flags & BlockReplicaStore.FLAG_COMPLETE) != 0, (flags & BlockReplicaStore.FLAG_CUSTODIAL) != 0, self._size[row])
+
+    def release(self, rows):
+        with self._lock:
+            for row in rows:
+                self._block[row] = None
+
+            self._free.extend(rows)
@@ -2,17 +2,33 @@ import time
 
 from block import Block
 from lfile import File
+from filecatalog import FileCatalog
 from exceptions import ObjectError
 
 class Dataset(object):
     """Represents a dataset."""
 
+    __slots__ = ['name', 'size', 'num_files', 'status', 'on_tape', 'data_type', 'software_version', 'last_update', 'is_open',
+        '_replicas', '_replica_index', '_blocks', '_block_index', '_files', 'requests', 'demand']
+
     # Enumerator for dataset type.
     # Starting from 1 to play better with MySQL
     TYPE_UNKNOWN, TYPE_ALIGN, TYPE_CALIB, TYPE_COSMIC, TYPE_DATA, TYPE_LUMI, TYPE_MC, TYPE_RAW, TYPE_TEST = range(1, 10)
     STAT_UNKNOWN, STAT_DELETED, STAT_DEPRECATED, STAT_INVALID, STAT_PRODUCTION, STAT_VALID, STAT_IGNORED = range(1, 8)
     TAPE_NONE, TAPE_FULL, TAPE_PARTIAL = range(3)
 
+    # optional loader of blocks on first access (lazy block loading). Must have a method load(dataset)
+    _block_loader = None
+
+    @staticmethod
+    def set_block_loader(loader):
+        """
+        Blocks of datasets with blocks = None will be requested from the loader when accessed.
+        Pass None to disable lazy loading.
+        """
+
+        Dataset._block_loader = loader
+
     @staticmethod
     def data_type_name(arg):
         if type(arg) is int:
@@ -48,6 +64,10 @@ class Dataset(object):
             return arg
 
     def __init__(self, name, size = 0, num_files = 0, status = STAT_UNKNOWN, on_tape = TAPE_NONE, data_type = TYPE_UNKNOWN, software_version = None, last_update = 0, is_open = True):
+        # the same name string is used as a key in the inventory, the history, and the demand records
+        if type(name) is str:
+            name = intern(name)
+
         self.name = name
         self.size = size # redundant with sum of block sizes when blocks are loaded
         self.num_files = num_files # redundant with sum of block num_files and len(files)
@@ -59,12 +79,63 @@ class Dataset(object):
         self.is_open = is_open
 
         # "transient" members
-        self.blocks = None # is a list when loaded
-        self.files = None # is a set when loaded
         self.replicas = None # is a list when loaded
+        self._blocks = None
+        self.blocks = None # is a list when loaded
+        self._files = None
+        self.files = None # is a FileCatalog when loaded
         self.requests = []
         self.demand = {} # freeform key-value pairs
 
+    # blocks, files, and replicas are accompanied by lookup indices that are rebuilt whenever
+    # the containers are replaced. Use the add_ / remove_ methods to modify the contents.
+
+    @property
+    def blocks(self):
+        if self._blocks is None and Dataset._block_loader is not None:
+            Dataset._block_loader.load(self)
+
+        return self._blocks
+
+    @blocks.setter
+    def blocks(self, blocks):
+        if self._blocks is not None:
+            # replicas in the implicit representation cover any blocks set to a dataset without blocks
+            self._materialize_block_replicas()
+
+        self._blocks = blocks
+        if blocks is None:
+            self._block_index = None # {block name: position in _blocks}
+        else:
+            self._block_index = dict((b.name, pos) for pos, b in enumerate(blocks))
+
+    @property
+    def files(self):
+        return self._files
+
+    @files.setter
+    def files(self, files):
+        # any iterable of files is converted to a FileCatalog, which indexes the files by path and by block
+        if self._files is not None:
+            self._files.clear()
+
+        if files is None or type(files) is FileCatalog:
+            self._files = files
+        else:
+            self._files = FileCatalog(files)
+
+    @property
+    def replicas(self):
+        return self._replicas
+
+    @replicas.setter
+    def replicas(self, replicas):
+        self._replicas = replicas
+        if replicas is None:
+            self._replica_index = None # {site: replica}
+        else:
+            self._replica_index = dict((r.site, r) for r in replicas)
+
     def __str__(self):
         if self.replicas is None:
             replica_sites = '?'
@@ -85,14 +156,13 @@ class Dataset(object):
 
         if self.replicas is not None:
             for replica in self.replicas:
-                replica.dataset = None
                 site = replica.site
     
-                for block_replica in replica.block_replicas:
-                    site.remove_block_replica(block_replica)
+                site.remove_block_replicas(replica)
     
                 replica.block_replicas = []
-                site.dataset_replicas.remove(replica)
+                site.remove_dataset_replica(replica)
+                replica.dataset = None
 
         # by removing the dataset replicas, the block replicas should become deletable (site->blockrep link is cut)
         self.replicas = None
@@ -100,78 +170,152 @@ class Dataset(object):
         self.files = None
         self.blocks = None
 
+    def blocks_loaded(self):
+        # check without triggering the lazy loading
+        return self._blocks is not None
+
+    def evict_blocks(self):
+        """
+        Drop the blocks from memory if nothing but the dataset refers to them, i.e. all replicas are implicit and
+        files are not loaded. Return True if the blocks are dropped.
+        """
+
+        if self._blocks is None or self._files is not None:
+            return False
+
+        if self._replicas is not None:
+            for replica in self._replicas:
+                if not replica.is_implicit():
+                    return False
+
+        self._blocks = None
+        self._block_index = None
+
+        return True
+
     def find_block(self, block):
         if self.blocks is None:
             raise ObjectError('Blocks are not loaded for %s' % self.name)
 
-        try:
-            if type(block).__name__ == 'Block':
-                return next(b for b in self.blocks if b == block)
+        if type(block).__name__ == 'Block':
+            pos = self._block_index.get(block.name)
+            if pos is not None and self._blocks[pos] == block:
+                return self._blocks[pos]
             else:
-                return next(b for b in self.blocks if b.name == block)
-
-        except StopIteration:
-            return None
+                return None
+        else:
+            pos = self._block_index.get(block)
+            if pos is None:
+                return None
+            else:
+                return self._blocks[pos]
 
     def find_file(self, lfile):
         if self.files is None:
             raise ObjectError('Files are not loaded for %s' % self.name)
 
-        try:
-            if type(lfile).__name__ == 'File':
-                return next(f for f in self.files if f == lfile)
+        if type(lfile).__name__ == 'File':
+            found = self._files.find(lfile.directory_id, lfile.name)
+            if found == lfile:
+                return found
             else:
-                directory_id = File.get_directory_id(lfile)
-                name = File.get_basename(lfile)
-                return next(f for f in self.files if f.name == name and f.directory_id == directory_id)
-
-        except StopIteration:
-            return None
+                return None
+        else:
+            directory_id = File.get_directory_id(lfile)
+            name = File.get_basename(lfile)
+            return self._files.find(directory_id, name)
 
     def find_replica(self, site):
         if self.replicas is None:
             return None
 
-        try:
-            if type(site).__name__ == 'Site':
-                return next(r for r in self.replicas if r.site == site)
-            else:
+        if type(site).__name__ == 'Site':
+            return self._replica_index.get(site)
+        else:
+            # lookup by name is only used by command-line tools
+            try:
                 return next(r for r in self.replicas if r.site.name == site)
+            except StopIteration:
+                return None
 
-        except StopIteration:
-            return None
+    def add_block(self, block):
+        if self.blocks is None:
+            raise ObjectError('Blocks are not loaded for %s' % self.name)
+
+        # implicit full replicas would otherwise cover the new block
+        self._materialize_block_replicas()
+
+        self._block_index[block.name] = len(self._blocks)
+        self._blocks.append(block)
+
+    def _materialize_block_replicas(self):
+        # replicas in the implicit representation refer to the current list of blocks
+        # and must be materialized before the list changes
+        if self._replicas is None:
+            return
+
+        for replica in self._replicas:
+            replica.materialize_block_replicas()
+
+    def add_file(self, lfile):
+        if self.files is None:
+            raise ObjectError('Files are not loaded for %s' % self.name)
+
+        self._files.add(lfile)
+
+    def remove_file(self, lfile):
+        if self.files is None:
+            raise ObjectError('Files are not loaded for %s' % self.name)
+
+        self._files.remove(lfile)
+
+    def add_replica(self, replica):
+        if self.replicas is None:
+            raise ObjectError('Replicas are not loaded for %s' % self.name)
+
+        self._replicas.append(replica)
+        self._replica_index[replica.site] = replica
+
+    def remove_replica(self, replica):
+        if self.replicas is None:
+            raise ObjectError('Replicas are not loaded for %s' % self.name)
+
+        self._replicas.remove(replica)
+        if self._replica_index.get(replica.site) is replica:
+            self._replica_index.pop(replica.site)
 
     def update_block(self, name, size, num_files, is_open):
         if self.blocks is None:
             raise ObjectError('Blocks are not loaded for %s' % self.name)
 
         # not catching exception intentionally
-        old_block = next(b for b in self.blocks if b.name == name)
-        self.blocks.remove(old_block)
+        pos = self._block_index[name]
+        old_block = self._blocks[pos]
+
+        self._materialize_block_replicas()
 
         new_block = Block(name, self, size, num_files, is_open)
-        self.blocks.append(new_block)
+        self._blocks[pos] = new_block
 
         self.size += new_block.size - old_block.size
         self.num_files += new_block.num_files - old_block.num_files
 
         if self.files is not None:
-            for lfile in [f for f in self.files if f.block == old_block]:
-                new_lfile = lfile.clone(block = new_block)
-    
-                self.files.remove(lfile)
-                self.files.add(new_lfile)
+            self._files.replace_block(old_block, new_block)
 
         if self.replicas is not None:
             for replica in self.replicas:
-                for block_replica in [r for r in replica.block_replicas if r.block == old_block]:
-                    new_block_replica = block_replica.clone(block = new_block)
-    
-                    replica.block_replicas.remove(block_replica)
-                    replica.block_replicas.append(new_block_replica)
-    
-                    replica.site.remove_block_replica(block_replica)
-                    replica.site.add_block_replica(new_block_replica)
+                block_replica = self._find_block_replica(replica, old_block)
+                if block_replica is None:
+                    continue
+
+                new_block_replica = block_replica.clone(block = new_block)
+
+                replica.remove_block_replica(block_replica)
+                replica.add_block_replica(new_block_replica)
+
+                replica.site.remove_block_replica(block_replica)
+                replica.site.add_block_replica(new_block_replica)
 
         return new_block
 
@@ -179,19 +323,52 @@ class Dataset(object):
         if self.blocks is None:
             raise ObjectError('Blocks are not loaded for %s' % self.name)
 
-        self.blocks.remove(block)
+        self._materialize_block_replicas()
+
+        pos = self._block_index.get(block.name)
+        if pos is None or self._blocks[pos] != block:
+            raise ValueError('%s is not a block of %s' % (block.name, self.name))
+
+        # move the last block into the vacated position to keep the removal O(1)
+        last = self._blocks.pop()
+        if pos != len(self._blocks):
+            self._blocks[pos] = last
+            self._block_index[last.name] = pos
+
+        self._block_index.pop(block.name)
+
         self.size -= block.size
         self.num_files -= block.num_files
 
         if self.files is not None:
-            for lfile in [f for f in self.files if f.block == block]:
-                self.files.remove(lfile)
+            self._files.remove_block(block)
 
         if self.replicas is not None:
             for replica in self.replicas:
-                for block_replica in [r for r in replica.block_replicas if r.block == block]:
-                    replica.block_replicas.remove(block_replica)
-                    replica.site.remove_block_replica(block_replica)
+                block_replica = self._find_block_replica(replica, block)
+                if block_replica is None:
+                    continue
+
+                replica.remove_block_replica(block_replica)
+                replica.site.remove_block_replica(block_replica)
+
+    def find_block_files(self, block):
+        """
+        Return the list of files of the block.
+        """
+
+        if self.files is None:
+            raise ObjectError('Files are not loaded for %s' % self.name)
+
+        return self._files.block_files(block)
+
+    def _find_block_replica(self, replica, block):
+        # sites index their block replicas by block; the dataset replica holds the same object
+        block_replica = replica.site.find_block_replica(block)
+        if block_replica is None or block_replica.block != block:
+            return None
+
+        return block_replica
 
     def update_file(self, path, size):
         if self.files is None:
@@ -199,11 +376,12 @@ class Dataset(object):
 
         directory_id = File.get_directory_id(path)
         name = File.get_basename(path)
-        old_file = next(f for f in self.files if f.name == name and f.directory_id == directory_id)
-        self.files.remove(old_file)
+        old_file = self._files.find(directory_id, name)
+        if old_file is None:
+            raise KeyError(path)
 
+        # replaces the entry with the same path
         new_file = old_file.clone(size = size)
-        self.files.add(new_file)
+        self.add_file(new_file)
 
         return new_file
-
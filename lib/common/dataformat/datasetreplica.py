@@ -1,6 +1,23 @@
+from blockreplica import BlockReplica
+from blockreplicastore import BlockReplicaStore
+
 class DatasetReplica(object):
     """Represents a dataset replica. Combines dataset and site information."""
 
+    __slots__ = ['dataset', 'site', 'is_complete', 'is_custodial', 'last_block_created', '_block_replicas', '_implicit', '_implicit_group', '_group_sizes']
+
+    # optional columnar backend for block replicas (BlockReplicaStore)
+    _block_replica_store = None
+
+    @staticmethod
+    def set_block_replica_store(store):
+        """
+        Block replicas of dataset replicas filled after this call will be kept in the store.
+        Pass None to revert to plain lists of BlockReplica tuples.
+        """
+
+        DatasetReplica._block_replica_store = store
+
     def __init__(self, dataset, site, is_complete = False, is_custodial = False, last_block_created = 0):
         self.dataset = dataset
         self.site = site
@@ -9,14 +26,164 @@ class DatasetReplica(object):
         self.last_block_created = last_block_created
         self.block_replicas = []
 
+    # Most replicas are full, with all block replicas complete and owned by one group. Such a replica can be kept in an
+    # implicit representation ("all blocks, owned by group") where no BlockReplica is created. The block replicas are
+    # materialized when block_replicas is accessed, which also happens before the replica is modified.
+
+    @property
+    def block_replicas(self):
+        if self._implicit:
+            self.materialize_block_replicas()
+
+        return self._block_replicas
+
+    @block_replicas.setter
+    def block_replicas(self, replicas):
+        store = DatasetReplica._block_replica_store
+        if store is not None and type(replicas) is list and len(replicas) != 0:
+            replicas = store.new_list(replicas)
+
+        self._block_replicas = replicas
+        self._implicit = False
+        self._implicit_group = None
+        self._group_sizes = None # {group: (physical size, projected size)}, computed on demand
+
+    # Use add_ / remove_block_replica to modify the contents of block_replicas, so that the cached sizes are invalidated.
+
+    def add_block_replica(self, replica):
+        self._writable_block_replicas().append(replica)
+        self._group_sizes = None
+
+    def remove_block_replica(self, replica):
+        self.block_replicas.remove(replica)
+        self._group_sizes = None
+
+    def is_implicit(self):
+        return self._implicit
+
+    def implicit_group(self):
+        return self._implicit_group
+
+    def is_columnar(self):
+        """
+        Whether the block replicas are rows of a BlockReplicaStore. Sites find such block replicas through the
+        dataset replica instead of indexing them by block.
+        """
+
+        return type(self._block_replicas) is BlockReplicaStore.ReplicaList
+
+    def _writable_block_replicas(self):
+        # empty lists are only converted to the store when the first block replica is added
+        block_replicas = self.block_replicas
+        if type(block_replicas) is list and len(block_replicas) == 0:
+            store = DatasetReplica._block_replica_store
+            if store is not None:
+                block_replicas = self._block_replicas = store.new_list()
+
+        return block_replicas
+
+    def set_full(self, group):
+        """
+        Make this a full replica of all blocks owned by group, without creating the block replicas.
+        The replica must then be added to the site with Site.add_full_replica instead of adding block replicas.
+        """
+
+        self.is_complete = True
+        self.block_replicas = []
+        self._implicit = True
+        self._implicit_group = group
+
+    def collapse_block_replicas(self):
+        """
+        Switch to the implicit representation if the replica is full and its block replicas are complete, share the
+        custodial flag of the dataset replica, and have a single owner. Return True if the replica is implicit after the call.
+        """
+
+        if self._implicit:
+            return True
+
+        if not self.is_full() or len(self._block_replicas) == 0:
+            return False
+
+        group = self._block_replicas[0].group
+        for block_replica in self._block_replicas:
+            if not block_replica.is_complete or block_replica.is_custodial != self.is_custodial or \
+                    block_replica.size != block_replica.block.size or block_replica.group != group:
+                return False
+
+        registered = (self.site.find_dataset_replica(self.dataset) is self)
+        if registered:
+            self.site.remove_block_replicas(self)
+
+        self.set_full(group)
+
+        if registered:
+            self.site.add_full_replica(self)
+
+        return True
+
+    def materialize_block_replicas(self):
+        """
+        Create the block replicas of an implicit replica and register them with the site in place of the whole replica.
+        """
+
+        if not self._implicit:
+            return
+
+        group = self._implicit_group
+        self._implicit = False
+        self._implicit_group = None
+
+        for block in self.dataset.blocks:
+            self.new_block_replica(block, group, True, self.is_custodial, block.size)
+
+        if self.site.remove_full_replica(self):
+            for block_replica in self._block_replicas:
+                self.site.add_block_replica(block_replica)
+
+    def iter_block_replicas(self):
+        """
+        Iterate over block replicas without materializing the implicit representation. Block replicas of an implicit
+        replica are created on the fly and are not registered anywhere; use block_replicas to modify the replica.
+        """
+
+        if self._implicit:
+            group = self._implicit_group
+            return (BlockReplica(block, self.site, group, True, self.is_custodial, block.size) for block in self.dataset.blocks)
+        else:
+            return iter(self._block_replicas)
+
+    def num_block_replicas(self):
+        if self._implicit:
+            return len(self.dataset.blocks)
+        else:
+            return len(self._block_replicas)
+
+    def new_block_replica(self, block, group, is_complete, is_custodial, size):
+        """
+        Create a block replica of the block at the site of this replica, append it to block_replicas, and return it.
+        The block replica still has to be added to the site.
+        """
+
+        self._group_sizes = None
+
+        block_replicas = self._writable_block_replicas()
+
+        if type(block_replicas) is list:
+            block_replica = BlockReplica(block, self.site, group, is_complete, is_custodial, size)
+            block_replicas.append(block_replica)
+        else:
+            block_replica = block_replicas.new(block, self.site, group, is_complete, is_custodial, size)
+
+        return block_replica
+
     def unlink(self):
-        self.dataset.replicas.remove(self)
-        self.dataset = None
+        self.dataset.remove_replica(self)
+        self.site.remove_dataset_replica(self)
 
-        self.site.dataset_replicas.remove(self)
+        self.dataset = None
 
-        for block_replica in self.block_replicas:
-            self.site.remove_block_replica(block_replica)
+        self.site.remove_block_replicas(self)
 
         self.block_replicas = []
         self.site = None
@@ -26,7 +193,7 @@ class DatasetReplica(object):
             ' {block_replicas_size} block_replicas)'.format(
                 site = self.site.name, dataset = self.dataset.name, is_complete = self.is_complete,
                 is_custodial = self.is_custodial,
-                block_replicas_size = len(self.block_replicas))
+                block_replicas_size = self.num_block_replicas())
 
     def __repr__(self):
         rep = 'DatasetReplica(%s,\n' % repr(self.dataset)
@@ -41,9 +208,11 @@ class DatasetReplica(object):
         # Create a detached clone. Detached in the sense that it is not linked from dataset or site.
         replica = DatasetReplica(dataset = self.dataset, site = self.site, is_complete = self.is_complete, is_custodial = self.is_custodial, last_block_created = self.last_block_created)
 
-        if block_replicas:
-            for brep in self.block_replicas:
-                replica.block_replicas.append(brep.clone())
+        if block_replicas and self._implicit:
+            replica.set_full(self._implicit_group)
+        elif block_replicas:
+            for brep in self._block_replicas:
+                replica.add_block_replica(brep.clone())
 
         return replica
 
@@ -51,20 +220,47 @@ class DatasetReplica(object):
         return len(self.dataset.replicas) == 1 and self.dataset.replicas[0] == self
 
     def is_partial(self):
+        if self._implicit:
+            return False
+
         # dataset.blocks must be loaded if a replica is created for the dataset
-        return self.is_complete and len(self.block_replicas) != len(self.dataset.blocks)
+        return self.is_complete and self.num_block_replicas() != len(self.dataset.blocks)
 
     def is_full(self):
+        if self._implicit:
+            return True
+
         # dataset.blocks must be loaded if a replica is created for the dataset
-        return self.is_complete and len(self.block_replicas) == len(self.dataset.blocks)
+        return self.is_complete and self.num_block_replicas() == len(self.dataset.blocks)
 
     def size(self, groups = [], physical = True):
+        if self._implicit:
+            # all blocks are complete and owned by one group; physical and projected sizes agree
+            if type(groups) is not list:
+                owned = (groups == self._implicit_group)
+            else:
+                owned = (len(groups) == 0 or self._implicit_group in groups)
+
+            return self.dataset.size if owned else 0
+
+        if self._group_sizes is None:
+            self._group_sizes = {}
+            for replica in self._block_replicas:
+                try:
+                    physical_size, projected_size = self._group_sizes[replica.group]
+                except KeyError:
+                    physical_size, projected_size = 0, 0
+
+                self._group_sizes[replica.group] = (physical_size + replica.size, projected_size + replica.block.size)
+
+        index = 0 if physical else 1
+
         if type(groups) is not list:
             # single group given
-            if physical:
-                return sum([r.size for r in self.block_replicas if r.group == groups])
-            else:
-                return sum([r.block.size for r in self.block_replicas if r.group == groups])
+            try:
+                return self._group_sizes[groups][index]
+            except KeyError:
+                return 0
 
         else: # expect a list
             if len(groups) == 0:
@@ -72,18 +268,15 @@ class DatasetReplica(object):
                 if self.is_full():
                     return self.dataset.size
                 else:
-                    if physical:
-                        return sum([r.size for r in self.block_replicas])
-                    else:
-                        return sum([r.block.size for r in self.block_replicas])
+                    return sum(sizes[index] for sizes in self._group_sizes.itervalues())
 
             else:
-                if physical:
-                    return sum([r.size for r in self.block_replicas if r.group in groups])
-                else:
-                    return sum([r.block.size for r in self.block_replicas if r.group in groups])
+                return sum(sizes[index] for group, sizes in self._group_sizes.iteritems() if group in groups)
 
     def find_block_replica(self, block):
+        if type(block).__name__ == 'Block' and self.is_columnar():
+            return self._block_replicas.find(block)
+
         try:
             if type(block).__name__ == 'Block':
                 return next(b for b in self.block_replicas if b.block == block)
@@ -0,0 +1,251 @@
+import array
+
+from lfile import File
+
+class FileCatalog(object):
+    """
+    Files of a dataset, stored column-wise: basename, directory id, block index, and size of each file.
+    File tuples are created on access. Used as Dataset.files.
+    Rows are kept dense; removing a file moves the last row into its place. Blocks are kept dense in the same way, and
+    a block is dropped together with its last file.
+    """
+
+    __slots__ = ['_names', '_directory_ids', '_block_indices', '_sizes', '_rows', '_blocks', '_block_ids', '_block_rows', '_directory_counts']
+
+    def __init__(self, files = []):
+        self._names = []
+        self._directory_ids = array.array('l')
+        self._block_indices = array.array('l')
+        self._sizes = array.array('l')
+
+        self._rows = {} # {basename: row or list of rows}. Basenames are almost always unique within a dataset
+        self._blocks = [] # blocks of the files
+        self._block_ids = {} # {block name: index in _blocks}
+        self._block_rows = [] # rows of the files of each block (array), parallel to _blocks
+        self._directory_counts = {} # {directory id: number of files}. Each directory in use is acquired once from File
+
+        for lfile in files:
+            self.add(lfile)
+
+    def __len__(self):
+        return len(self._names)
+
+    def __iter__(self):
+        for row in xrange(len(self._names)):
+            yield self._make_file(row)
+
+    def __contains__(self, lfile):
+        row = self._find_row(lfile.directory_id, lfile.name)
+        return row >= 0 and self._make_file(row) == lfile
+
+    def find(self, directory_id, name):
+        row = self._find_row(directory_id, name)
+        if row < 0:
+            return None
+
+        return self._make_file(row)
+
+    def add(self, lfile):
+        """
+        Add a file. A file with the same path is replaced.
+        """
+
+        try:
+            block_index = self._block_ids[lfile.block.name]
+        except KeyError:
+            block_index = self._block_ids[lfile.block.name] = len(self._blocks)
+            self._blocks.append(lfile.block)
+            self._block_rows.append(array.array('l'))
+        else:
+            self._blocks[block_index] = lfile.block
+
+        row = self._find_row(lfile.directory_id, lfile.name)
+        if row >= 0:
+            old_index = self._block_indices[row]
+            if old_index != block_index:
+                self._block_indices[row] = block_index
+                self._block_rows[block_index].append(row)
+                self._unlink_block_row(old_index, row)
+
+            self._sizes[row] = lfile.size
+            return
+
+        row = len(self._names)
+        self._block_rows[block_index].append(row)
+
+        self._names.append(lfile.name)
+        self._directory_ids.append(lfile.directory_id)
+        self._block_indices.append(block_index)
+        self._sizes.append(lfile.size)
+
+        self._register_row(lfile.name, row)
+
+        try:
+            self._directory_counts[lfile.directory_id] += 1
+        except KeyError:
+            self._directory_counts[lfile.directory_id] = 1
+            File.acquire_directory(lfile.directory_id)
+
+    def remove(self, lfile):
+        row = self._find_row(lfile.directory_id, lfile.name)
+        if row < 0:
+            raise KeyError(lfile)
+
+        self._remove_row(row)
+
+    def block_files(self, block):
+        """
+        Return the list of files of the block.
+        """
+
+        try:
+            block_index = self._block_ids[block.name]
+        except KeyError:
+            return []
+
+        return [self._make_file(row) for row in sorted(self._block_rows[block_index])]
+
+    def replace_block(self, old_block, new_block):
+        """
+        Point all files of old_block to new_block (same block name).
+        """
+
+        try:
+            block_index = self._block_ids[old_block.name]
+        except KeyError:
+            return
+
+        self._blocks[block_index] = new_block
+
+    def remove_block(self, block):
+        """
+        Remove all files of the block.
+        """
+
+        try:
+            block_index = self._block_ids[block.name]
+        except KeyError:
+            return
+
+        # descending order - rows moved into the freed slots are never ones still to be removed
+        # the block is dropped with its last row
+        for row in sorted(self._block_rows[block_index], reverse = True):
+            self._remove_row(row)
+
+    def clear(self):
+        """
+        Remove all files and release the directories.
+        """
+
+        for directory_id in self._directory_counts.iterkeys():
+            File.release_directory(directory_id)
+
+        self.__init__()
+
+    def _make_file(self, row):
+        return File(self._names[row], self._directory_ids[row], self._blocks[self._block_indices[row]], self._sizes[row])
+
+    def _unlink_block_row(self, block_index, row):
+        rows = self._block_rows[block_index]
+        if len(rows) == 1:
+            self._remove_block_index(block_index)
+            return
+
+        # rows are mostly appended in order and removed from the end
+        rows.pop(_rindex(rows, row))
+
+    def _remove_block_index(self, block_index):
+        self._block_ids.pop(self._blocks[block_index].name)
+
+        last = len(self._blocks) - 1
+        if block_index != last:
+            # move the last block into the freed slot
+            last_block = self._blocks[last]
+            self._blocks[block_index] = last_block
+            self._block_rows[block_index] = self._block_rows[last]
+            self._block_ids[last_block.name] = block_index
+
+            for row in self._block_rows[block_index]:
+                self._block_indices[row] = block_index
+
+        self._blocks.pop()
+        self._block_rows.pop()
+
+    def _find_row(self, directory_id, name):
+        try:
+            rows = self._rows[name]
+        except KeyError:
+            return -1
+
+        if type(rows) is not list:
+            rows = [rows]
+
+        for row in rows:
+            if self._directory_ids[row] == directory_id:
+                return row
+
+        return -1
+
+    def _register_row(self, name, row):
+        try:
+            rows = self._rows[name]
+        except KeyError:
+            self._rows[name] = row
+            return
+
+        if type(rows) is list:
+            rows.append(row)
+        else:
+            self._rows[name] = [rows, row]
+
+    def _unregister_row(self, name, row):
+        rows = self._rows[name]
+        if type(rows) is list:
+            rows.remove(row)
+            if len(rows) == 1:
+                self._rows[name] = rows[0]
+        else:
+            self._rows.pop(name)
+
+    def _remove_row(self, row):
+        name = self._names[row]
+        directory_id = self._directory_ids[row]
+
+        self._unregister_row(name, row)
+        self._unlink_block_row(self._block_indices[row], row)
+
+        last = len(self._names) - 1
+        if row != last:
+            # move the last row into the freed slot
+            last_name = self._names[last]
+            self._unregister_row(last_name, last)
+
+            last_block_rows = self._block_rows[self._block_indices[last]]
+            last_block_rows[_rindex(last_block_rows, last)] = row
+
+            self._names[row] = last_name
+            self._directory_ids[row] = self._directory_ids[last]
+            self._block_indices[row] = self._block_indices[last]
+            self._sizes[row] = self._sizes[last]
+
+            self._register_row(last_name, row)
+
+        self._names.pop()
+        self._directory_ids.pop()
+        self._block_indices.pop()
+        self._sizes.pop()
+
+        count = self._directory_counts[directory_id] - 1
+        if count == 0:
+            self._directory_counts.pop(directory_id)
+            File.release_directory(directory_id)
+        else:
+            self._directory_counts[directory_id] = count
+
+def _rindex(rows, row):
+    # index of row in the array rows, searched from the end
+    for index in xrange(len(rows) - 1, -1, -1):
+        if rows[index] == row:
+            return index
+
+    raise ValueError(row)
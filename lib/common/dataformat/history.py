@@ -3,6 +3,8 @@ import collections
 class HistoryRecord(object):
     """Represents a transaction history record."""
 
+    __slots__ = ['operation_type', 'operation_id', 'site_name', 'timestamp', 'approved', 'size', 'completed', 'replicas']
+
     # operation types
     OP_COPY, OP_DELETE = range(2)
 
@@ -12,7 +14,7 @@ class HistoryRecord(object):
     def __init__(self, operation_type, operation_id, site_name, timestamp = 0, approved = False, size = 0, completed = False, last_update = 0):
         self.operation_type = operation_type
         self.operation_id = operation_id
-        self.site_name = site_name
+        self.site_name = intern(site_name) if type(site_name) is str else site_name
         self.timestamp = timestamp
         self.approved = bool(approved)
         self.size = size
@@ -1,18 +1,63 @@
 import collections
+import threading
 
 File = collections.namedtuple('File', ['name', 'directory_id', 'block', 'size'])
 
 def _File_get_directory_id(path):
     directory = path[:path.rfind('/')]
+    # lookup of a known directory does not need the lock
     try:
-        directory_id = File.directory_ids[directory]
-    except:
-        directory_id = len(File.directories)
+        return File.directory_ids[directory]
+    except KeyError:
+        pass
+
+    with File._directory_lock:
+        try:
+            return File.directory_ids[directory]
+        except KeyError:
+            pass
+
+        if len(File._free_directory_ids) != 0:
+            directory_id = File._free_directory_ids.pop()
+            File.directories[directory_id] = directory
+        else:
+            directory_id = len(File.directories)
+            File.directories.append(directory)
+            File.directory_refcounts.append(0)
+
         File.directory_ids[directory] = directory_id
-        File.directories.append(directory)
 
     return directory_id
 
+def _File_acquire_directory(directory_id):
+    with File._directory_lock:
+        File.directory_refcounts[directory_id] += 1
+
+def _File_release_directory(directory_id):
+    with File._directory_lock:
+        File.directory_refcounts[directory_id] -= 1
+
+def _File_reclaim_directories():
+    """
+    Free the directories not used by any FileCatalog, so that their ids can be reused.
+    File tuples created before the call may point to a reclaimed directory. Call only when no such
+    object is in use (e.g. at the end of an inventory update).
+    Returns the number of reclaimed directories.
+    """
+
+    num_reclaimed = 0
+
+    with File._directory_lock:
+        for directory_id, refcount in enumerate(File.directory_refcounts):
+            directory = File.directories[directory_id]
+            if refcount == 0 and directory is not None:
+                File.directory_ids.pop(directory)
+                File.directories[directory_id] = None
+                File._free_directory_ids.append(directory_id)
+                num_reclaimed += 1
+
+    return num_reclaimed
+
 def _File_get_basename(path):
     return path[path.rfind('/') + 1:]
 
@@ -38,9 +83,17 @@ def _File_clone(self, **kwd):
         self.size if 'size' not in kwd else kwd['size']
     )
 
+# Directory registry shared by all files. Directories are counted by the FileCatalogs that use them.
+# Lookup and insertion are thread-safe.
 File.directories = []
 File.directory_ids = {}
+File.directory_refcounts = []
+File._free_directory_ids = []
+File._directory_lock = threading.Lock()
 File.get_directory_id = staticmethod(_File_get_directory_id)
+File.acquire_directory = staticmethod(_File_acquire_directory)
+File.release_directory = staticmethod(_File_release_directory)
+File.reclaim_directories = staticmethod(_File_reclaim_directories)
 File.get_basename = staticmethod(_File_get_basename)
 File.create = staticmethod(_File_create)
 File.fullpath = _File_fullpath
@@ -1,4 +1,9 @@
+from blockreplica import BlockReplica
+
 class Site(object):
+    __slots__ = ['name', 'host', 'storage_type', 'backend', 'storage', 'cpu', 'status', '_dataset_replicas', '_dataset_replica_index',
+        '_block_replicas', '_full_replicas', '_partition_quota', '_occupancy_projected', '_occupancy_physical']
+
     TYPE_DISK, TYPE_MSS, TYPE_BUFFER, TYPE_UNKNOWN = range(1, 5)
     STAT_READY, STAT_WAITROOM, STAT_MORGUE, STAT_UNKNOWN = range(1, 5)
 
@@ -68,26 +73,74 @@ class Site(object):
         """
         Defines storage partitioning.
         _partitioning: A function that takes a block replica and return whether the replica is in partition
+        index: Position of the partition in the occupancy and quota arrays of the sites
         """
 
-        def __init__(self, name, func):
+        def __init__(self, name, func, index):
             self.name = name
             self._partitioning = func
+            self.index = index
+            self.bit = 1 << index
 
         def __call__(self, replica):
-            return self._partitioning(replica)
+            return (Site.partition_mask(replica) & self.bit) != 0
 
     partitions = {} # name -> Partition
     _partitions_order = [] # list of partitions
 
+    # Partitioning functions only look at the group and the storage type of the site of a replica.
+    # The membership bitmask is therefore computed once per combination and cached.
+    _partition_masks = {} # (group, storage type) -> bitmask
+    _partition_indices = {} # bitmask -> tuple of partition indices
+
     # must be called before any Site is instantiated
     @staticmethod
     def set_partitions(config):
         for name, func in config:
-            partition = Site.Partition(name, func)
+            partition = Site.Partition(name, func, len(Site._partitions_order))
             Site.partitions[name] = partition
             Site._partitions_order.append(partition)
 
+        Site._partition_masks.clear()
+        Site._partition_indices.clear()
+
+    @staticmethod
+    def partition_mask(replica):
+        """
+        Return the bitmask of the partitions the block replica belongs to.
+        """
+
+        key = (replica.group, replica.site.storage_type)
+
+        try:
+            return Site._partition_masks[key]
+        except KeyError:
+            pass
+
+        mask = 0
+        for partition in Site._partitions_order:
+            if partition._partitioning(replica):
+                mask |= partition.bit
+
+        Site._partition_masks[key] = mask
+
+        return mask
+
+    @staticmethod
+    def partition_indices(mask):
+        """
+        Return the tuple of partition indices set in the bitmask.
+        """
+
+        try:
+            return Site._partition_indices[mask]
+        except KeyError:
+            pass
+
+        indices = tuple(p.index for p in Site._partitions_order if mask & p.bit)
+        Site._partition_indices[mask] = indices
+
+        return indices
 
     def __init__(self, name, host = '', storage_type = TYPE_DISK, backend = '', storage = 0., cpu = 0., status = STAT_UNKNOWN):
         self.name = name
@@ -100,7 +153,8 @@ class Site(object):
 
         self.dataset_replicas = set()
 
-        self._block_replicas = set()
+        self._block_replicas = {} # {block: block replica}; columnar block replicas are found through the dataset replica
+        self._full_replicas = {} # {dataset replica: (partition indices, size)} for replicas without materialized block replicas
 
         # Each block replica can have multiple owners but will always have one "accounting owner", whose quota the replica counts toward.
         # When the accounting owner disowns the replica, the software must reassign the ownership to another.
@@ -116,75 +170,178 @@ class Site(object):
         return 'Site(\'%s\', host=\'%s\', storage_type=%d, backend=\'%s\', storage=%d, cpu=%f, status=%d)' % \
             (self.name, self.host, self.storage_type, self.backend, self.storage, self.cpu, self.status)
 
+    @property
+    def dataset_replicas(self):
+        return self._dataset_replicas
+
+    @dataset_replicas.setter
+    def dataset_replicas(self, replicas):
+        # index is rebuilt whenever the set is replaced. Use add_ / remove_dataset_replica to modify the contents.
+        self._dataset_replicas = replicas
+        self._dataset_replica_index = dict((r.dataset, r) for r in replicas) # {dataset: dataset replica}
+
     def unlink(self):
         # unlink objects to avoid ref cycles - should be called when this site is absolutely not needed
         while True:
             try:
-                replica = self.dataset_replicas.pop()
+                replica = self._dataset_replicas.pop()
             except KeyError:
                 break
 
-            replica.dataset.replicas.remove(replica)
+            replica.dataset.remove_replica(replica)
+            # need to call remove before clearing the list for size accounting
+            self.remove_block_replicas(replica)
+
             replica.dataset = None
             replica.site = None
-            for block_replica in replica.block_replicas:
-                # need to call remove before clearing the set for size accounting
-                self.remove_block_replica(block_replica)
-
             replica.block_replicas = []
 
+        self.dataset_replicas = set()
         self._block_replicas.clear()
 
-    def find_dataset_replica(self, dataset):
-        # very inefficient operation
-        try:
-            if type(dataset).__name__ == 'Dataset':
-                return next(d for d in list(self.dataset_replicas) if d.dataset == dataset)
-            else:
-                return next(d for d in list(self.dataset_replicas) if d.dataset.name == dataset)
+    def add_dataset_replica(self, replica):
+        self._dataset_replicas.add(replica)
+        self._dataset_replica_index[replica.dataset] = replica
 
-        except StopIteration:
-            return None
+    def remove_dataset_replica(self, replica):
+        self._dataset_replicas.remove(replica)
+        if self._dataset_replica_index.get(replica.dataset) is replica:
+            self._dataset_replica_index.pop(replica.dataset)
+
+    def find_dataset_replica(self, dataset):
+        if type(dataset).__name__ == 'Dataset':
+            return self._dataset_replica_index.get(dataset)
+        else:
+            # lookup by name is only used by command-line tools
+            try:
+                return next(d for d in self._dataset_replicas if d.dataset.name == dataset)
+            except StopIteration:
+                return None
 
     def find_block_replica(self, block):
-        try:
-            if type(block).__name__ == 'Block':
-                return next(b for b in list(self._block_replicas) if b.block == block)
-            else:
-                return next(b for b in list(self._block_replicas) if b.block.name == block)
+        if type(block).__name__ == 'Block':
+            replica = self._block_replicas.get(block)
+            if replica is None:
+                dataset_replica = self._dataset_replica_index.get(block.dataset)
+                if dataset_replica in self._full_replicas or (dataset_replica is not None and dataset_replica.is_columnar()):
+                    # materializes the block replicas of a full dataset replica
+                    replica = dataset_replica.find_block_replica(block)
+
+            return replica
+        else:
+            # lookup by name is only used by command-line tools
+            try:
+                return next(b for b in self._block_replicas.itervalues() if b.block.name == block)
+            except StopIteration:
+                pass
+
+            for dataset_replica in self._dataset_replicas:
+                if dataset_replica.is_columnar():
+                    replica = dataset_replica.find_block_replica(block)
+                    if replica is not None:
+                        return replica
+
+            for dataset_replica in self._full_replicas.keys():
+                if dataset_replica.dataset.find_block(block) is not None:
+                    return dataset_replica.find_block_replica(block)
 
-        except StopIteration:
             return None
 
+    def _is_indexed(self, replica):
+        # block replicas kept in a BlockReplicaStore are not indexed by the site (see find_block_replica)
+        dataset_replica = self._dataset_replica_index.get(replica.block.dataset)
+        return dataset_replica is None or not dataset_replica.is_columnar()
+
     def add_block_replica(self, replica, partitions = None):
-        self._block_replicas.add(replica)
+        if self._is_indexed(replica):
+            try:
+                existing = self._block_replicas[replica.block]
+            except KeyError:
+                pass
+            else:
+                # one replica per block per site - replace the existing entry in the accounting
+                self.remove_block_replica(existing)
 
-        if partitions is None:
-            for ip, partition in enumerate(Site._partitions_order):
-                if partition(replica):
-                    self._occupancy_projected[ip] += replica.block.size
-                    self._occupancy_physical[ip] += replica.size
+            self._block_replicas[replica.block] = replica
 
+        if partitions is None:
+            indices = Site.partition_indices(Site.partition_mask(replica))
         else:
-            for partition in partitions:
-                ip = Site._partitions_order.index(partition)
-                self._occupancy_projected[ip] += replica.block.size
-                self._occupancy_physical[ip] += replica.size
+            indices = [p.index for p in partitions]
+
+        for ip in indices:
+            self._occupancy_projected[ip] += replica.block.size
+            self._occupancy_physical[ip] += replica.size
 
     def remove_block_replica(self, replica):
+        self._remove_block_replica(replica, self._is_indexed(replica))
+
+    def _remove_block_replica(self, replica, indexed):
+        if indexed:
+            try:
+                if self._block_replicas[replica.block] != replica:
+                    raise KeyError(replica.block)
+
+                self._block_replicas.pop(replica.block)
+
+            except KeyError:
+                print replica.site.name, replica.block.dataset.name, replica.block.name
+                raise
+
+        for ip in Site.partition_indices(Site.partition_mask(replica)):
+            self._occupancy_projected[ip] -= replica.block.size
+            self._occupancy_physical[ip] -= replica.size
+
+    def add_full_replica(self, replica):
+        """
+        Add the block replicas of a dataset replica in the implicit full representation (see DatasetReplica.set_full)
+        to the accounting as a whole.
+        """
+
+        # partitioning only looks at the group and the storage type - all block replicas of the dataset replica share the mask
+        mask = Site.partition_mask(BlockReplica(None, self, replica._implicit_group, True, replica.is_custodial, 0))
+        indices = Site.partition_indices(mask)
+        size = replica.dataset.size
+
+        self.remove_full_replica(replica)
+        self._full_replicas[replica] = (indices, size)
+
+        for ip in indices:
+            self._occupancy_projected[ip] += size
+            self._occupancy_physical[ip] += size
+
+    def remove_full_replica(self, replica):
+        """
+        Remove a dataset replica added with add_full_replica from the accounting. Return False if it was not added.
+        """
+
         try:
-            self._block_replicas.remove(replica)
-        except ValueError:
-            print replica.site.name, replica.block.dataset.name, replica.block.name
-            raise
+            indices, size = self._full_replicas.pop(replica)
+        except KeyError:
+            return False
+
+        for ip in indices:
+            self._occupancy_projected[ip] -= size
+            self._occupancy_physical[ip] -= size
+
+        return True
+
+    def remove_block_replicas(self, replica):
+        """
+        Remove all block replicas of a dataset replica from the accounting, without materializing them.
+        """
 
-        for ip, partition in enumerate(Site._partitions_order):
-            if partition(replica):
-                self._occupancy_projected[ip] -= replica.block.size
-                self._occupancy_physical[ip] -= replica.size
+        if replica.is_implicit():
+            self.remove_full_replica(replica)
+        else:
+            # the dataset replica may already be removed from the site
+            indexed = not replica.is_columnar()
+            for block_replica in replica.block_replicas:
+                self._remove_block_replica(block_replica, indexed)
 
     def clear_block_replicas(self):
         self._block_replicas.clear()
+        self._full_replicas.clear()
 
         for ip in xrange(len(Site.partitions)):
             self._occupancy_projected[ip] = 0
@@ -192,26 +349,27 @@ class Site(object):
 
     def set_block_replicas(self, replicas):
         self._block_replicas.clear()
-        self._block_replicas.update(replicas)
+        self._block_replicas.update((r.block, r) for r in replicas if self._is_indexed(r))
 
         for ip in xrange(len(Site.partitions)):
-            partition = Site._partitions_order[ip]
             self._occupancy_projected[ip] = 0
             self._occupancy_physical[ip] = 0
-            for replica in self._block_replicas:
-                if partition(replica):
-                    self._occupancy_projected[ip] += replica.block.size
-                    self._occupancy_physical[ip] += replica.size
 
-    def partition_quota(self, partition):
-        index = Site._partitions_order.index(partition)
+        for replica in replicas:
+            for ip in Site.partition_indices(Site.partition_mask(replica)):
+                self._occupancy_projected[ip] += replica.block.size
+                self._occupancy_physical[ip] += replica.size
 
-        return self._partition_quota[index]
+        for indices, size in self._full_replicas.itervalues():
+            for ip in indices:
+                self._occupancy_projected[ip] += size
+                self._occupancy_physical[ip] += size
 
-    def set_partition_quota(self, partition, quota):
-        index = Site._partitions_order.index(partition)
+    def partition_quota(self, partition):
+        return self._partition_quota[partition.index]
 
-        self._partition_quota[index] = quota
+    def set_partition_quota(self, partition, quota):
+        self._partition_quota[partition.index] = quota
 
     def storage_occupancy(self, partitions = [], physical = True):
         """
@@ -234,7 +392,7 @@ class Site(object):
             numer = 0.
             denom = 0.
             for partition in partitions:
-                index = Site._partitions_order.index(partition)
+                index = partition.index
 
                 denom += self._partition_quota[index]
                 if physical:
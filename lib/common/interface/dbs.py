@@ -49,7 +49,7 @@ class DBS(DatasetInfoSourceInterface):
                     if block is None:
                         block = Block(block_name, dataset = dataset, size = block_record['block_size'], num_files = block_record['file_count'], is_open = is_open)
                 
-                        dataset.blocks.append(block)
+                        dataset.add_block(block)
                         dataset.size += block.size
                         dataset.num_files += block.num_files
 
@@ -4,11 +4,16 @@ Generic MySQL interface (for an interface).
 
 import MySQLdb
 import MySQLdb.converters
+import MySQLdb.cursors
 import sys
+import os
+import tempfile
 import logging
 import time
 import re
 import traceback
+import threading
+import Queue
 
 import common.configuration as config
 
@@ -19,13 +24,121 @@ MySQLdb.converters.conversions[ListType] = MySQLdb.converters.escape_sequence
 
 logger = logging.getLogger(__name__)
 
+class MySQLConnectionPool(object):
+    """
+    Thread-safe pool of MySQLdb connections, keyed by the connection parameters. A checked-out connection belongs
+    exclusively to its user until it is checked back in. Checked-in connections are reset (table locks released,
+    transaction rolled back) and kept for reuse by any thread, up to config.mysql.pool_size per parameter set. A
+    connection idle for longer than config.mysql.pool_ping_interval is pinged before reuse and replaced if it is dead.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {} # {key: [(connection, checkin time)]}
+
+    def checkout(self, parameters):
+        """
+        Return an idle connection with the parameters, or a new one.
+        """
+
+        key = MySQLConnectionPool._key(parameters)
+
+        while True:
+            with self._lock:
+                try:
+                    connection, checkin_time = self._idle[key].pop()
+                except (KeyError, IndexError):
+                    break
+
+            if time.time() - checkin_time <= config.mysql.pool_ping_interval:
+                return connection
+
+            try:
+                connection.ping()
+            except MySQLdb.Error:
+                logger.info('Pooled MySQL connection is dead. Discarding.')
+                MySQLConnectionPool._close(connection)
+            else:
+                return connection
+
+        return MySQLdb.connect(**parameters)
+
+    def checkin(self, parameters, connection):
+        """
+        Return a connection obtained with checkout. The session is reset first; a connection that cannot be reset is
+        closed. Temporary tables are not seen by the pool and must be dropped by the user (see MySQL.close).
+        """
+
+        try:
+            cursor = connection.cursor()
+            try:
+                cursor.execute('UNLOCK TABLES')
+            finally:
+                cursor.close()
+
+            connection.rollback()
+        except MySQLdb.Error:
+            logger.info('Could not reset the session of a MySQL connection. Closing.')
+            MySQLConnectionPool._close(connection)
+            return
+
+        key = MySQLConnectionPool._key(parameters)
+
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < config.mysql.pool_size:
+                idle.append((connection, time.time()))
+                return
+
+        MySQLConnectionPool._close(connection)
+
+    def clear(self):
+        """
+        Close all idle connections.
+        """
+
+        with self._lock:
+            idle = self._idle
+            self._idle = {}
+
+        for connections in idle.itervalues():
+            for connection, _ in connections:
+                MySQLConnectionPool._close(connection)
+
+    @staticmethod
+    def _key(parameters):
+        return tuple(sorted(parameters.iteritems()))
+
+    @staticmethod
+    def _close(connection):
+        try:
+            connection.close()
+        except MySQLdb.Error:
+            pass
+
+
 class MySQL(object):
+    """
+    Connection to a MySQL database. Each object checks out its own connection from the shared MySQLConnectionPool and
+    returns it with close(). A closed object checks out a connection again when used. The connection of an object that
+    is deleted without close() is closed, as its session may be in any state.
+    The object tracks the table locks and temporary tables of its session. Statements failing while they are held are
+    not retried over a new connection, which would silently drop them.
+    """
+
+    pool = MySQLConnectionPool()
+
+    # statements that change the session state
+    _lock_tables = re.compile(r'\s*LOCK\s+TABLES?\s', re.I)
+    _unlock_tables = re.compile(r'\s*UNLOCK\s+TABLES?\s*$', re.I)
+    _create_temporary = re.compile(r'\s*CREATE\s+TEMPORARY\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?`?(\w+)', re.I)
+    _drop_temporary = re.compile(r'\s*DROP\s+TEMPORARY\s+TABLE\s+(?:IF\s+EXISTS\s+)?`?(\w+)', re.I)
 
     @staticmethod
     def escape_string(string):
         return MySQLdb.escape_string(string)
     
-    def __init__(self, host = '', user = '', passwd = '', config_file = '', config_group = '', db = ''):
+    def __init__(self, host = '', user = '', passwd = '', config_file = '', config_group = '', db = '', bulk_load = False):
         self._connection_parameters = {}
         if config_file:
             self._connection_parameters['read_default_file'] = config_file
@@ -38,14 +151,109 @@ class MySQL(object):
             self._connection_parameters['passwd'] = passwd
         if db:
             self._connection_parameters['db'] = db
+        if bulk_load:
+            # LOAD DATA LOCAL INFILE lets the server read client files; enabled only for connections that use load_many
+            self._connection_parameters['local_infile'] = 1
+
+        # set to False when the server refuses LOAD DATA LOCAL INFILE
+        self._bulk_load = bulk_load
+
+        # session state of the checked-out connection
+        self._locked = False
+        self._temporary_tables = set()
+        self._num_streams = 0 # open xquery cursors
+
+        # connect now so that connection errors surface at construction
+        self._checked_out = None
+        self._checked_out = MySQL.pool.checkout(self._connection_parameters)
+
+    def __del__(self):
+        # may be collected in the middle of any operation; the connection is not returned to the pool
+        try:
+            if self._checked_out is not None:
+                MySQLConnectionPool._close(self._checked_out)
+        except:
+            # the module may already be torn down at interpreter exit
+            pass
+
+    @property
+    def _connection(self):
+        if self._checked_out is None:
+            self._checked_out = MySQL.pool.checkout(self._connection_parameters)
+
+        return self._checked_out
+
+    def _reconnect(self, sql):
+        """
+        Replace the connection after an error in executing sql. Raise the error instead if the session holds table locks
+        or temporary tables, unless sql releases them.
+        """
+
+        if (self._locked or len(self._temporary_tables) != 0) and \
+                not (MySQL._unlock_tables.match(sql) or MySQL._drop_temporary.match(sql)):
+            # re-raise the OperationalError being handled
+            raise
+
+        # the old connection is not returned to the pool
+        if self._checked_out is not None:
+            MySQLConnectionPool._close(self._checked_out)
 
-        self._connection = MySQLdb.connect(**self._connection_parameters)
+        self._locked = False
+        self._temporary_tables.clear()
+
+        self._checked_out = MySQLdb.connect(**self._connection_parameters)
+
+    def _track_session(self, sql):
+        if MySQL._lock_tables.match(sql):
+            self._locked = True
+        elif MySQL._unlock_tables.match(sql):
+            self._locked = False
+        else:
+            match = MySQL._create_temporary.match(sql)
+            if match:
+                self._temporary_tables.add(match.group(1))
+                return
+
+            match = MySQL._drop_temporary.match(sql)
+            if match:
+                self._temporary_tables.discard(match.group(1))
 
     def db_name(self):
         return self._connection_parameters['db']
 
     def close(self):
-        self._connection.close()
+        """
+        Drop the temporary tables of the session and return the connection to the pool, which releases the table locks.
+        The connection is closed instead if an xquery stream is still open or the tables cannot be dropped.
+        """
+
+        connection = self._checked_out
+        if connection is None:
+            return
+
+        self._checked_out = None
+
+        temporary_tables = list(self._temporary_tables)
+        self._locked = False
+        self._temporary_tables.clear()
+
+        if self._num_streams != 0:
+            # the unread rows of the stream would be returned to the next user
+            MySQLConnectionPool._close(connection)
+            return
+
+        try:
+            cursor = connection.cursor()
+            try:
+                for table in temporary_tables:
+                    cursor.execute('DROP TEMPORARY TABLE IF EXISTS `%s`' % table)
+            finally:
+                cursor.close()
+        except MySQLdb.Error:
+            MySQLConnectionPool._close(connection)
+            return
+
+        MySQL.pool.checkin(self._connection_parameters, connection)
 
     def query(self, sql, *args):
         """
@@ -73,7 +281,7 @@ class MySQL(object):
                     last_except = sys.exc_info()[1]
                     # reconnect to server
                     cursor.close()
-                    self._connection = MySQLdb.connect(**self._connection_parameters)
+                    self._reconnect(sql)
                     cursor = self._connection.cursor()
     
             else: # 10 failures
@@ -86,6 +294,8 @@ class MySQL(object):
             logger.error(sys.exc_info()[1])
             raise
 
+        self._track_session(sql)
+
         result = cursor.fetchall()
 
         if cursor.description is None:
@@ -102,22 +312,133 @@ class MySQL(object):
         else:
             return list(result)
 
+    def xquery(self, sql, *args):
+        """
+        Execute a SELECT query and return a generator of the result rows, streamed from the server (SSCursor) instead of
+        being buffered in full. Rows are tuples, or values if one column is called. A failed execution is retried with
+        reconnection as in query(); errors after the first row is read are raised. The connection cannot be used for
+        other queries until the generator is exhausted or closed.
+        """
+
+        if logger.getEffectiveLevel() == logging.DEBUG:
+            if len(args) == 0:
+                logger.debug(sql)
+            else:
+                logger.debug(sql + ' % ' + str(args))
+
+        cursor = self._connection.cursor(MySQLdb.cursors.SSCursor)
+
+        try:
+            for attempt in range(10):
+                try:
+                    cursor.execute(sql, args)
+                    break
+                except MySQLdb.OperationalError:
+                    logger.error(str(sys.exc_info()[1]))
+                    last_except = sys.exc_info()[1]
+                    # nothing has been read yet - reconnect to server and retry
+                    cursor.close()
+                    self._reconnect(sql)
+                    cursor = self._connection.cursor(MySQLdb.cursors.SSCursor)
+    
+            else: # 10 failures
+                logger.error('Too many OperationalErrors. Last exception:')
+                raise last_except
+
+        except:
+            logger.error('There was an error executing the following statement:')
+            logger.error(sql[:10000])
+            logger.error(sys.exc_info()[1])
+            cursor.close()
+            raise
+
+        self._num_streams += 1
+
+        try:
+            if cursor.description is not None and len(cursor.description) == 1:
+                # single column requested
+                for row in cursor:
+                    yield row[0]
+            else:
+                for row in cursor:
+                    yield row
+        finally:
+            # reads out the remaining rows if the generator is closed early
+            cursor.close()
+            self._num_streams -= 1
+
+    def query_in_parallel(self, queries, num_connections):
+        """
+        Execute SELECT queries concurrently over up to num_connections pooled connections with the parameters of this
+        connection. Results are fetched by the worker threads while the caller consumes the ones already available.
+        If num_connections is 1 or less, the queries are executed serially over this connection and the rows are streamed
+        (the rows of each query must be read before the next query result is requested).
+        Return a generator of (query index, iterable of row tuples) in the order of completion.
+        """
+
+        if num_connections <= 1 or len(queries) <= 1:
+            for index, sql in enumerate(queries):
+                yield index, self.xquery(sql)
+
+            return
+
+        tasks = Queue.Queue()
+        for index, sql in enumerate(queries):
+            tasks.put((index, sql))
+
+        results = Queue.Queue()
+
+        def run_queries():
+            try:
+                connection = MySQL.pool.checkout(self._connection_parameters)
+            except:
+                results.put((-1, sys.exc_info()))
+                return
+
+            failed = False
+            try:
+                cursor = connection.cursor()
+                while True:
+                    try:
+                        index, sql = tasks.get_nowait()
+                    except Queue.Empty:
+                        break
+
+                    if logger.getEffectiveLevel() == logging.DEBUG:
+                        logger.debug(sql)
+
+                    cursor.execute(sql)
+                    results.put((index, list(cursor.fetchall())))
+
+            except:
+                results.put((-1, sys.exc_info()))
+                failed = True
+
+            finally:
+                if failed:
+                    # the session state is unknown
+                    MySQLConnectionPool._close(connection)
+                else:
+                    MySQL.pool.checkin(self._connection_parameters, connection)
+
+        for _ in range(min(num_connections, len(queries))):
+            worker = threading.Thread(target = run_queries)
+            worker.daemon = True
+            worker.start()
+
+        for _ in range(len(queries)):
+            index, result = results.get()
+            if index < 0:
+                logger.error('There was an error executing a parallel query:')
+                logger.error(result[1])
+                raise result[0], result[1], result[2]
+
+            yield index, result
+
     def execute_many(self, sqlbase, key, pool, additional_conditions = [], exec_on_match = True, order_by = ''):
         result = []
 
-        if type(key) is tuple:
-            key_str = '(' + ','.join('`%s`' % k for k in key) + ')'
-        else:
-            key_str = '`%s`' % key
-
-        sqlbase += ' WHERE '
-        for add in additional_conditions:
-            sqlbase += add + ' AND '
-        sqlbase += key_str
-        if exec_on_match:
-            sqlbase += ' IN '
-        else:
-            sqlbase += ' NOT IN '
+        sqlbase = self._make_many_sql(sqlbase, key, additional_conditions, exec_on_match)
 
         def execute(pool_expr):
             sql = sqlbase + pool_expr
@@ -133,15 +454,26 @@ class MySQL(object):
         return result
 
     def select_many(self, table, fields, key, pool, additional_conditions = [], select_match = True, order_by = ''):
-        if type(fields) is str:
-            fields_str = '`%s`' % fields
-        else:
-            fields_str = ','.join('`%s`' % f for f in fields)
-
-        sqlbase = 'SELECT {fields} FROM `{table}`'.format(fields = fields_str, table = table)
+        sqlbase = self._make_select_sql(table, fields)
 
         return self.execute_many(sqlbase, key, pool, additional_conditions, select_match, order_by = order_by)
 
+    def xselect_many(self, table, fields, key, pool, additional_conditions = [], select_match = True, order_by = ''):
+        """
+        Generator version of select_many. The rows of each batch are streamed with xquery; order_by applies within
+        each batch.
+        """
+
+        sqlbase = self._make_many_sql(self._make_select_sql(table, fields), key, additional_conditions, select_match)
+
+        for pool_expr in self._make_pool_expressions(pool):
+            sql = sqlbase + pool_expr
+            if order_by:
+                sql += ' ORDER BY ' + order_by
+
+            for row in self.xquery(sql):
+                yield row
+
     def delete_many(self, table, key, pool, additional_conditions = [], delete_match = True):
         sqlbase = 'DELETE FROM `{table}`'.format(table = table)
 
@@ -173,24 +505,133 @@ class MySQL(object):
         template = '(' + ','.join(['%s'] * len(fields)) + ')'
         # template = (%s, %s, ...)
 
-        values = ''
+        values = []
+        query_len = 0
         for obj in objects:
-            if mapping is None:
-                values += template % MySQLdb.escape(obj, MySQLdb.converters.conversions)
-            else:
-                values += template % MySQLdb.escape(mapping(obj), MySQLdb.converters.conversions)
-            
+            if mapping is not None:
+                obj = mapping(obj)
+
+            value = template % MySQLdb.escape(obj, MySQLdb.converters.conversions)
+            values.append(value)
+            query_len += len(value) + 1
+
             # MySQL allows queries up to 1M characters
-            if len(values) > config.mysql.max_query_len or obj == objects[-1]:
-                if logger.getEffectiveLevel() == logging.DEBUG:
-                    logger.debug(sqlbase % values)
+            if query_len > config.mysql.max_query_len or len(values) == config.mysql.insert_chunk_rows:
+                self.query(sqlbase % ','.join(values))
+                values = []
+                query_len = 0
 
-                self.query(sqlbase % values)
+        if len(values) != 0:
+            self.query(sqlbase % ','.join(values))
 
-                values = ''
+    def load_many(self, table, fields, mapping, objects, do_update = True):
+        """
+        Bulk version of insert_many for connections created with bulk_load = True. The rows are streamed into a
+        tab-separated temporary file, which is loaded with LOAD DATA LOCAL INFILE. With do_update, the file is loaded
+        into a temporary table and merged with INSERT ... SELECT ... ON DUPLICATE KEY UPDATE. As with insert_many,
+        duplicate keys without do_update and values that do not convert raise an exception (the server only reports
+        them as warnings for LOAD DATA LOCAL).
+        Short lists (config.mysql.bulk_load_min_rows), or a server that refuses LOAD DATA LOCAL, fall back to
+        insert_many.
+        """
 
-            else:
-                values += ','
+        if len(objects) == 0:
+            return
+
+        if not self._bulk_load or len(objects) < config.mysql.bulk_load_min_rows:
+            self.insert_many(table, fields, mapping, objects, do_update = do_update)
+            return
+
+        fd, path = tempfile.mkstemp(prefix = 'dynamo_load_', suffix = '.tsv')
+        try:
+            with os.fdopen(fd, 'w') as tsv:
+                for obj in objects:
+                    if mapping is not None:
+                        obj = mapping(obj)
+
+                    tsv.write('\t'.join(MySQL._tsv_field(v) for v in obj))
+                    tsv.write('\n')
+
+            fields_str = ','.join(['`%s`' % f for f in fields])
+
+            if do_update:
+                tmp_table = '%s_load_tmp' % table
+                self.query('DROP TEMPORARY TABLE IF EXISTS `%s`' % tmp_table)
+                self.query('CREATE TEMPORARY TABLE `{tmp}` SELECT {fields} FROM `{table}` LIMIT 0'.format(tmp = tmp_table, fields = fields_str, table = table))
+
+                try:
+                    if not self._load_file(path, tmp_table, fields_str):
+                        self.insert_many(table, fields, mapping, objects, do_update = do_update)
+                        return
+
+                    sql = 'INSERT INTO `{table}` ({fields}) SELECT {fields} FROM `{tmp}`'.format(table = table, fields = fields_str, tmp = tmp_table)
+                    sql += ' ON DUPLICATE KEY UPDATE ' + ','.join(['`{f}`=VALUES(`{f}`)'.format(f = f) for f in fields])
+                    self.query(sql)
+
+                finally:
+                    self.query('DROP TEMPORARY TABLE IF EXISTS `%s`' % tmp_table)
+
+            elif not self._load_file(path, table, fields_str):
+                self.insert_many(table, fields, mapping, objects, do_update = do_update)
+
+        finally:
+            os.unlink(path)
+
+    def _load_file(self, path, table, fields_str):
+        """
+        Execute LOAD DATA LOCAL INFILE. Return False if the server or the client library does not allow it.
+        Not executed through query(): the error must not trigger reconnections. Warnings of the load are raised as
+        the errors INSERT would have raised.
+        """
+
+        sql = 'LOAD DATA LOCAL INFILE \'%s\' INTO TABLE `%s` (%s)' % (MySQLdb.escape_string(path), table, fields_str)
+
+        if logger.getEffectiveLevel() == logging.DEBUG:
+            logger.debug(sql)
+
+        cursor = self._connection.cursor()
+        try:
+            try:
+                cursor.execute(sql)
+            except (MySQLdb.OperationalError, MySQLdb.InternalError) as ex:
+                # ER_NOT_ALLOWED_COMMAND, ER_CLIENT_LOCAL_FILES_DISABLED, CR_LOAD_DATA_LOCAL_INFILE_REJECTED
+                if ex.args[0] not in (1148, 3948, 2068):
+                    raise
+
+                logger.warning('LOAD DATA LOCAL INFILE is not allowed (%s). Falling back to INSERT.', ex.args[1])
+                self._bulk_load = False
+                return False
+
+            # LOCAL implies IGNORE: duplicate keys are skipped and conversion errors are truncated, with warnings
+            cursor.execute('SHOW WARNINGS')
+            warnings = [(code, message) for level, code, message in cursor.fetchall() if level != 'Note']
+            if len(warnings) != 0:
+                code, message = warnings[0]
+                if code == 1062: # ER_DUP_ENTRY
+                    raise MySQLdb.IntegrityError(code, message)
+                else:
+                    raise MySQLdb.DataError(code, message)
+
+        finally:
+            cursor.close()
+
+        return True
+
+    @staticmethod
+    def _tsv_field(value):
+        # LOAD DATA default format: tab-separated, backslash escapes, \N for NULL
+        if value is None:
+            return '\\N'
+        elif type(value) is bool:
+            return '1' if value else '0'
+        elif type(value) is float:
+            return repr(value)
+        elif type(value) is unicode:
+            value = value.encode('utf-8')
+        elif type(value) is not str:
+            return str(value)
+
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
 
     def make_snapshot(self, tag):
         snapshot_db = self.db_name() + '_' + tag
@@ -254,22 +695,28 @@ class MySQL(object):
         the pool of rows to run execute on.
         """
 
+        for pool_expr in self._make_pool_expressions(pool):
+            execute(pool_expr)
+
+    def _make_pool_expressions(self, pool):
+        """
+        Generate the IN-list expressions for the pool (see _execute_in_batches).
+        """
+
         if type(pool) is tuple:
             if len(pool) == 2:
-                execute('(SELECT `%s` FROM `%s`)' % pool)
+                yield '(SELECT `%s` FROM `%s`)' % pool
 
             elif len(pool) == 3:
-                execute('(SELECT `%s` FROM `%s` WHERE %s)' % pool)
+                yield '(SELECT `%s` FROM `%s` WHERE %s)' % pool
 
             elif len(pool) == 4:
                 # nested pool: the fourth element is the pool argument
-                def nested_execute(expr):
+                for expr in self._make_pool_expressions(pool[3]):
                     pool_expr = '(SELECT `%s` FROM `%s` WHERE `%s` IN ' % pool[:3]
                     pool_expr += expr
                     pool_expr += ')'
-                    execute(pool_expr)
-
-                self._execute_in_batches(nested_execute, pool[3])
+                    yield pool_expr
 
         elif type(pool) is list:
             # need to repeat in case pool is a long list
@@ -292,10 +739,35 @@ class MySQL(object):
                 pool_expr += ','.join(items)
                 pool_expr += ')'
     
-                execute(pool_expr)
+                yield pool_expr
 
         elif type(pool) is str:
-            execute(pool)
+            yield pool
+
+    def _make_select_sql(self, table, fields):
+        if type(fields) is str:
+            fields_str = '`%s`' % fields
+        else:
+            fields_str = ','.join('`%s`' % f for f in fields)
+
+        return 'SELECT {fields} FROM `{table}`'.format(fields = fields_str, table = table)
+
+    def _make_many_sql(self, sqlbase, key, additional_conditions, match):
+        if type(key) is tuple:
+            key_str = '(' + ','.join('`%s`' % k for k in key) + ')'
+        else:
+            key_str = '`%s`' % key
+
+        sqlbase += ' WHERE '
+        for add in additional_conditions:
+            sqlbase += add + ' AND '
+        sqlbase += key_str
+        if match:
+            sqlbase += ' IN '
+        else:
+            sqlbase += ' NOT IN '
+
+        return sqlbase
 
     def table_exists(self, table):
         return len(self.query('SELECT * FROM `information_schema`.`tables` WHERE `table_schema` = %s AND `table_name` = %s LIMIT 1', self.db_name(), table)) != 0
@@ -20,7 +20,7 @@ class MySQLHistory(TransactionHistoryInterface):
     def __init__(self):
         super(self.__class__, self).__init__()
 
-        self._mysql = MySQL(**config.mysqlhistory.db_params)
+        self._mysql = MySQL(bulk_load = config.mysql.bulk_load, **config.mysqlhistory.db_params)
 
         self._site_id_map = {}
         self._dataset_id_map = {}
@@ -111,7 +111,7 @@ class MySQLHistory(TransactionHistoryInterface):
 
         self._mysql.query('INSERT INTO `copy_requests` (`id`, `run_id`, `timestamp`, `approved`, `site_id`, `size`) VALUES (%s, %s, NOW(), %s, %s, %s)', operation_id, run_number, approved, self._site_id_map[site.name], size)
 
-        self._mysql.insert_many('copied_replicas', ('copy_id', 'dataset_id'), lambda d: (operation_id, self._dataset_id_map[d.name]), dataset_list)
+        self._mysql.load_many('copied_replicas', ('copy_id', 'dataset_id'), lambda d: (operation_id, self._dataset_id_map[d.name]), dataset_list)
 
     def _do_make_deletion_entry(self, run_number, site, operation_id, approved, datasets, size): #override
         """
@@ -124,7 +124,7 @@ class MySQLHistory(TransactionHistoryInterface):
 
         self._mysql.query('INSERT INTO `deletion_requests` (`id`, `run_id`, `timestamp`, `approved`, `site_id`, `size`) VALUES (%s, %s, NOW(), %s, %s, %s)', operation_id, run_number, approved, site_id, size)
 
-        self._mysql.insert_many('deleted_replicas', ('deletion_id', 'dataset_id'), lambda did: (operation_id, did), dataset_ids)
+        self._mysql.load_many('deleted_replicas', ('deletion_id', 'dataset_id'), lambda did: (operation_id, did), dataset_ids)
 
     def _do_update_copy_entry(self, copy_record): #override
         self._mysql.query('UPDATE `copy_requests` SET `approved` = %s, `size` = %s, `completed` = %s WHERE `id` = %s', copy_record.approved, copy_record.size, copy_record.completed, copy_record.operation_id)
@@ -142,7 +142,7 @@ class MySQLHistory(TransactionHistoryInterface):
                 sites_to_insert.append(site_name)
 
         if len(sites_to_insert) != 0:
-            self._mysql.insert_many('sites', ('name',), lambda n: (n,), sites_to_insert)
+            self._mysql.load_many('sites', ('name',), lambda n: (n,), sites_to_insert)
             self._make_site_id_map()        
 
         sites_in_record = set()
@@ -209,7 +209,7 @@ class MySQLHistory(TransactionHistoryInterface):
         if len(datasets_to_insert) == 0:
             return
 
-        self._mysql.insert_many('datasets', ('name',), lambda n: (n,), datasets_to_insert)
+        self._mysql.load_many('datasets', ('name',), lambda n: (n,), datasets_to_insert)
         self._make_dataset_id_map()
 
     def _do_save_quotas(self, run_number, quotas): #override
@@ -310,7 +310,7 @@ class MySQLHistory(TransactionHistoryInterface):
 
         fields = ('site_id', 'dataset_id', 'partition_id', 'run_id', 'size')
         mapping = lambda (site_id, dataset_id, size): (site_id, dataset_id, partition_id, run_number, size)
-        self._mysql.insert_many('replica_size_snapshots', fields, mapping, insertions)
+        self._mysql.load_many('replica_size_snapshots', fields, mapping, insertions)
 
         # deletion decisions
         decisions = {}
@@ -354,7 +354,7 @@ class MySQLHistory(TransactionHistoryInterface):
 
         fields = ('site_id', 'dataset_id', 'partition_id', 'run_id', 'decision', 'matched_condition')
         mapping = lambda (site_id, dataset_id, decision, condition_id): (site_id, dataset_id, partition_id, run_number, decision, condition_id)
-        self._mysql.insert_many('deletion_decisions', fields, mapping, insertions)
+        self._mysql.load_many('deletion_decisions', fields, mapping, insertions)
 
         # now fill the cache
         self._fill_snapshot_cache(run_number)
@@ -428,7 +428,7 @@ class MySQLHistory(TransactionHistoryInterface):
 
         fields = ('run_id', 'dataset_id', 'popularity')
         mapping = lambda dataset: (run_number, self._dataset_id_map[dataset.name], dataset.demand['request_weight'] if 'request_weight' in dataset.demand else 0.)
-        self._mysql.insert_many('dataset_popularity_snapshots', fields, mapping, datasets)
+        self._mysql.load_many('dataset_popularity_snapshots', fields, mapping, datasets)
 
     def _do_get_incomplete_copies(self, partition): #override
         query = 'SELECT h.`id`, UNIX_TIMESTAMP(h.`timestamp`), h.`approved`, s.`name`, h.`size`'
@@ -23,6 +23,19 @@ class MySQLReplicaLock(object):
     def update(self, inventory):
         entries = self._mysql.query('SELECT `item`, `sites`, `groups` FROM `detox_locks` WHERE `unlock_date` IS NULL')
 
+        # load the blocks of all locked datasets at once
+        locked_datasets = set()
+        for item_name, sites_pattern, groups_pattern in entries:
+            try:
+                dataset = inventory.datasets[item_name.partition('#')[0]]
+            except KeyError:
+                continue
+
+            if dataset.replicas is not None:
+                locked_datasets.add(dataset)
+
+        inventory.prefetch_blocks(locked_datasets)
+
         for item_name, sites_pattern, groups_pattern in entries:
             if '#' in item_name:
                 dataset_name, block_real_name = item_name.split('#')
@@ -39,9 +52,6 @@ class MySQLReplicaLock(object):
             if dataset.replicas is None:
                 continue
 
-            if dataset.blocks is None:
-                inventory.store.load_blocks(dataset)
-
             if block_real_name is None:
                 blocks = list(dataset.blocks)
             else:
@@ -79,7 +89,7 @@ class MySQLReplicaLock(object):
             if len(groups) == 0:
                 # if no group matches the pattern, we will be on the safe side and treat it as a global lock
                 for replica in dataset.replicas:
-                    groups.update(brep.group for brep in replica.block_replicas)
+                    groups.update(brep.group for brep in replica.iter_block_replicas())
 
             try:
                 locked_blocks = dataset.demand['locked_blocks']
@@ -93,7 +103,7 @@ class MySQLReplicaLock(object):
                 if replica.site not in locked_blocks:
                     locked_blocks[replica.site] = set()
 
-                for block_replica in replica.block_replicas:
+                for block_replica in replica.iter_block_replicas():
                     if block_replica.group not in groups:
                         continue
 
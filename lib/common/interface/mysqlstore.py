@@ -22,10 +22,31 @@ class MySQLStore(LocalStoreInterface):
     def __init__(self):
         super(self.__class__, self).__init__()
 
-        self._mysql = MySQL(**config.mysqlstore.db_params)
+        self._mysql = MySQL(bulk_load = config.mysql.bulk_load, **config.mysqlstore.db_params)
 
         self.last_update = self._mysql.query('SELECT UNIX_TIMESTAMP(`last_update`) FROM `system`')[0] # MySQL displays last_update in local time, but returns the UTC timestamp
 
+        # {dataset name: (id, size, num_files, status, on_tape, data_type, software_version_id, last_update, is_open)}
+        # Table rows of the datasets as of the last load or save. Valid while the table last_update is at the stamp.
+        self._dataset_entries = {}
+        self._dataset_entries_stamp = None
+        self._dataset_entries_saved = False
+
+        # {snapshot db: {table: [state, max_id]}} of the copy-on-write snapshots sharing tables with the store.
+        # Loaded at the first write after each lock acquisition.
+        self._snapshot_states = None
+
+        # Write-through name -> id caches of sites, groups, and datasets, and {dataset_id: {block name: block_id}}.
+        # Valid while the system last_update is _id_cache_stamp; checked whenever the store lock is acquired.
+        self._id_cache = {'sites': {}, 'groups': {}, 'datasets': {}}
+        self._block_id_cache = {}
+        self._id_cache_stamp = None
+
+        # databases created before the column was added (see etc/db/upgrade_replicas_last_update.sql)
+        self._has_replicas_last_update = (len(self._mysql.query('SHOW COLUMNS FROM `system` LIKE \'replicas_last_update\'')) != 0)
+        if not self._has_replicas_last_update:
+            logger.warning('Column system.replicas_last_update does not exist. Incremental updates are disabled.')
+
     def _do_acquire_lock(self, blocking): #override
         while True:
             # Use the system table to "software-lock" the database
@@ -38,6 +59,10 @@ class MySQLStore(LocalStoreInterface):
 
             if host == socket.gethostname() and pid == os.getpid():
                 # The database is locked.
+                # snapshots may have been made or removed by other processes
+                self._snapshot_states = None
+                # the caches are valid until the lock is released; check once per locked operation
+                self._validate_id_cache()
                 break
 
             if blocking:
@@ -64,15 +89,31 @@ class MySQLStore(LocalStoreInterface):
             raise LocalStoreInterface.LockError('Failed to release lock from ' + socket.gethostname() + ':' + str(os.getpid()))
 
     def _do_make_snapshot(self, tag, clear): #override
+        """
+        Without clear, and with config.mysqlstore.lazy_snapshots, make a copy-on-write snapshot: only the system table is
+        copied, and the other tables are shared with the store until they are written (see _snapshot_table and
+        _snapshot_rows). The state of each table is kept in the snapshot_tables table of the snapshot database.
+        """
+
+        if clear == LocalStoreInterface.CLEAR_NONE and config.mysqlstore.lazy_snapshots:
+            self._make_lazy_snapshot(tag)
+            return
+
+        tables = self._mysql.query('SHOW TABLES')
+
+        # the tables are modified below; other snapshots need their own copies
+        if clear != LocalStoreInterface.CLEAR_NONE:
+            for table in tables:
+                self._snapshot_table(table)
+
         new_db = self._mysql.make_snapshot(tag)
         
         self._mysql.query('UPDATE `%s`.`system` SET `lock_host` = \'\', `lock_process` = 0' % new_db)
 
-        tables = []
-        if clear == LocalStoreInterface.CLEAR_ALL:
-            tables = self._mysql.query('SHOW TABLES')
-        elif clear == LocalStoreInterface.CLEAR_REPLICAS:
+        if clear == LocalStoreInterface.CLEAR_REPLICAS:
             tables = ['dataset_replicas', 'block_replicas', 'block_replica_sizes']
+        elif clear != LocalStoreInterface.CLEAR_ALL:
+            tables = []
 
         for table in tables:
             if table == 'system':
@@ -81,12 +122,44 @@ class MySQLStore(LocalStoreInterface):
             # drop the original table and copy back the format from the snapshot
             self._mysql.query('TRUNCATE TABLE `{orig}`.`{table}`'.format(orig = self._mysql.db_name(), table = table))
 
+    def _make_lazy_snapshot(self, tag):
+        db = self._mysql.db_name()
+        snapshot_db = db + '_' + tag
+
+        self._mysql.query('CREATE DATABASE `%s`' % snapshot_db)
+        self._mysql.query('CREATE TABLE `%s`.`snapshot_tables` (`name` varchar(64) NOT NULL, `state` enum(\'shared\',\'rows\',\'full\') NOT NULL, `max_id` bigint(20) DEFAULT NULL, PRIMARY KEY (`name`)) ENGINE=MyISAM DEFAULT CHARSET=latin1' % snapshot_db)
+
+        # rows inserted into these tables after the snapshot have ids above max_id and need no copy
+        auto_increment_tables = self._mysql.query('SELECT `table_name` FROM `information_schema`.`columns` WHERE `table_schema` = %s AND `column_name` = \'id\' AND `extra` LIKE \'%%auto_increment%%\'', db)
+
+        for table in self._mysql.query('SHOW TABLES'):
+            self._mysql.query('CREATE TABLE `{copy}`.`{table}` LIKE `{orig}`.`{table}`'.format(copy = snapshot_db, orig = db, table = table))
+
+            if table == 'system':
+                self._mysql.query('INSERT INTO `{copy}`.`{table}` SELECT * FROM `{orig}`.`{table}`'.format(copy = snapshot_db, orig = db, table = table))
+                self._mysql.query('UPDATE `%s`.`system` SET `lock_host` = \'\', `lock_process` = 0' % snapshot_db)
+                self._mysql.query('INSERT INTO `%s`.`snapshot_tables` VALUES (%%s, \'full\', NULL)' % snapshot_db, table)
+
+            elif table in auto_increment_tables:
+                max_id = self._mysql.query('SELECT MAX(`id`) FROM `%s`' % table)[0]
+                if max_id is None:
+                    max_id = 0
+
+                self._mysql.query('INSERT INTO `%s`.`snapshot_tables` VALUES (%%s, \'shared\', %%s)' % snapshot_db, table, max_id)
+
+            else:
+                self._mysql.query('INSERT INTO `%s`.`snapshot_tables` VALUES (%%s, \'shared\', NULL)' % snapshot_db, table)
+
+        self._snapshot_states = None
+
     def _do_remove_snapshot(self, tag, newer_than, older_than): #override
         if tag:
             self._mysql.remove_snapshot(tag = tag)
         else:
             self._mysql.remove_snapshot(newer_than = newer_than, older_than = older_than)
 
+        self._snapshot_states = None
+
     def _do_list_snapshots(self, timestamp_only):
         return self._mysql.list_snapshots(timestamp_only)
 
@@ -94,23 +167,238 @@ class MySQLStore(LocalStoreInterface):
         tables = self._mysql.query('SHOW TABLES')
         tables.remove('system')
 
+        self._clear_id_cache()
+
         for table in tables:
+            self._snapshot_table(table)
+
             # drop the original table and copy back the format from the snapshot
             self._mysql.query('TRUNCATE TABLE `{orig}`.`{table}`'.format(orig = self._mysql.db_name(), table = table))
 
     def _do_recover_from(self, tag): #override
-        self._mysql.recover_from(tag)
+        db = self._mysql.db_name()
+        snapshot_db = db + '_' + tag
+
+        states = self._get_snapshot_states()
+        # the snapshot stays valid through the recovery and must not receive copies of the tables
+        source_states = states.pop(snapshot_db, {})
+
+        self._clear_id_cache()
+
+        try:
+            if len(self._mysql.query('SHOW TABLES FROM `%s` LIKE \'snapshot_tables\'' % snapshot_db)) == 0:
+                # full copy
+                for table in self._mysql.query('SHOW TABLES'):
+                    self._snapshot_table(table)
+
+                self._mysql.recover_from(tag)
+                return
+
+            current_tables = self._mysql.query('SHOW TABLES')
+            snapshot_tables = self._mysql.query('SELECT `name`, `state`, `max_id` FROM `%s`.`snapshot_tables`' % snapshot_db)
+
+            for table, state, max_id in snapshot_tables:
+                self._snapshot_table(table)
+
+                if table not in current_tables:
+                    if state != 'full':
+                        logger.warning('Table %s was dropped after snapshot %s. Its content cannot be recovered.', table, tag)
+
+                    self._mysql.query('CREATE TABLE `{current}`.`{table}` LIKE `{snapshot}`.`{table}`'.format(current = db, snapshot = snapshot_db, table = table))
+                    state = 'full'
+
+                if state == 'full':
+                    self._mysql.query('TRUNCATE TABLE `%s`.`%s`' % (db, table))
+                    self._mysql.query('INSERT INTO `{current}`.`{table}` SELECT * FROM `{snapshot}`.`{table}`'.format(current = db, snapshot = snapshot_db, table = table))
+                    continue
+
+                if state == 'rows':
+                    # remove the rows written after the snapshot and put back their old versions
+                    key_columns = [column[0] for column in self._mysql.query('SHOW COLUMNS FROM `%s`.`%s__keys`' % (snapshot_db, table))]
+                    join = ' AND '.join('t.`{c}` = k.`{c}`'.format(c = c) for c in key_columns)
+                    self._mysql.query('DELETE t FROM `{current}`.`{table}` AS t INNER JOIN `{snapshot}`.`{table}__keys` AS k ON {join}'.format(current = db, snapshot = snapshot_db, table = table, join = join))
+                    self._mysql.query('INSERT INTO `{current}`.`{table}` SELECT * FROM `{snapshot}`.`{table}`'.format(current = db, snapshot = snapshot_db, table = table))
+
+                if max_id is not None:
+                    # rows inserted after the snapshot
+                    self._mysql.query('DELETE FROM `%s`.`%s` WHERE `id` > %d' % (db, table, max_id))
+
+            snapshot_table_names = set(table for table, _, _ in snapshot_tables)
+            for table in current_tables:
+                if table not in snapshot_table_names:
+                    self._snapshot_table(table)
+                    self._mysql.query('DROP TABLE `%s`.`%s`' % (db, table))
+
+        finally:
+            if len(source_states) != 0:
+                states[snapshot_db] = source_states
 
     def _do_switch_snapshot(self, tag): #override
         snapshot_name = self._mysql.db_name() + '_' + tag
 
+        # a copy-on-write snapshot needs its own copies of all tables to be used as a store
+        states = self._get_snapshot_states()
+        if snapshot_name in states:
+            for table, (state, max_id) in states.pop(snapshot_name).items():
+                self._copy_to_snapshot(snapshot_name, table, state, max_id)
+
         self._mysql.query('USE ' + snapshot_name)
 
+        self._clear_id_cache()
+
+    def _get_snapshot_states(self):
+        if self._snapshot_states is not None:
+            return self._snapshot_states
+
+        self._snapshot_states = {}
+
+        prefix = self._mysql.db_name() + '_'
+        for database in self._mysql.query('SHOW DATABASES'):
+            if not database.startswith(prefix):
+                continue
+
+            if len(self._mysql.query('SHOW TABLES FROM `%s` LIKE \'snapshot_tables\'' % database)) == 0:
+                # full copy
+                continue
+
+            tables = {}
+            for table, state, max_id in self._mysql.query('SELECT `name`, `state`, `max_id` FROM `%s`.`snapshot_tables` WHERE `state` != \'full\'' % database):
+                tables[table] = [state, max_id]
+
+            if len(tables) != 0:
+                self._snapshot_states[database] = tables
+
+        return self._snapshot_states
+
+    def _snapshot_table(self, table):
+        """
+        Called before a table is modified in a way that cannot be expressed as a list of keys. Snapshots still sharing the
+        table receive a full copy of its content at the time of the snapshot.
+        """
+
+        for snapshot_db, tables in self._get_snapshot_states().items():
+            try:
+                state, max_id = tables.pop(table)
+            except KeyError:
+                continue
+
+            self._copy_to_snapshot(snapshot_db, table, state, max_id)
+
+            if len(tables) == 0:
+                self._snapshot_states.pop(snapshot_db)
+
+    def _copy_to_snapshot(self, snapshot_db, table, state, max_id):
+        logger.info('Copying table %s to snapshot %s.', table, snapshot_db)
+
+        sql = 'INSERT INTO `{snapshot}`.`{table}` SELECT * FROM `{current}`.`{table}`'.format(current = self._mysql.db_name(), snapshot = snapshot_db, table = table)
+        conditions = []
+
+        if state == 'rows':
+            # rows with saved old versions are already in the snapshot
+            key_columns = [column[0] for column in self._mysql.query('SHOW COLUMNS FROM `%s`.`%s__keys`' % (snapshot_db, table))]
+            key_str = ','.join('`%s`' % c for c in key_columns)
+            conditions.append('({key}) NOT IN (SELECT {key} FROM `{snapshot}`.`{table}__keys`)'.format(key = key_str, snapshot = snapshot_db, table = table))
+
+        if max_id is not None:
+            conditions.append('`id` <= %d' % max_id)
+
+        if len(conditions) != 0:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+
+        self._mysql.query(sql)
+
+        if state == 'rows':
+            if max_id is not None:
+                # rows created after the snapshot and modified later
+                self._mysql.query('DELETE FROM `%s`.`%s` WHERE `id` > %d' % (snapshot_db, table, max_id))
+
+            self._mysql.query('DROP TABLE `%s`.`%s__keys`' % (snapshot_db, table))
+
+        self._mysql.query('UPDATE `%s`.`snapshot_tables` SET `state` = \'full\' WHERE `name` = %%s' % snapshot_db, table)
+
+    def _snapshot_rows(self, table, key, keys):
+        """
+        Called before the rows of the table with the given primary keys are inserted, updated, or deleted. Snapshots
+        still sharing the table save the current versions of the rows (once per key) and the list of keys.
+        @param table  Table name
+        @param key    Primary key column name or tuple of column names
+        @param keys   List of integer keys (tuples for multi-column keys)
+        """
+
+        if len(keys) == 0:
+            return
+
+        states = self._get_snapshot_states()
+        if len(states) == 0:
+            return
+
+        if type(key) is tuple:
+            key_columns = key
+            keys = [tuple(int(k) for k in kt) for kt in keys]
+        else:
+            key_columns = (key,)
+            keys = [int(k) for k in keys]
+
+        key_str = ','.join('`%s`' % c for c in key_columns)
+
+        for snapshot_db, tables in states.iteritems():
+            try:
+                table_state = tables[table]
+            except KeyError:
+                continue
+
+            if table_state[0] == 'shared':
+                self._mysql.query('CREATE TABLE `{snapshot}`.`{table}__keys` (PRIMARY KEY ({key})) ENGINE=MyISAM SELECT {key} FROM `{table}` LIMIT 0'.format(snapshot = snapshot_db, table = table, key = key_str))
+                self._mysql.query('UPDATE `%s`.`snapshot_tables` SET `state` = \'rows\' WHERE `name` = %%s' % snapshot_db, table)
+                table_state[0] = 'rows'
+
+            # current versions of the rows whose keys are not logged yet
+            sqlbase = 'INSERT INTO `{snapshot}`.`{table}` SELECT * FROM `{table}`'.format(snapshot = snapshot_db, table = table)
+            condition = '({key}) NOT IN (SELECT {key} FROM `{snapshot}`.`{table}__keys`)'.format(key = key_str, snapshot = snapshot_db, table = table)
+            self._mysql.execute_many(sqlbase, key, keys, additional_conditions = [condition])
+
+            sqlbase = 'INSERT IGNORE INTO `{snapshot}`.`{table}__keys` VALUES '.format(snapshot = snapshot_db, table = table)
+            for start in xrange(0, len(keys), 10000):
+                if len(key_columns) == 1:
+                    values = ','.join('(%d)' % k for k in keys[start:start + 10000])
+                else:
+                    values = ','.join('(%s)' % ','.join('%d' % k for k in kt) for kt in keys[start:start + 10000])
+
+                self._mysql.query(sqlbase + values)
+
     def _do_get_last_update(self): #override
         return self._mysql.query('SELECT UNIX_TIMESTAMP(`last_update`) FROM `system`')[0]
 
     def _do_set_last_update(self, tm): #override
-        self._mysql.query('UPDATE `system` SET `last_update` = FROM_UNIXTIME(%d)' % int(tm))
+        previous = self._do_get_last_update()
+
+        # last_update tags the caches and the inventory image and has a granularity of one second; a write within the
+        # second of the previous one still moves it forward
+        self._mysql.query('UPDATE `system` SET `last_update` = GREATEST(FROM_UNIXTIME(%d), `last_update` + INTERVAL 1 SECOND)' % int(tm))
+        stamp = self._do_get_last_update()
+
+        if self._id_cache_stamp is not None and previous == self._id_cache_stamp:
+            # no other writer since the caches were validated; our own writes went through them
+            self._id_cache_stamp = stamp
+        else:
+            self._clear_id_cache()
+
+        if self._dataset_entries_saved:
+            # this is the update following _do_save_datasets
+            self._dataset_entries_stamp = stamp
+            self._dataset_entries_saved = False
+
+    def _do_get_replicas_last_update(self): #override
+        if not self._has_replicas_last_update:
+            return 0
+
+        return self._mysql.query('SELECT UNIX_TIMESTAMP(`replicas_last_update`) FROM `system`')[0]
+
+    def _do_set_replicas_last_update(self, tm): #override
+        if not self._has_replicas_last_update:
+            return
+
+        self._mysql.query('UPDATE `system` SET `replicas_last_update` = FROM_UNIXTIME(%d)' % int(tm))
 
     def _do_get_site_list(self, include, exclude): #override
         # Load sites
@@ -133,7 +421,7 @@ class MySQLStore(LocalStoreInterface):
         
         return site_names
 
-    def _do_load_data(self, site_filt, dataset_filt, load_blocks, load_files, load_replicas): #override
+    def _do_load_data(self, site_filt, dataset_filt, load_blocks, load_files, load_replicas, lazy_blocks): #override
         # First set last_update
         self.last_update = self._mysql.query('SELECT UNIX_TIMESTAMP(`last_update`) FROM `system`')[0]
 
@@ -203,7 +491,7 @@ class MySQLStore(LocalStoreInterface):
         # Load datasets - only load ones with replicas on selected sites if load_replicas == True
         dataset_list = []
 
-        query = 'SELECT DISTINCT d.`name`, d.`size`, d.`num_files`, d.`status`+0, d.`on_tape`, d.`data_type`+0, d.`software_version_id`, UNIX_TIMESTAMP(d.`last_update`), d.`is_open`'
+        query = 'SELECT DISTINCT d.`id`, d.`name`, d.`size`, d.`num_files`, d.`status`+0, d.`on_tape`, d.`data_type`+0, d.`software_version_id`, UNIX_TIMESTAMP(d.`last_update`), d.`is_open`'
         query += ' FROM `datasets` AS d'
         conditions = []
         if load_replicas:
@@ -215,12 +503,21 @@ class MySQLStore(LocalStoreInterface):
         if len(conditions) != 0:
             query += ' WHERE ' + (' AND '.join(conditions))
 
-        for name, size, num_files, status, on_tape, data_type, software_version_id, last_update, is_open in self._mysql.query(query):
+        dataset_id_cache = self._id_cache['datasets']
+
+        self._dataset_entries = {}
+        self._dataset_entries_stamp = self._do_get_last_update()
+
+        for entry in self._mysql.xquery(query):
+            dataset_id, name, size, num_files, status, on_tape, data_type, software_version_id, last_update, is_open = entry
             dataset = Dataset(name, size = size, num_files = num_files, status = int(status), on_tape = on_tape, data_type = int(data_type), last_update = last_update, is_open = (is_open == 1))
             dataset.software_version = software_version_map[software_version_id]
 
             dataset_list.append(dataset)
 
+            self._dataset_entries[dataset.name] = (dataset_id,) + entry[2:]
+            dataset_id_cache[name] = dataset_id
+
         logger.info('Loaded data for %d datasets.', len(dataset_list))
 
         if len(dataset_list) == 0:
@@ -228,37 +525,91 @@ class MySQLStore(LocalStoreInterface):
 
         id_dataset_map = {}
 
-        if load_blocks or load_files or load_replicas:
-            # Load blocks
-            logger.info('Loading blocks.')
-    
+        # blocks are needed for files
+        lazy_blocks = lazy_blocks and load_replicas and not load_files
+
+        if lazy_blocks:
             self._make_dataset_map(dataset_list, id_dataset_map = id_dataset_map)
-    
-            block_id_maps = {} # {dataset_id: {block_id: block}}
-    
-            query = 'SELECT DISTINCT b.`id`, b.`dataset_id`, b.`name`, b.`size`, b.`num_files`, b.`is_open` FROM `blocks` AS b'
-            conditions = []
+
+            # number of blocks per dataset, to find the full replicas without loading the blocks
+            num_blocks_map = dict(self._mysql.xquery('SELECT `dataset_id`, COUNT(*) FROM `blocks` GROUP BY `dataset_id`'))
+
+        elif load_blocks or load_files or load_replicas:
+            self._make_dataset_map(dataset_list, id_dataset_map = id_dataset_map)
+
+        # Blocks and replicas are read in dataset_id ranges over parallel connections (if configured).
+        # All range queries are submitted at once; blocks are built first, while the replica ranges are still transferred.
+        dataset_id_ranges = self._dataset_id_ranges(id_dataset_map.keys())
+        queries = []
+
+        if len(id_dataset_map) != 0 and not lazy_blocks:
+            block_sql = 'SELECT DISTINCT b.`id`, b.`dataset_id`, b.`name`, b.`size`, b.`num_files`, b.`is_open` FROM `blocks` AS b'
+            block_conditions = []
             if load_replicas:
-                query += ' INNER JOIN `block_replicas` AS br ON br.`block_id` = b.`id`'
-                conditions.append('br.`site_id` IN (%s)' % sites_str)
+                block_sql += ' INNER JOIN `block_replicas` AS br ON br.`block_id` = b.`id`'
+                block_conditions.append('br.`site_id` IN (%s)' % sites_str)
             if dataset_filt != '/*/*/*' and dataset_filt != '':
-                query += ' INNER JOIN `datasets` AS d ON d.`id` = b.`dataset_id`'
-                conditions.append('d.`name` LIKE \'%s\'' % dataset_filt.replace('*', '%%'))
-    
-            if len(conditions) != 0:
-                query += ' WHERE ' + (' AND '.join(conditions))
+                block_sql += ' INNER JOIN `datasets` AS d ON d.`id` = b.`dataset_id`'
+                block_conditions.append('d.`name` LIKE \'%s\'' % dataset_filt.replace('*', '%%'))
+
+            block_queries = range(len(queries), len(queries) + len(dataset_id_ranges))
+            queries.extend(self._range_query(block_sql, block_conditions, 'b.`dataset_id`', id_range, 'b.`dataset_id`') for id_range in dataset_id_ranges)
+        else:
+            block_queries = []
+
+        if load_replicas:
+            replica_sql = 'SELECT dr.`dataset_id`, dr.`site_id`, dr.`completion`, dr.`is_custodial`, UNIX_TIMESTAMP(dr.`last_block_created`),'
+            replica_sql += ' br.`block_id`, br.`group_id`, br.`is_complete`, br.`is_custodial`, brs.`size`, b.`size`'
+            replica_sql += ' FROM `dataset_replicas` AS dr'
+            replica_sql += ' INNER JOIN `datasets` AS d ON d.`id` = dr.`dataset_id`'
+            replica_sql += ' INNER JOIN `blocks` AS b ON b.`dataset_id` = d.`id`'
+            replica_sql += ' INNER JOIN `block_replicas` AS br ON (br.`block_id`, br.`site_id`) = (b.`id`, dr.`site_id`)'
+            replica_sql += ' LEFT JOIN `block_replica_sizes` AS brs ON (brs.`block_id`, brs.`site_id`) = (br.`block_id`, br.`site_id`)'
+
+            replica_conditions = ['dr.`site_id` IN (%s)' % sites_str]
+            if dataset_filt != '/*/*/*' and dataset_filt != '':
+                replica_conditions.append('dr.`dataset_id` IN (%s)' % (','.join(['%d' % i for i in id_dataset_map.keys()])))
+
+            replica_queries = range(len(queries), len(queries) + len(dataset_id_ranges))
+            queries.extend(self._range_query(replica_sql, replica_conditions, 'dr.`dataset_id`', id_range, 'dr.`dataset_id`, dr.`site_id`') for id_range in dataset_id_ranges)
+        else:
+            replica_queries = []
+
+        query_results = self._mysql.query_in_parallel(queries, config.mysqlstore.load_connections)
+        completed_results = {} # {query index: rows} for results that arrived before they were needed
+
+        def range_results(indices):
+            # rows of the given queries in the order of completion
+            remaining = set(indices)
+            for index in indices:
+                if index in completed_results:
+                    remaining.remove(index)
+                    for row in completed_results.pop(index):
+                        yield row
+
+            while len(remaining) != 0:
+                index, rows = next(query_results)
+                if index in remaining:
+                    remaining.remove(index)
+                    for row in rows:
+                        yield row
+                else:
+                    completed_results[index] = rows
+
+        if len(block_queries) != 0:
+            # Load blocks
+            logger.info('Loading blocks in %d ranges.', len(block_queries))
     
-            query += ' ORDER BY b.`dataset_id`'
+            block_id_maps = {} # {dataset_id: {block_id: block}}
     
             num_blocks = 0
     
             start = time.time()
-            results = self._mysql.query(query)
-            logger.info('Query took %.1f seconds.', time.time() - start)
     
             _dataset_id = 0
             dataset = None
-            for block_id, dataset_id, name, size, num_files, is_open in results:
+            # ranges are disjoint and each is ordered by dataset_id
+            for block_id, dataset_id, name, size, num_files, is_open in range_results(block_queries):
                 if dataset_id != _dataset_id:
                     try:
                         dataset = id_dataset_map[dataset_id]
@@ -269,17 +620,23 @@ class MySQLStore(LocalStoreInterface):
                     block_id_maps[dataset_id] = block_id_map
                     _dataset_id = dataset_id
 
+                    if not load_replicas:
+                        # all blocks of the dataset are loaded
+                        block_id_cache = self._block_id_cache[dataset_id] = {}
+
                     dataset.blocks = []
                     dataset.size = 0
                     dataset.num_files = 0
     
                 block = Block(Block.translate_name(name), dataset, size, num_files, is_open)
     
-                dataset.blocks.append(block)
+                dataset.add_block(block)
                 dataset.size += block.size
                 dataset.num_files += block.num_files
 
                 block_id_map[block_id] = block
+                if not load_replicas:
+                    block_id_cache[block.name] = block_id
     
                 num_blocks += 1
     
@@ -289,156 +646,232 @@ class MySQLStore(LocalStoreInterface):
             logger.info('Loading files.')
             start = time.time()
 
-            num_files = 0
             for dataset in dataset_list:
-                self._do_load_files(dataset)
-                num_files += len(dataset.files)
+                dataset.files = set()
+
+            self._load_files_by_id(id_dataset_map)
+
+            num_files = sum(len(dataset.files) for dataset in dataset_list)
 
             logger.info('Loaded data for %d files in %.1f seconds.', num_files, time.time() - start)
 
         if load_replicas:
             logger.info('Loading replicas.')
 
-            if len(id_dataset_map) == 0:
-                self._make_dataset_map(dataset_list, id_dataset_map = id_dataset_map)
-
-            sql = 'SELECT dr.`dataset_id`, dr.`site_id`, dr.`completion`, dr.`is_custodial`, UNIX_TIMESTAMP(dr.`last_block_created`),'
-            sql += ' br.`block_id`, br.`group_id`, br.`is_complete`, br.`is_custodial`, brs.`size`'
-            sql += ' FROM `dataset_replicas` AS dr'
-            sql += ' INNER JOIN `datasets` AS d ON d.`id` = dr.`dataset_id`'
-            sql += ' INNER JOIN `blocks` AS b ON b.`dataset_id` = d.`id`'
-            sql += ' INNER JOIN `block_replicas` AS br ON (br.`block_id`, br.`site_id`) = (b.`id`, dr.`site_id`)'
-            sql += ' LEFT JOIN `block_replica_sizes` AS brs ON (brs.`block_id`, brs.`site_id`) = (br.`block_id`, br.`site_id`)'
-
-            conditions = ['dr.`site_id` IN (%s)' % sites_str]
-            if dataset_filt != '/*/*/*' and dataset_filt != '':
-                conditions.append('dr.`dataset_id` IN (%s)' % (','.join(['%d' % i for i in id_dataset_map.keys()])))
-
-            if len(conditions) != 0:
-                sql += ' WHERE ' + (' AND '.join(conditions))
-
-            sql += ' ORDER BY dr.`dataset_id`, dr.`site_id`'
-
             _dataset_id = 0
             _site_id = 0
             dataset_replica = None
+            block_replica_data = []
+            num_blocks = 0
+
+            # lazy_blocks: replicas that need the blocks, as [(dataset replica, dataset_id, block_replica_data)]
+            # block_replica_data of these replicas have block ids in place of the blocks
+            deferred_replicas = []
+
+            def make_block_replicas():
+                if not self._make_block_replicas(dataset_replica, block_replica_data, num_blocks, blocks_loaded = not lazy_blocks):
+                    deferred_replicas.append((dataset_replica, _dataset_id, block_replica_data))
     
-            for dataset_id, site_id, completion, is_custodial, last_block_created, block_id, group_id, is_complete, b_is_custodial, b_size in self._mysql.query(sql):
+            for dataset_id, site_id, completion, is_custodial, last_block_created, block_id, group_id, is_complete, b_is_custodial, b_size, block_size in range_results(replica_queries):
                 if dataset_id != _dataset_id:
+                    if dataset_replica is not None:
+                        make_block_replicas()
+                        dataset_replica = None
+
                     _dataset_id = dataset_id
                     dataset = id_dataset_map[_dataset_id]
                     dataset.replicas = []
 
-                    block_id_map = block_id_maps[dataset_id]
+                    if lazy_blocks:
+                        num_blocks = num_blocks_map.get(dataset_id, 0)
+                    else:
+                        block_id_map = block_id_maps[dataset_id]
+                        num_blocks = len(dataset.blocks)
 
                 if site_id != _site_id:
                     _site_id = site_id
                     site = id_site_map[site_id]
 
-                if dataset_replica is None or dataset != dataset_replica.dataset or site != dataset_replica.site:
+                if dataset_replica is None or site != dataset_replica.site:
+                    if dataset_replica is not None:
+                        make_block_replicas()
+
                     dataset_replica = DatasetReplica(dataset, site, is_complete = (completion != 'incomplete'), is_custodial = is_custodial, last_block_created = last_block_created)
 
-                    dataset.replicas.append(dataset_replica)
-                    site.dataset_replicas.add(dataset_replica)
+                    dataset.add_replica(dataset_replica)
+                    site.add_dataset_replica(dataset_replica)
+
+                    block_replica_data = []
 
-                block = block_id_map[block_id]
+                if lazy_blocks:
+                    block = block_id
+                else:
+                    block = block_id_map[block_id]
 
                 group = id_group_map[group_id]
 
-                block_replica = BlockReplica(block, site, group = group, is_complete = is_complete, is_custodial = b_is_custodial, size = block.size if b_size is None else b_size)
+                block_replica_data.append((block, group, is_complete, b_is_custodial, block_size if b_size is None else b_size, block_size))
+
+            if dataset_replica is not None:
+                make_block_replicas()
+
+            if len(deferred_replicas) != 0:
+                logger.info('Loading blocks of %d datasets with partial replicas.', len(set(dataset_id for _, dataset_id, _ in deferred_replicas)))
+
+                block_id_maps = self._load_blocks_by_id(dict((dataset_id, id_dataset_map[dataset_id]) for _, dataset_id, _ in deferred_replicas))
 
-                dataset_replica.block_replicas.append(block_replica)
-                site.add_block_replica(block_replica)
+                for dataset_replica, dataset_id, block_replica_data in deferred_replicas:
+                    block_id_map = block_id_maps[dataset_id]
+                    block_replica_data = [(block_id_map[data[0]],) + data[1:] for data in block_replica_data]
+                    self._make_block_replicas(dataset_replica, block_replica_data, len(dataset_replica.dataset.blocks))
 
         # Only the list of sites, groups, and datasets are returned
         return site_list, group_list, dataset_list
 
-    def _do_load_dataset(self, dataset_name, load_blocks, load_files):
-        query = 'SELECT d.`size`, d.`num_files`, d.`status`+0, d.`on_tape`, d.`data_type`+0, s.`cycle`, s.`major`, s.`minor`, s.`suffix`, UNIX_TIMESTAMP(d.`last_update`), d.`is_open` FROM `datasets` AS d'
-        query += ' LEFT JOIN `software_versions` AS s ON s.`id` = d.`software_version_id`'
-        query += ' WHERE d.`name` = %s'
-        result = self._mysql.query(query, dataset_name)
+    def _make_block_replicas(self, dataset_replica, block_replica_data, num_blocks, blocks_loaded = True):
+        """
+        Attach the block replicas to a loaded dataset replica. A full replica whose block replicas are complete and
+        owned by a single group is set in the implicit representation and no BlockReplica is created.
+        @param dataset_replica     DatasetReplica already added to the dataset and the site
+        @param block_replica_data  List of (block, group, is_complete, is_custodial, size, block size)
+        @param num_blocks          Number of blocks in the dataset
+        @param blocks_loaded       If False, the block entries are not Block objects and only full replicas can be made
+        @return False if the replica is not full and blocks_loaded is False.
+        """
 
-        if len(result) == 0:
-            return None
+        site = dataset_replica.site
 
-        size, num_files, status, on_tape, data_type, s_cycle, s_major, s_minor, s_suffix, last_update, is_open = result[0]
-        dataset = Dataset(dataset_name, size = size, num_files = num_files, status = int(status), on_tape = on_tape, data_type = int(data_type), last_update = last_update, is_open = (is_open == 1))
-        if s_cycle is None:
-            dataset.software_version = None
+        if dataset_replica.is_complete and len(block_replica_data) == num_blocks:
+            group = block_replica_data[0][1]
+            for block, b_group, is_complete, is_custodial, size, block_size in block_replica_data:
+                if not is_complete or is_custodial != dataset_replica.is_custodial or size != block_size or b_group != group:
+                    break
+            else:
+                dataset_replica.set_full(group)
+                site.add_full_replica(dataset_replica)
+                return True
+
+        if not blocks_loaded:
+            return False
+
+        for block, group, is_complete, is_custodial, size, block_size in block_replica_data:
+            block_replica = dataset_replica.new_block_replica(block, group, is_complete, is_custodial, size)
+            site.add_block_replica(block_replica)
+
+        return True
+
+    def _do_load_dataset(self, dataset_name, load_blocks, load_files): #override
+        datasets = self._do_load_datasets([dataset_name], load_blocks, load_files)
+        if len(datasets) == 0:
+            return None
         else:
-            dataset.software_version = (s_cycle, s_major, s_minor, s_suffix)
+            return datasets[0]
+
+    def _do_load_datasets(self, dataset_names, load_blocks, load_files): #override
+        if len(dataset_names) == 0:
+            return []
 
-        if load_blocks:
-            self._do_load_blocks(dataset)
+        query = 'SELECT d.`id`, d.`name`, d.`size`, d.`num_files`, d.`status`+0, d.`on_tape`, d.`data_type`+0, s.`cycle`, s.`major`, s.`minor`, s.`suffix`, UNIX_TIMESTAMP(d.`last_update`), d.`is_open` FROM `datasets` AS d'
+        query += ' LEFT JOIN `software_versions` AS s ON s.`id` = d.`software_version_id`'
+
+        id_dataset_map = {}
+
+        for dataset_id, name, size, num_files, status, on_tape, data_type, s_cycle, s_major, s_minor, s_suffix, last_update, is_open in self._mysql.execute_many(query, 'name', list(dataset_names)):
+            dataset = Dataset(name, size = size, num_files = num_files, status = int(status), on_tape = on_tape, data_type = int(data_type), last_update = last_update, is_open = (is_open == 1))
+            if s_cycle is None:
+                dataset.software_version = None
+            else:
+                dataset.software_version = (s_cycle, s_major, s_minor, s_suffix)
+
+            id_dataset_map[dataset_id] = dataset
+
+        if load_blocks or load_files:
+            self._load_blocks_by_id(id_dataset_map)
 
         if load_files:
-            self._do_load_files(dataset)
+            for dataset in id_dataset_map.itervalues():
+                dataset.files = set()
 
-        return dataset
+            self._load_files_by_id(id_dataset_map)
 
-    def _do_load_blocks(self, dataset):
-        if dataset.blocks is not None:
-            # clear out the existing blocks
-            for block in list(dataset.blocks):
-                dataset.remove_block(block)
+        return id_dataset_map.values()
 
-        dataset.blocks = None
-        dataset.size = 0
-        dataset.num_files = 0
+    def _do_load_blocks(self, datasets): #override
+        for dataset in datasets:
+            if dataset.blocks is not None:
+                # clear out the existing blocks
+                for block in list(dataset.blocks):
+                    dataset.remove_block(block)
+    
+            dataset.blocks = None
+            dataset.size = 0
+            dataset.num_files = 0
 
-        result = self._mysql.query('SELECT `id` FROM `datasets` WHERE `name` = %s', dataset.name)
-        if len(result) == 0:
-            return
+        id_dataset_map = {}
+        self._make_dataset_map(datasets, id_dataset_map = id_dataset_map)
 
-        dataset_id = result[0]
+        self._load_blocks_by_id(id_dataset_map)
 
-        result = self._mysql.query('SELECT `name`, `size`, `num_files`, `is_open` FROM `blocks` WHERE `dataset_id` = %d' % dataset_id)
+    def _load_blocks_by_id(self, id_dataset_map):
+        """
+        Set the blocks of the datasets from the blocks table. The blocks of the datasets must not be loaded.
+        @param id_dataset_map  {dataset_id: dataset}
+        @return {dataset_id: {block_id: block}}
+        """
 
-        dataset.blocks = []
+        block_lists = dict((dataset_id, []) for dataset_id in id_dataset_map)
+        block_id_maps = dict((dataset_id, {}) for dataset_id in id_dataset_map)
 
-        for name, size, num_files, is_open in result:
-            dataset.blocks.append(Block(Block.translate_name(name), dataset, size, num_files, is_open == 1))
-            dataset.size += size
-            dataset.num_files += num_files
+        fields = ('dataset_id', 'id', 'name', 'size', 'num_files', 'is_open')
+        for dataset_id, block_id, name, size, num_files, is_open in self._mysql.select_many('blocks', fields, 'dataset_id', id_dataset_map.keys()):
+            block = Block(Block.translate_name(name), id_dataset_map[dataset_id], size, num_files, is_open == 1)
+            block_lists[dataset_id].append(block)
+            block_id_maps[dataset_id][block_id] = block
 
-    def _do_load_files(self, dataset): #override
-        dataset.files = set()
+        for dataset_id, blocks in block_lists.iteritems():
+            dataset = id_dataset_map[dataset_id]
+            # replicas in the implicit representation cover the blocks as they are set
+            dataset.blocks = blocks
+            dataset.size = sum(b.size for b in blocks)
+            dataset.num_files = sum(b.num_files for b in blocks)
 
-        query = 'SELECT `id` FROM `datasets` WHERE `name` = %s'
-        results = self._mysql.query(query, dataset.name)
+        return block_id_maps
 
-        if len(results) == 0:
-            return
+    def _do_load_files(self, datasets): #override
+        for dataset in datasets:
+            dataset.files = set()
 
-        dataset_id = results[0]
+        id_dataset_map = {}
+        self._make_dataset_map(datasets, id_dataset_map = id_dataset_map)
 
-        block_map = dict((b.real_name(), b) for b in dataset.blocks)
+        self._load_files_by_id(id_dataset_map)
 
-        block_id_map = dict()
-        for block_id, name in self._mysql.query('SELECT `id`, `name` FROM `blocks` WHERE `dataset_id` = %d' % dataset_id):
-            try:
-                block_id_map[block_id] = block_map[name]
-            except KeyError:
-                continue
+    def _load_files_by_id(self, id_dataset_map):
+        """
+        Set the files of the datasets from the files table. The blocks of the datasets must be loaded.
+        @param id_dataset_map  {dataset_id: dataset}
+        """
 
-        # Load files
-        query = 'SELECT `block_id`, `name`, `size` FROM `files` WHERE `dataset_id` = %d ORDER BY `block_id`' % dataset_id
+        block_id_maps = dict((dataset_id, {}) for dataset_id in id_dataset_map) # {dataset_id: {block_id: block}}
 
-        _block_id = 0
-        block = None
-        for block_id, name, size in self._mysql.query(query):
-            if block_id != _block_id:
-                try:
-                    block = block_id_map[block_id]
-                except KeyError:
-                    continue
+        for dataset_id, block_id, name in self._mysql.xselect_many('blocks', ('dataset_id', 'id', 'name'), 'dataset_id', id_dataset_map.keys()):
+            block = id_dataset_map[dataset_id].find_block(Block.translate_name(name))
+            if block is not None:
+                block_id_maps[dataset_id][block_id] = block
 
-                _block_id = block_id
+        file_lists = dict((dataset_id, []) for dataset_id in id_dataset_map)
+
+        for dataset_id, block_id, name, size in self._mysql.xselect_many('files', ('dataset_id', 'block_id', 'name', 'size'), 'dataset_id', id_dataset_map.keys()):
+            try:
+                block = block_id_maps[dataset_id][block_id]
+            except KeyError:
+                continue
 
-            lfile = File.create(name, block, size)
+            file_lists[dataset_id].append(File.create(name, block, size))
 
-            dataset.files.add(lfile)
+        for dataset_id, files in file_lists.iteritems():
+            # converted to a FileCatalog
+            id_dataset_map[dataset_id].files = files
 
     def _do_load_replica_accesses(self, sites, datasets): #override
         id_site_map = {}
@@ -454,13 +887,16 @@ class MySQLStore(LocalStoreInterface):
 
         # pick up all accesses that are less than 1 year old
         # old accesses will eb removed automatically next time the access information is saved from memory
-        records = self._mysql.query('SELECT `dataset_id`, `site_id`, YEAR(`date`), MONTH(`date`), DAY(`date`), `access_type`+0, `num_accesses` FROM `dataset_accesses` WHERE `date` > DATE_SUB(NOW(), INTERVAL 2 YEAR) ORDER BY `dataset_id`, `site_id`, `date`')
+        records = self._mysql.xquery('SELECT `dataset_id`, `site_id`, YEAR(`date`), MONTH(`date`), DAY(`date`), `access_type`+0, `num_accesses` FROM `dataset_accesses` WHERE `date` > DATE_SUB(NOW(), INTERVAL 2 YEAR) ORDER BY `dataset_id`, `site_id`, `date`')
+        num_records = 0
 
         # little speedup by not repeating lookups for the same replica
         current_dataset_id = 0
         current_site_id = 0
         replica = None
         for dataset_id, site_id, year, month, day, access_type, num_accesses in records:
+            num_records += 1
+
             if dataset_id != current_dataset_id:
                 try:
                     dataset = id_dataset_map[dataset_id]
@@ -501,7 +937,7 @@ class MySQLStore(LocalStoreInterface):
 
         last_update = self._mysql.query('SELECT UNIX_TIMESTAMP(`dataset_accesses_last_update`) FROM `system`')[0]
 
-        logger.info('Loaded %d replica access data. Last update on %s UTC', len(records), time.strftime('%Y-%m-%d', time.gmtime(last_update)))
+        logger.info('Loaded %d replica access data. Last update on %s UTC', num_records, time.strftime('%Y-%m-%d', time.gmtime(last_update)))
 
         return (last_update, access_list)
 
@@ -511,13 +947,16 @@ class MySQLStore(LocalStoreInterface):
 
         # pick up requests that are less than 1 year old
         # old requests will be removed automatically next time the access information is saved from memory
-        records = self._mysql.query('SELECT `dataset_id`, `id`, UNIX_TIMESTAMP(`queue_time`), UNIX_TIMESTAMP(`completion_time`), `nodes_total`, `nodes_done`, `nodes_failed`, `nodes_queued` FROM `dataset_requests` WHERE `queue_time` > DATE_SUB(NOW(), INTERVAL 1 YEAR) ORDER BY `dataset_id`, `queue_time`')
+        records = self._mysql.xquery('SELECT `dataset_id`, `id`, UNIX_TIMESTAMP(`queue_time`), UNIX_TIMESTAMP(`completion_time`), `nodes_total`, `nodes_done`, `nodes_failed`, `nodes_queued` FROM `dataset_requests` WHERE `queue_time` > DATE_SUB(NOW(), INTERVAL 1 YEAR) ORDER BY `dataset_id`, `queue_time`')
 
         requests = {}
 
         # little speedup by not repeating lookups for the same dataset
         current_dataset_id = 0
+        num_records = 0
         for dataset_id, job_id, queue_time, completion_time, nodes_total, nodes_done, nodes_failed, nodes_queued in records:
+            num_records += 1
+
             if dataset_id != current_dataset_id:
                 try:
                     dataset = id_dataset_map[dataset_id]
@@ -531,7 +970,7 @@ class MySQLStore(LocalStoreInterface):
 
         last_update = self._mysql.query('SELECT UNIX_TIMESTAMP(`dataset_requests_last_update`) FROM `system`')[0]
 
-        logger.info('Loaded %d dataset request data. Last update at %s UTC', len(records), time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(last_update)))
+        logger.info('Loaded %d dataset request data. Last update at %s UTC', num_records, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(last_update)))
 
         return (last_update, requests)
 
@@ -542,13 +981,15 @@ class MySQLStore(LocalStoreInterface):
         fields = ('name', 'host', 'storage_type', 'backend', 'storage', 'cpu', 'status')
         mapping = lambda s: (s.name, s.host, Site.storage_type_name(s.storage_type), s.backend, s.storage, s.cpu, s.status)
 
-        self._mysql.insert_many('sites', fields, mapping, sites)
+        self._snapshot_table('sites')
+        self._mysql.load_many('sites', fields, mapping, sites)
 
     def _do_save_groups(self, groups): #override
         # insert/update groups
         logger.info('Inserting/updating %d groups.', len(groups))
 
-        self._mysql.insert_many('groups', ('name', 'olevel'), lambda g: (g.name, g.olevel.__name__), groups)
+        self._snapshot_table('groups')
+        self._mysql.load_many('groups', ('name', 'olevel'), lambda g: (g.name, g.olevel.__name__), groups)
 
     def _do_save_datasets(self, datasets): #override
         # insert/update software versions
@@ -568,40 +1009,81 @@ class MySQLStore(LocalStoreInterface):
         logger.info('Inserting/updating %d datasets.', len(datasets))
 
         # first delete datasets in UNKNOWN status if there are any
-        self._mysql.query('DELETE FROM `datasets` WHERE `status` = \'UNKNOWN\'')
+        unknown_entries = self._mysql.query('SELECT `id`, `name` FROM `datasets` WHERE `status` = \'UNKNOWN\'')
+        if len(unknown_entries) != 0:
+            unknown_ids = [dataset_id for dataset_id, _ in unknown_entries]
+            self._snapshot_rows('datasets', 'id', unknown_ids)
+            self._mysql.delete_many('datasets', 'id', unknown_ids)
+            self._delete_dataset_children(unknown_ids)
+            self._forget_datasets([name for _, name in unknown_entries], unknown_ids)
+
+        make_entry = lambda d: (d.size, d.num_files, d.status, d.on_tape, d.data_type, version_map[d.software_version], d.last_update, d.is_open)
 
-        name_entry_map = {}
         query = 'SELECT `name`, `id`, `size`, `num_files`, `status`+0, `on_tape`, `data_type`+0, `software_version_id`, UNIX_TIMESTAMP(`last_update`), `is_open` FROM `datasets`'
-        for entry in self._mysql.query(query):
+
+        if self._dataset_entries_stamp is not None and self._do_get_last_update() == self._dataset_entries_stamp:
+            # the table is as we last saw it - compare only the datasets that changed in memory
+            # if size, num_file, or is_open of a block or a file is updated, its dataset also is
+            candidates = []
+            for dataset in datasets:
+                try:
+                    entry = self._dataset_entries[dataset.name]
+                except KeyError:
+                    candidates.append(dataset)
+                    continue
+
+                if entry[3] == Dataset.STAT_UNKNOWN or entry[1:] != make_entry(dataset):
+                    candidates.append(dataset)
+
+            logger.info('%d datasets changed since the last load or save.', len(candidates))
+
+            entries = self._mysql.execute_many(query, 'name', [d.name for d in candidates])
+
+        else:
+            self._dataset_entries = {}
+            candidates = datasets
+            entries = self._mysql.xquery(query)
+
+        # invalid until the entries are updated and the table last_update is set
+        self._dataset_entries_stamp = None
+
+        name_entry_map = {}
+        for entry in entries:
             name_entry_map[entry[0]] = entry[1:]
 
         dataset_ids_to_delete = []
+        dataset_names_to_delete = []
         datasets_to_update = []
         datasets_to_insert = []
 
-        for dataset in datasets:
+        for dataset in candidates:
             try:
-                dataset_id, size, num_files, status, on_tape, data_type, software_version_id, last_update, is_open = name_entry_map[dataset.name]
+                entry = name_entry_map[dataset.name]
             except KeyError:
                 if dataset.status != Dataset.STAT_UNKNOWN:
                     datasets_to_insert.append(dataset)
                 continue
 
+            dataset_id = entry[0]
+
             if dataset.status == Dataset.STAT_UNKNOWN:
                 dataset_ids_to_delete.append(dataset_id)
+                dataset_names_to_delete.append(dataset.name)
+                self._dataset_entries.pop(dataset.name, None)
                 continue
 
-            if dataset.size != size or dataset.num_files != num_files or dataset.status != status or dataset.on_tape != on_tape or \
-                    version_map[dataset.software_version] != software_version_id or dataset.last_update != last_update or dataset.is_open != is_open:
+            new_entry = make_entry(dataset)
+            if entry[1:] != new_entry:
                 datasets_to_update.append((dataset_id, dataset))
 
+            self._dataset_entries[dataset.name] = (dataset_id,) + new_entry
+
         if len(dataset_ids_to_delete) != 0:
+            self._snapshot_rows('datasets', 'id', dataset_ids_to_delete)
             self._mysql.delete_many('datasets', 'id', dataset_ids_to_delete)
-
-        # clean up orphans before making insertions
-        self._mysql.query('DELETE FROM `blocks` WHERE `dataset_id` NOT IN (SELECT `id` FROM `datasets`)')
-        self._mysql.query('DELETE FROM `files` WHERE `dataset_id` NOT IN (SELECT `id` FROM `datasets`)')
-        self._mysql.query('DELETE FROM `files` WHERE `block_id` NOT IN (SELECT `id` FROM `blocks`)')
+            # clean up the children before making insertions
+            self._delete_dataset_children(dataset_ids_to_delete)
+            self._forget_datasets(dataset_names_to_delete, dataset_ids_to_delete)
 
         fields = ('id', 'name', 'size', 'num_files', 'status', 'on_tape', 'data_type', 'software_version_id', 'last_update', 'is_open')
         # MySQL expects the local time for last_update
@@ -619,7 +1101,8 @@ class MySQLStore(LocalStoreInterface):
         )
 
         # use INSERT ON DUPLICATE KEY UPDATE
-        self._mysql.insert_many('datasets', fields, mapping, datasets_to_update, do_update = True)
+        self._snapshot_rows('datasets', 'id', [i for i, _ in datasets_to_update])
+        self._mysql.load_many('datasets', fields, mapping, datasets_to_update, do_update = True)
 
         fields = ('name', 'size', 'num_files', 'status', 'on_tape', 'data_type', 'software_version_id', 'last_update', 'is_open')
         # MySQL expects the local time for last_update
@@ -635,11 +1118,14 @@ class MySQLStore(LocalStoreInterface):
             1 if d.is_open else 0
         )
 
-        self._mysql.insert_many('datasets', fields, mapping, datasets_to_insert)
+        self._mysql.load_many('datasets', fields, mapping, datasets_to_insert)
 
-        # load the dataset ids
+        # load the ids of the new datasets
         dataset_id_map = {}
-        self._make_dataset_map(datasets, dataset_id_map = dataset_id_map)
+        self._make_dataset_map(datasets_to_insert, dataset_id_map = dataset_id_map)
+
+        for dataset in datasets_to_insert:
+            self._dataset_entries[dataset.name] = (dataset_id_map[dataset],) + make_entry(dataset)
 
         # insert/update blocks and files
         logger.info('Inserting/updating blocks and files.')
@@ -670,7 +1156,10 @@ class MySQLStore(LocalStoreInterface):
             entry_list.append(entry[1:])
 
         block_ids_to_delete = []
+        block_names_to_delete = [] # [(dataset_id, block name)] for the block id cache
         blocks_to_update = []
+        blocks_to_insert = [] # [(dataset_id, block)]
+        block_ids = {} # {block: block_id} for blocks with files to insert
         file_ids_to_delete = []
         files_to_update = []
         files_to_insert = []
@@ -679,14 +1168,17 @@ class MySQLStore(LocalStoreInterface):
             if dataset.blocks is None:
                 continue
 
-            blocks = dict((b.real_name(), b) for b in dataset.blocks)
-            block_id_map = {}
+            # parsing the names from the DB is cheaper than formatting the names of the blocks in memory
+            blocks = dict((b.name, b) for b in dataset.blocks)
+            block_id_map = block_ids if dataset.files is not None else {}
 
             for block_id, name, size, num_files, is_open in block_entries[dataset_id]:
+                block_name = Block.translate_name(name)
                 try:
-                    block = blocks.pop(name)
+                    block = blocks.pop(block_name)
                 except KeyError:
                     block_ids_to_delete.append(block_id)
+                    block_names_to_delete.append((dataset_id, block_name))
                     continue
 
                 block_id_map[block] = block_id
@@ -694,9 +1186,7 @@ class MySQLStore(LocalStoreInterface):
                 if size != block.size or num_files != block.num_files or is_open != block.is_open:
                     blocks_to_update.append((block_id, name, block.size, block.num_files, block.is_open))
 
-            for name, block in blocks.items():
-                block_id_map[block] = self._mysql.query('INSERT INTO `blocks` (`dataset_id`, `name`, `size`, `num_files`, `is_open`) VALUES (%s, %s, %s, %s, %s)',
-                    dataset_id, name, block.size, block.num_files, block.is_open)
+            blocks_to_insert.extend((dataset_id, block) for block in blocks.itervalues())
 
             if dataset.files is None:
                 continue
@@ -713,8 +1203,9 @@ class MySQLStore(LocalStoreInterface):
                 if size != lfile.size:
                     files_to_update.append((file_id, lfile.size, name))
 
+            # block ids are resolved after the block insertion
             for name, lfile in files.items():
-                files_to_insert.append((block_id_map[lfile.block], dataset_id, lfile.size, name))
+                files_to_insert.append((lfile.block, dataset_id, lfile.size, name))
 
         for dataset in datasets_to_insert:
             if dataset.blocks is None:
@@ -722,35 +1213,81 @@ class MySQLStore(LocalStoreInterface):
 
             dataset_id = dataset_id_map[dataset]
 
-            block_id_map = {}
-
-            for block in dataset.blocks:
-                block_id_map[block] = self._mysql.query('INSERT INTO `blocks` (`dataset_id`, `name`, `size`, `num_files`, `is_open`) VALUES (%s, %s, %s, %s, %s)',
-                    dataset_id, block.real_name(), block.size, block.num_files, block.is_open)
+            blocks_to_insert.extend((dataset_id, block) for block in dataset.blocks)
 
             if dataset.files is None:
                 continue
 
             for lfile in dataset.files:
-                files_to_insert.append((block_id_map[lfile.block], dataset_id, lfile.size, lfile.fullpath()))
+                files_to_insert.append((lfile.block, dataset_id, lfile.size, lfile.fullpath()))
+
+        if len(blocks_to_insert) != 0:
+            logger.info('Inserting %d blocks.', len(blocks_to_insert))
+
+            fields = ('dataset_id', 'name', 'size', 'num_files', 'is_open')
+            mapping = lambda (i, b): (i, b.real_name(), b.size, b.num_files, b.is_open)
+            self._mysql.load_many('blocks', fields, mapping, blocks_to_insert, do_update = False)
+
+            # one lookup for the ids of all new blocks
+            new_blocks = {} # {dataset_id: {block name: block}}
+            for dataset_id, block in blocks_to_insert:
+                try:
+                    new_blocks[dataset_id][block.name] = block
+                except KeyError:
+                    new_blocks[dataset_id] = {block.name: block}
+
+            # the lookup returns all blocks of the datasets
+            for dataset_id in new_blocks:
+                self._block_id_cache[dataset_id] = {}
+
+            for dataset_id, block_id, name in self._mysql.xselect_many('blocks', ('dataset_id', 'id', 'name'), 'dataset_id', new_blocks.keys()):
+                block_name = Block.translate_name(name)
+                self._block_id_cache[dataset_id][block_name] = block_id
+
+                try:
+                    block = new_blocks[dataset_id][block_name]
+                except KeyError:
+                    continue
+
+                block_ids[block] = block_id
+
+        files_to_insert = [(block_ids[f[0]],) + f[1:] for f in files_to_insert]
+
+        self._snapshot_rows('blocks', 'id', block_ids_to_delete + [b[0] for b in blocks_to_update])
+        self._snapshot_rows('files', 'id', file_ids_to_delete + [f[0] for f in files_to_update])
 
         self._mysql.delete_many('blocks', 'id', block_ids_to_delete)
         self._mysql.delete_many('files', 'id', file_ids_to_delete)
+        self._delete_block_children(block_ids_to_delete)
+
+        for dataset_id, block_name in block_names_to_delete:
+            try:
+                self._block_id_cache[dataset_id].pop(block_name, None)
+            except KeyError:
+                pass
         
         # update blocks
         fields = ('id', 'name', 'size', 'num_files', 'is_open')
         # use INSERT ON DUPLICATE KEY UPDATE query
-        self._mysql.insert_many('blocks', fields, None, blocks_to_update, do_update = True)
+        self._mysql.load_many('blocks', fields, None, blocks_to_update, do_update = True)
 
         # update files
         fields = ('id', 'size', 'name')
-        self._mysql.insert_many('files', fields, None, files_to_update, do_update = True)
+        self._mysql.load_many('files', fields, None, files_to_update, do_update = True)
 
         # insert files
         fields = ('block_id', 'dataset_id', 'size', 'name')
-        self._mysql.insert_many('files', fields, None, files_to_insert, do_update = False)
+        self._mysql.load_many('files', fields, None, files_to_insert, do_update = False)
+
+        self._dataset_entries_saved = True
 
     def _do_save_replicas(self, sites, groups, datasets): #override
+        """
+        Bring the replica tables to the state of the replicas of the datasets. The new rows are compared with the
+        table contents (streamed in key order) and only the differences are written, with the three tables locked so
+        that readers never see a partial update.
+        """
+
         site_id_map = {}
         self._make_site_map(sites, site_id_map = site_id_map)
         group_id_map = {}
@@ -758,74 +1295,104 @@ class MySQLStore(LocalStoreInterface):
         dataset_id_map = {}
         self._make_dataset_map(datasets, dataset_id_map = dataset_id_map)
 
-        # insert/update dataset replicas
-        logger.info('Inserting/updating dataset replicas.')
+        replicated_datasets = [d for d in datasets if d.status != Dataset.STAT_UNKNOWN and d.replicas is not None]
 
-        if self._mysql.table_exists('dataset_replicas_new'):
-            self._mysql.query('DROP TABLE `dataset_replicas_new`')
+        block_id_maps = self._make_block_maps([dataset_id_map[d] for d in replicated_datasets if len(d.replicas) != 0])
 
-        self._mysql.query('CREATE TABLE `dataset_replicas_new` LIKE `dataset_replicas`')
+        dataset_replicas = []
+        block_replicas = []
+        replica_sizes = []
+        for dataset in replicated_datasets:
+            dataset_id = dataset_id_map[dataset]
+            if len(dataset.replicas) != 0:
+                block_name_to_id = block_id_maps[dataset_id]
 
-        fields = ('dataset_id', 'site_id', 'completion', 'is_custodial', 'last_block_created')
-        mapping = lambda r: (dataset_id_map[r.dataset], site_id_map[r.site], 'partial' if r.is_partial() else ('full' if r.is_complete else 'incomplete'), r.is_custodial, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r.last_block_created)))
+            for replica in dataset.replicas:
+                site_id = site_id_map[replica.site]
+                completion = 'partial' if replica.is_partial() else ('full' if replica.is_complete else 'incomplete')
+                dataset_replicas.append((dataset_id, site_id, completion, replica.is_custodial, replica.last_block_created))
 
-        all_replicas = []
-        for dataset in datasets:
-            if dataset.status != Dataset.STAT_UNKNOWN and dataset.replicas is not None:
-                all_replicas.extend(dataset.replicas)
+                for block_replica in replica.iter_block_replicas():
+                    block_id = block_name_to_id[block_replica.block.name]
 
-        self._mysql.insert_many('dataset_replicas_new', fields, mapping, all_replicas, do_update = False)
+                    block_replicas.append((block_id, site_id, group_id_map[block_replica.group], block_replica.is_complete, block_replica.is_custodial))
+                    if not block_replica.is_complete:
+                        replica_sizes.append((block_id, site_id, block_replica.size))
 
-        self._mysql.query('RENAME TABLE `dataset_replicas` TO `dataset_replicas_old`')
-        self._mysql.query('RENAME TABLE `dataset_replicas_new` TO `dataset_replicas`')
-        self._mysql.query('DROP TABLE `dataset_replicas_old`')
+        dataset_replicas.sort()
+        block_replicas.sort()
+        replica_sizes.sort()
 
-        # insert/update block replicas
-        logger.info('Inserting/updating block replicas.')
+        logger.info('Comparing dataset replicas.')
+        sql = 'SELECT `dataset_id`, `site_id`, `completion`, `is_custodial`, UNIX_TIMESTAMP(`last_block_created`) FROM `dataset_replicas` ORDER BY `dataset_id`, `site_id`'
+        dataset_replica_diff = self._compare_rows(self._mysql.xquery(sql), dataset_replicas, 2)
 
-        # assuming block name is unique
-        block_name_to_id = {}
-        for block_id, block_name in self._mysql.query('SELECT DISTINCT b.`id`, b.`name` FROM `blocks` AS b INNER JOIN `dataset_replicas` AS dr ON dr.`dataset_id` = b.`dataset_id`'):
-            block_name_to_id[Block.translate_name(block_name)] = block_id
+        logger.info('Comparing block replicas.')
+        sql = 'SELECT `block_id`, `site_id`, `group_id`, `is_complete`, `is_custodial` FROM `block_replicas` ORDER BY `block_id`, `site_id`'
+        block_replica_diff = self._compare_rows(self._mysql.xquery(sql), block_replicas, 2)
 
-        all_replicas = []
-        replica_sizes = []
-        for dataset in datasets:
-            if dataset.status == Dataset.STAT_UNKNOWN or dataset.replicas is None:
-                continue
+        sql = 'SELECT `block_id`, `site_id`, `size` FROM `block_replica_sizes` ORDER BY `block_id`, `site_id`'
+        replica_size_diff = self._compare_rows(self._mysql.xquery(sql), replica_sizes, 2)
 
-            for replica in dataset.replicas:
-                site_id = site_id_map[replica.site]
-                for block_replica in replica.block_replicas:
-                    block_id = block_name_to_id[block_replica.block.name]
+        logger.info('Writing %d/%d dataset replica and %d/%d block replica updates/deletions.', len(dataset_replica_diff[0]), len(dataset_replica_diff[1]), len(block_replica_diff[0]), len(block_replica_diff[1]))
 
-                    all_replicas.append((block_id, site_id, group_id_map[block_replica.group], block_replica.is_complete, block_replica.is_custodial))
-                    if not block_replica.is_complete:
-                        replica_sizes.append((block_id, site_id, block_replica.size))
+        fields = ('dataset_id', 'site_id', 'completion', 'is_custodial', 'last_block_created')
+        mapping = lambda r: r[:4] + (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r[4])),)
+
+        # save the rows to be modified to snapshots before locking
+        key = ('dataset_id', 'site_id')
+        self._snapshot_rows('dataset_replicas', key, dataset_replica_diff[1] + [r[:2] for r in dataset_replica_diff[0]])
+        key = ('block_id', 'site_id')
+        self._snapshot_rows('block_replicas', key, block_replica_diff[1] + [r[:2] for r in block_replica_diff[0]])
+        self._snapshot_rows('block_replica_sizes', key, replica_size_diff[1] + [r[:2] for r in replica_size_diff[0]])
+
+        self._mysql.query('LOCK TABLES `dataset_replicas` WRITE, `block_replicas` WRITE, `block_replica_sizes` WRITE')
+
+        try:
+            self._mysql.delete_in('dataset_replicas', ('dataset_id', 'site_id'), dataset_replica_diff[1])
+            self._mysql.load_many('dataset_replicas', fields, mapping, dataset_replica_diff[0])
+
+            self._mysql.delete_in('block_replicas', ('block_id', 'site_id'), block_replica_diff[1])
+            self._mysql.load_many('block_replicas', ('block_id', 'site_id', 'group_id', 'is_complete', 'is_custodial'), None, block_replica_diff[0])
 
-        if self._mysql.table_exists('block_replicas_new'):
-            self._mysql.query('DROP TABLE `block_replicas_new`')
+            self._mysql.delete_in('block_replica_sizes', ('block_id', 'site_id'), replica_size_diff[1])
+            self._mysql.load_many('block_replica_sizes', ('block_id', 'site_id', 'size'), None, replica_size_diff[0])
 
-        self._mysql.query('CREATE TABLE `block_replicas_new` LIKE `block_replicas`')
+        finally:
+            self._mysql.query('UNLOCK TABLES')
+
+    def _compare_rows(self, current_rows, new_rows, num_keys):
+        """
+        Merge-compare the rows of a table with their new contents. Both must be sorted by the key (the first num_keys
+        columns).
+        @param current_rows  Iterable of row tuples in the table
+        @param new_rows      Sorted list of row tuples
+        @param num_keys      Number of key columns
+        @return (rows to insert or update, keys to delete)
+        """
 
-        fields = ('block_id', 'site_id', 'group_id', 'is_complete', 'is_custodial')
-        self._mysql.insert_many('block_replicas_new', fields, None, all_replicas, do_update = False)
+        upserts = []
+        deletions = []
 
-        self._mysql.query('RENAME TABLE `block_replicas` TO `block_replicas_old`')
-        self._mysql.query('RENAME TABLE `block_replicas_new` TO `block_replicas`')
-        self._mysql.query('DROP TABLE `block_replicas_old`')
+        inew = 0
+        for row in current_rows:
+            key = row[:num_keys]
 
-        if self._mysql.table_exists('block_replica_sizes_new'):
-            self._mysql.query('DROP TABLE `block_replica_sizes_new`')
+            while inew < len(new_rows) and new_rows[inew][:num_keys] < key:
+                upserts.append(new_rows[inew])
+                inew += 1
 
-        self._mysql.query('CREATE TABLE `block_replica_sizes_new` LIKE `block_replica_sizes`')
+            if inew < len(new_rows) and new_rows[inew][:num_keys] == key:
+                if new_rows[inew] != row:
+                    upserts.append(new_rows[inew])
+                inew += 1
+            else:
+                # key lists are inserted into the query text - avoid the long suffix
+                deletions.append(tuple(int(k) for k in key))
 
-        fields = ('block_id', 'site_id', 'size')
-        self._mysql.insert_many('block_replica_sizes_new', fields, None, replica_sizes, do_update = False)
+        upserts.extend(new_rows[inew:])
 
-        self._mysql.query('RENAME TABLE `block_replica_sizes` TO `block_replica_sizes_old`')
-        self._mysql.query('RENAME TABLE `block_replica_sizes_new` TO `block_replica_sizes`')
-        self._mysql.query('DROP TABLE `block_replica_sizes_old`')
+        return upserts, deletions
 
     def _do_save_replica_accesses(self, access_list): #override
         replicas = access_list.keys()
@@ -845,7 +1412,8 @@ class MySQLStore(LocalStoreInterface):
             for date, (num_accesses, cputime) in replica_access_list.items():
                 data.append((dataset_id, site_id, date.strftime('%Y-%m-%d'), 'local', num_accesses, cputime))
 
-        self._mysql.insert_many('dataset_accesses', fields, None, data, do_update = True)
+        self._snapshot_table('dataset_accesses')
+        self._mysql.load_many('dataset_accesses', fields, None, data, do_update = True)
 
         # remove old entries
         self._mysql.query('DELETE FROM `dataset_accesses` WHERE `date` < DATE_SUB(NOW(), INTERVAL 2 YEAR)')
@@ -875,19 +1443,15 @@ class MySQLStore(LocalStoreInterface):
                     nodes_queued
                 ))
 
-        self._mysql.insert_many('dataset_requests', fields, None, data, do_update = True)
+        self._snapshot_table('dataset_requests')
+        self._mysql.load_many('dataset_requests', fields, None, data, do_update = True)
 
         self._mysql.query('DELETE FROM `dataset_requests` WHERE `queue_time` < DATE_SUB(NOW(), INTERVAL 1 YEAR)')
         self._mysql.query('UPDATE `system` SET `dataset_requests_last_update` = NOW()')
 
-    def _do_add_datasetreplicas(self, replicas): #override
+    def _do_add_datasetreplicas(self, replicas, add_blockreplicas): #override
         site_id_map = {}
         self._make_site_map(list(set(r.site for r in replicas)), site_id_map = site_id_map)
-        groups = set()
-        for replica in replicas:
-            groups.update(block_replica.group for block_replica in replica.block_replicas)
-        group_id_map = {}
-        self._make_group_map(list(groups), group_id_map = group_id_map)
         dataset_id_map = {}
         self._make_dataset_map(list(set(r.dataset for r in replicas)), dataset_id_map = dataset_id_map)
 
@@ -897,33 +1461,51 @@ class MySQLStore(LocalStoreInterface):
         fields = ('dataset_id', 'site_id', 'completion', 'is_custodial', 'last_block_created')
         mapping = lambda r: (dataset_id_map[r.dataset], site_id_map[r.site], 'partial' if r.is_partial() else ('full' if r.is_complete else 'incomplete'), r.is_custodial, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(r.last_block_created)))
 
-        self._mysql.insert_many('dataset_replicas', fields, mapping, replicas)
+        self._snapshot_rows('dataset_replicas', ('dataset_id', 'site_id'), [(dataset_id_map[r.dataset], site_id_map[r.site]) for r in replicas])
+
+        if not add_blockreplicas:
+            self._mysql.load_many('dataset_replicas', fields, mapping, replicas)
+            return
+
+        groups = set()
+        for replica in replicas:
+            groups.update(block_replica.group for block_replica in replica.iter_block_replicas())
+        group_id_map = {}
+        self._make_group_map(list(groups), group_id_map = group_id_map)
 
         # insert/update block replicas
         all_replicas = []
         replica_sizes = []
 
+        block_id_maps = self._make_block_maps(dataset_id_map.values())
+
         for replica in replicas:
             dataset_id = dataset_id_map[replica.dataset]
             site_id = site_id_map[replica.site]
             
-            block_ids = {}
-            for name_str, block_id in self._mysql.query('SELECT `name`, `id` FROM `blocks` WHERE `dataset_id` = %s', dataset_id):
-                block_ids[Block.translate_name(name_str)] = block_id
+            block_ids = block_id_maps[dataset_id]
 
             # add the block replicas on this site to block_replicas together with SQL ID
-            for block_replica in replica.block_replicas:
+            for block_replica in replica.iter_block_replicas():
                 block_id = block_ids[block_replica.block.name]
 
                 all_replicas.append((block_id, site_id, group_id_map[block_replica.group], block_replica.is_complete, block_replica.is_custodial))
                 if not block_replica.is_complete:
                     replica_sizes.append((block_id, site_id, block_replica.size))
 
-        fields = ('block_id', 'site_id', 'group_id', 'is_complete', 'is_custodial')
-        self._mysql.insert_many('block_replicas', fields, None, all_replicas)
+        self._snapshot_rows('block_replicas', ('block_id', 'site_id'), [r[:2] for r in all_replicas])
+        self._snapshot_rows('block_replica_sizes', ('block_id', 'site_id'), [r[:2] for r in replica_sizes])
 
-        fields = ('block_id', 'site_id', 'size')
-        self._mysql.insert_many('block_replica_sizes', fields, None, replica_sizes)
+        # all rows become visible at once
+        self._mysql.query('LOCK TABLES `dataset_replicas` WRITE, `block_replicas` WRITE, `block_replica_sizes` WRITE')
+
+        try:
+            self._mysql.load_many('dataset_replicas', fields, mapping, replicas)
+            self._mysql.load_many('block_replicas', ('block_id', 'site_id', 'group_id', 'is_complete', 'is_custodial'), None, all_replicas)
+            self._mysql.load_many('block_replica_sizes', ('block_id', 'site_id', 'size'), None, replica_sizes)
+
+        finally:
+            self._mysql.query('UNLOCK TABLES')
 
     def _do_add_blockreplicas(self, replicas): #override
         site_id_map = {}
@@ -936,25 +1518,29 @@ class MySQLStore(LocalStoreInterface):
         all_replicas = []
         replica_sizes = []
 
+        block_id_maps = self._make_block_maps(dataset_id_map.values())
+
         for replica in replicas:
             dataset_id = dataset_id_map[replica.block.dataset]
             site_id = site_id_map[replica.site]
             
-            block_ids = {}
-            for name_str, block_id in self._mysql.query('SELECT `name`, `id` FROM `blocks` WHERE `dataset_id` = %s', dataset_id):
-                block_ids[Block.translate_name(name_str)] = block_id
-
-            block_id = block_ids[replica.block.name]
+            block_id = block_id_maps[dataset_id][replica.block.name]
 
             all_replicas.append((block_id, site_id, group_id_map[replica.group], replica.is_complete, replica.is_custodial))
             if not replica.is_complete:
                 replica_sizes.append((block_id, site_id, replica.size))
 
-        fields = ('block_id', 'site_id', 'group_id', 'is_complete', 'is_custodial')
-        self._mysql.insert_many('block_replicas', fields, None, all_replicas)
+        self._snapshot_rows('block_replicas', ('block_id', 'site_id'), [r[:2] for r in all_replicas])
+        self._snapshot_rows('block_replica_sizes', ('block_id', 'site_id'), [r[:2] for r in replica_sizes])
 
-        fields = ('block_id', 'site_id', 'size')
-        self._mysql.insert_many('block_replica_sizes', fields, None, replica_sizes)
+        self._mysql.query('LOCK TABLES `block_replicas` WRITE, `block_replica_sizes` WRITE')
+
+        try:
+            self._mysql.load_many('block_replicas', ('block_id', 'site_id', 'group_id', 'is_complete', 'is_custodial'), None, all_replicas)
+            self._mysql.load_many('block_replica_sizes', ('block_id', 'site_id', 'size'), None, replica_sizes)
+
+        finally:
+            self._mysql.query('UNLOCK TABLES')
 
     def _do_delete_dataset(self, dataset): #override
         """
@@ -965,129 +1551,241 @@ class MySQLStore(LocalStoreInterface):
         except IndexError:
             return
 
-        self._mysql.query('DELETE FROM br USING `block_replicas` AS br INNER JOIN `blocks` AS b ON b.`id` = br.`block_id` WHERE b.`dataset_id` = %s', dataset_id)
-        self._mysql.query('DELETE FROM brs USING `block_replica_sizes` AS brs INNER JOIN `blocks` AS b ON b.`id` = brs.`block_id` WHERE b.`dataset_id` = %s', dataset_id)
-        self._mysql.query('DELETE FROM `blocks` WHERE `dataset_id` = %s', dataset_id)
-        self._mysql.query('DELETE FROM `dataset_replicas` WHERE `dataset_id` = %s', dataset_id)
+        self._snapshot_rows('datasets', 'id', [dataset_id])
         self._mysql.query('DELETE FROM `datasets` WHERE `id` = %s', dataset_id)
+        self._delete_dataset_children([dataset_id])
+
+        self._forget_datasets([dataset.name], [dataset_id])
 
     def _do_delete_datasets(self, datasets): #override
         """
         Delete everything related to the datasets
         """
         dataset_ids = self._mysql.select_many('datasets', 'id', 'name', [d.name for d in datasets])
+        if len(dataset_ids) == 0:
+            return
 
-        ids_str = ','.join(['%d' % i for i in dataset_ids])
+        self._snapshot_rows('datasets', 'id', dataset_ids)
+        self._mysql.delete_many('datasets', 'id', dataset_ids)
+        self._delete_dataset_children(dataset_ids)
 
-        self._mysql.query('DELETE FROM br USING `block_replicas` AS br INNER JOIN `blocks` AS b ON b.`id` = br.`block_id` WHERE b.`dataset_id` IN (%s)' % ids_str)
-        self._mysql.query('DELETE FROM brs USING `block_replica_sizes` AS brs INNER JOIN `blocks` AS b ON b.`id` = brs.`block_id` WHERE b.`dataset_id` IN (%s)' % ids_str)
-        self._mysql.query('DELETE FROM `blocks` WHERE `dataset_id` IN (%s)' % ids_str)
-        self._mysql.query('DELETE FROM `dataset_replicas` WHERE `dataset_id` IN (%s)' % ids_str)
-        self._mysql.query('DELETE FROM `datasets` WHERE `id` IN (%s)' % ids_str)
+        self._forget_datasets([d.name for d in datasets], dataset_ids)
 
     def _do_delete_block(self, block): #override
-        query = 'SELECT b.`id` FROM `blocks` AS b INNER JOIN `datasets` AS d ON d.`id` = b.`dataset_id`'
+        query = 'SELECT b.`id`, b.`dataset_id` FROM `blocks` AS b INNER JOIN `datasets` AS d ON d.`id` = b.`dataset_id`'
         query += ' WHERE b.`name` LIKE %s AND d.`name` LIKE %s'
 
         try:
-            block_id = self._mysql.query(query, block.real_name(), block.dataset.name)[0]
+            block_id, dataset_id = self._mysql.query(query, block.real_name(), block.dataset.name)[0]
         except IndexError:
             return
 
-        self._mysql.query('DELETE FROM `block_replicas` WHERE `block_id` = %s', block_id)
-        self._mysql.query('DELETE FROM `block_replica_sizes` WHERE `block_id` = %s', block_id)
+        self._snapshot_rows('blocks', 'id', [block_id])
         self._mysql.query('DELETE FROM `blocks` WHERE `id` = %s', block_id)
+        self._delete_block_children([block_id])
+
+        try:
+            self._block_id_cache[dataset_id].pop(block.name, None)
+        except KeyError:
+            pass
+
+    def _delete_dataset_children(self, dataset_ids):
+        """
+        Delete the blocks, files, and replicas of deleted datasets. Only the rows of the given datasets are looked at,
+        through the dataset_id indices.
+        """
+
+        if len(dataset_ids) == 0:
+            return
+
+        block_ids = self._mysql.select_many('blocks', 'id', 'dataset_id', dataset_ids)
+        self._snapshot_rows('blocks', 'id', block_ids)
+        self._mysql.delete_many('blocks', 'id', block_ids)
+        self._delete_block_children(block_ids)
+
+        # files not matching their block_id
+        file_ids = self._mysql.select_many('files', 'id', 'dataset_id', dataset_ids)
+        self._snapshot_rows('files', 'id', file_ids)
+        self._mysql.delete_many('files', 'id', file_ids)
+
+        keys = self._mysql.select_many('dataset_replicas', ('dataset_id', 'site_id'), 'dataset_id', dataset_ids)
+        self._snapshot_rows('dataset_replicas', ('dataset_id', 'site_id'), keys)
+        self._mysql.delete_many('dataset_replicas', 'dataset_id', dataset_ids)
+
+    def _delete_block_children(self, block_ids):
+        """
+        Delete the files and replicas of deleted blocks.
+        """
+
+        if len(block_ids) == 0:
+            return
+
+        file_ids = self._mysql.select_many('files', 'id', 'block_id', block_ids)
+        self._snapshot_rows('files', 'id', file_ids)
+        self._mysql.delete_many('files', 'id', file_ids)
+
+        for table in ['block_replicas', 'block_replica_sizes']:
+            keys = self._mysql.select_many(table, ('block_id', 'site_id'), 'block_id', block_ids)
+            self._snapshot_rows(table, ('block_id', 'site_id'), keys)
+            self._mysql.delete_many(table, 'block_id', block_ids)
 
     def _do_delete_datasetreplicas(self, site, datasets, delete_blockreplicas): #override
-        site_id = self._mysql.query('SELECT `id` FROM `sites` WHERE `name` LIKE %s', site.name)[0]
+        site_id_map = {}
+        self._make_site_map([site], site_id_map = site_id_map)
+        dataset_id_map = {}
+        self._make_dataset_map(datasets, dataset_id_map = dataset_id_map)
 
-        dataset_ids = self._mysql.select_many('datasets', 'id', 'name', [d.name for d in datasets])
+        try:
+            site_id = site_id_map[site]
+        except KeyError:
+            return
+
+        dataset_ids = list(set(dataset_id_map.itervalues()))
+        if len(dataset_ids) == 0:
+            return
 
-        self._mysql.delete_in('dataset_replicas', 'dataset_id', dataset_ids, additional_conditions = ['site_id = %d' % site_id])
+        keys = [(dataset_id, site_id) for dataset_id in dataset_ids]
+        self._snapshot_rows('dataset_replicas', ('dataset_id', 'site_id'), keys)
+        self._delete_by_keys(['dataset_replicas'], ('dataset_id', 'site_id'), keys)
 
         if delete_blockreplicas:
-            ids_str = ','.join(['%d' % i for i in dataset_ids])
-            self._mysql.query('DELETE FROM br USING `block_replicas` AS br INNER JOIN `blocks` AS b ON b.`id` = br.`block_id` WHERE b.`dataset_id` IN (%s) AND br.`site_id` = %d' % (ids_str, site_id))
-            self._mysql.query('DELETE FROM brs USING `block_replica_sizes` AS brs INNER JOIN `blocks` AS b ON b.`id` = brs.`block_id` WHERE b.`dataset_id` IN (%s) AND brs.`site_id` = %d' % (ids_str, site_id))
+            block_id_maps = self._make_block_maps(dataset_ids)
+            keys = [(block_id, site_id) for dataset_id in dataset_ids for block_id in block_id_maps[dataset_id].itervalues()]
+
+            self._snapshot_rows('block_replicas', ('block_id', 'site_id'), keys)
+            self._snapshot_rows('block_replica_sizes', ('block_id', 'site_id'), keys)
+            self._delete_by_keys(['block_replicas', 'block_replica_sizes'], ('block_id', 'site_id'), keys)
 
     def _do_delete_blockreplicas(self, replica_list): #override
         # Mass block replica deletion typically happens for a few sites and a few datasets.
-        # Fetch site id first to avoid a long query.
+        # Fetch the block ids of the datasets at once and delete by (block, site).
+
+        site_id_map = {}
+        self._make_site_map(list(set(r.site for r in replica_list)), site_id_map = site_id_map)
+        dataset_id_map = {}
+        self._make_dataset_map(list(set(r.block.dataset for r in replica_list)), dataset_id_map = dataset_id_map)
+
+        block_id_maps = self._make_block_maps(dataset_id_map.values())
+
+        keys = set() # (block_id, site_id)
+        for replica in replica_list:
+            try:
+                site_id = site_id_map[replica.site]
+                block_id = block_id_maps[dataset_id_map[replica.block.dataset]][replica.block.name]
+            except KeyError:
+                # not in the store
+                continue
 
-        sites = list(set([r.site for r in replica_list])) # list of unique sites
-        datasets = list(set([r.block.dataset for r in replica_list])) # list of unique sites
+            keys.add((block_id, site_id))
 
-        site_names = ','.join(['\'%s\'' % s.name for s in sites])
-        dataset_names = ','.join(['\'%s\'' % d.name for d in datasets])
+        if len(keys) == 0:
+            return
 
-        site_ids = {}
-        dataset_ids = {}
+        keys = list(keys)
 
-        sql = 'SELECT `name`, `id` FROM `sites` WHERE `name` IN ({names})'
-        result = self._mysql.query(sql.format(names = site_names))
-        for site_name, site_id in result:
-            site = next(s for s in sites if s.name == site_name)
-            site_ids[site] = site_id
+        self._snapshot_rows('block_replicas', ('block_id', 'site_id'), keys)
+        self._snapshot_rows('block_replica_sizes', ('block_id', 'site_id'), keys)
 
-        sql = 'SELECT `name`, `id` FROM `datasets` WHERE `name` IN ({names})'
-        result = self._mysql.query(sql.format(names = dataset_names))
-        for dataset_name, dataset_id in result:
-            dataset = next(d for d in datasets if d.name == dataset_name)
-            dataset_ids[dataset] = dataset_id
+        self._delete_by_keys(['block_replicas', 'block_replica_sizes'], ('block_id', 'site_id'), keys)
 
-        for site, site_id in site_ids.items():
-            replicas_on_site = [r for r in replica_list if r.site == site]
-            ids_str = ','.join(['%d' % dataset_ids[r.block.dataset] for r in replicas_on_site])
+    def _delete_by_keys(self, tables, key, keys):
+        """
+        Delete the rows with the given keys from the tables with one join per table. The keys are loaded into a
+        temporary table, and the tables are locked during the deletion so that readers see all or none of it.
+        @param tables  List of table names; all must have the key columns
+        @param key     Tuple of key column names
+        @param keys    List of unique key tuples
+        """
 
-            sql = 'DELETE FROM br USING `block_replicas` AS br'
-            sql += ' INNER JOIN `blocks` AS b ON b.`id` = br.`block_id`'
-            sql += ' WHERE br.`site_id` = %d AND b.`dataset_id` IN (%s)' % (site_id, ids_str)
+        key_table = 'delete_keys_tmp'
+        key_str = ','.join('`%s`' % c for c in key)
 
-            self._mysql.query(sql)
+        self._mysql.query('DROP TEMPORARY TABLE IF EXISTS `%s`' % key_table)
+        self._mysql.query('CREATE TEMPORARY TABLE `{tmp}` (PRIMARY KEY ({key})) ENGINE=MEMORY SELECT {key} FROM `{table}` LIMIT 0'.format(tmp = key_table, key = key_str, table = tables[0]))
 
-            sql = 'DELETE FROM brs USING `block_replica_sizes` AS brs'
-            sql += ' INNER JOIN `blocks` AS b ON b.`id` = brs.`block_id`'
-            sql += ' WHERE brs.`site_id` = %d AND b.`dataset_id` IN (%s)' % (site_id, ids_str)
+        try:
+            self._mysql.load_many(key_table, key, None, keys, do_update = False)
 
-            self._mysql.query(sql)
+            self._mysql.query('LOCK TABLES ' + ', '.join('`%s` WRITE' % table for table in tables))
+
+            try:
+                for table in tables:
+                    join = ' AND '.join('`{table}`.`{c}` = `{tmp}`.`{c}`'.format(table = table, tmp = key_table, c = c) for c in key)
+                    self._mysql.query('DELETE `{table}` FROM `{table}` INNER JOIN `{tmp}` ON {join}'.format(table = table, tmp = key_table, join = join))
+
+            finally:
+                self._mysql.query('UNLOCK TABLES')
+
+        finally:
+            self._mysql.query('DROP TEMPORARY TABLE IF EXISTS `%s`' % key_table)
 
     def _do_set_dataset_status(self, dataset_name, status_str): #override
+        self._snapshot_rows('datasets', 'id', self._mysql.query('SELECT `id` FROM `datasets` WHERE `name` LIKE %s', dataset_name))
         self._mysql.query('UPDATE `datasets` SET `status` = %s WHERE `name` LIKE %s', status_str, dataset_name)
 
     def _make_site_map(self, sites, site_id_map = None, id_site_map = None):
-        self._make_map('sites', sites, site_id_map, id_site_map)
+        self._make_map('sites', sites, site_id_map, id_site_map, 0)
 
     def _make_group_map(self, groups, group_id_map = None, id_group_map = None):
-        self._make_map('groups', groups, group_id_map, id_group_map)
+        self._make_map('groups', groups, group_id_map, id_group_map, 0)
         if group_id_map is not None:
             group_id_map[None] = 0
         if id_group_map is not None:
             id_group_map[0] = None
 
+    def _dataset_id_ranges(self, dataset_ids):
+        """
+        Split the dataset ids into contiguous (first, last) ranges with equal numbers of ids for parallel loading.
+        Return [None] (one unrestricted range) if the load is serial.
+        """
+
+        num_connections = config.mysqlstore.load_connections
+        if num_connections <= 1 or len(dataset_ids) == 0:
+            return [None]
+
+        dataset_ids = sorted(dataset_ids)
+
+        num_ranges = min(num_connections * config.mysqlstore.load_ranges_per_connection, len(dataset_ids))
+        range_size = (len(dataset_ids) + num_ranges - 1) / num_ranges
+
+        ranges = []
+        for first in xrange(0, len(dataset_ids), range_size):
+            last = min(first + range_size, len(dataset_ids)) - 1
+            ranges.append((dataset_ids[first], dataset_ids[last]))
+
+        return ranges
+
+    def _range_query(self, sql, conditions, column, id_range, order_by):
+        if id_range is not None:
+            conditions = conditions + ['%s BETWEEN %d AND %d' % (column, id_range[0], id_range[1])]
+
+        if len(conditions) != 0:
+            sql += ' WHERE ' + (' AND '.join(conditions))
+
+        return sql + ' ORDER BY ' + order_by
+
     def _make_dataset_map(self, datasets, dataset_id_map = None, id_dataset_map = None):
-        self._make_map('datasets', datasets, dataset_id_map, id_dataset_map, tmp_join = (len(datasets) < 1000))
+        self._make_map('datasets', datasets, dataset_id_map, id_dataset_map, config.mysqlstore.id_lookup_max)
+
+    def _make_map(self, table, objects, object_id_map, id_object_map, lookup_max):
+        """
+        Fill the object -> id and id -> object maps from the id cache of the table. Names missing in the cache are
+        looked up by name, or the whole table is read if there are more than lookup_max of them.
+        """
 
-    def _make_map(self, table, objects, object_id_map, id_object_map, tmp_join = False):
         logger.debug('make_map %s (%d) obejcts', table, len(objects))
 
         if len(objects) == 0:
             return
 
-        if tmp_join:
-            tmp_table = '%s_map_tmp' % table
-            if self._mysql.table_exists(tmp_table):
-                self._mysql.query('DROP TABLE `%s`' % tmp_table)
-
-            self._mysql.query('CREATE TABLE `%s` (`name` varchar(512) CHARACTER SET latin1 COLLATE latin1_general_cs NOT NULL, PRIMARY KEY (`name`)) ENGINE=MyISAM DEFAULT CHARSET=latin1' % tmp_table)
-            obj_names = [(obj.name,) for obj in objects]
-            self._mysql.insert_many(tmp_table, ('name',), None, obj_names)
+        name_to_id = self._id_cache[table]
 
-            name_to_id = dict(self._mysql.query('SELECT t1.`name`, t1.`id` FROM `%s` AS t1 INNER JOIN `%s` AS t2 ON t2.`name` = t1.`name`' % (table, tmp_table)))
+        missing = set(obj.name for obj in objects if obj.name not in name_to_id)
 
-            self._mysql.query('DROP TABLE `%s`' % tmp_table)
-
-        else:
-            name_to_id = dict(self._mysql.query('SELECT `name`, `id` FROM `%s`' % table))
+        if len(missing) > lookup_max:
+            name_to_id.update(self._mysql.xquery('SELECT `name`, `id` FROM `%s`' % table))
+        elif len(missing) != 0:
+            name_to_id.update(self._mysql.xselect_many(table, ('name', 'id'), 'name', list(missing)))
 
         for obj in objects:
             try:
@@ -1099,3 +1797,42 @@ class MySQLStore(LocalStoreInterface):
                 object_id_map[obj] = obj_id
             if id_object_map is not None:
                 id_object_map[obj_id] = obj
+
+    def _make_block_maps(self, dataset_ids):
+        """
+        Return {dataset_id: {block name: block_id}} for the datasets, from the block id cache. Datasets missing in the
+        cache are read in one query.
+        """
+
+        missing = [i for i in set(dataset_ids) if i not in self._block_id_cache]
+        for dataset_id in missing:
+            self._block_id_cache[dataset_id] = {}
+
+        for dataset_id, block_id, name in self._mysql.xselect_many('blocks', ('dataset_id', 'id', 'name'), 'dataset_id', missing):
+            self._block_id_cache[dataset_id][Block.translate_name(name)] = block_id
+
+        return dict((i, self._block_id_cache[i]) for i in dataset_ids)
+
+    def _validate_id_cache(self):
+        last_update = self._do_get_last_update()
+        if last_update != self._id_cache_stamp:
+            # the store was written by someone else
+            self._clear_id_cache()
+            self._id_cache_stamp = last_update
+
+    def _clear_id_cache(self):
+        for name_to_id in self._id_cache.itervalues():
+            name_to_id.clear()
+
+        self._block_id_cache = {}
+        self._id_cache_stamp = None
+        self._dataset_entries_stamp = None
+
+    def _forget_datasets(self, dataset_names, dataset_ids):
+        # drop deleted datasets from the id caches
+        name_to_id = self._id_cache['datasets']
+        for name in dataset_names:
+            name_to_id.pop(name, None)
+
+        for dataset_id in dataset_ids:
+            self._block_id_cache.pop(dataset_id, None)
@@ -484,25 +484,31 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
 
             # process retrieved data under a lock - otherwise can cause inconsistencies when e.g. block info is updated between one phedex call and another.
             with lock:
+                # datasets and blocks of this chunk are loaded from the store in bulk
+                ds_names = [dataset_entry['name'] for dataset_entry in source if 'block' in dataset_entry]
+                stored_datasets = inventory.store.load_datasets([n for n in ds_names if n not in inventory.datasets], load_blocks = True)
+                stored_datasets = dict((d.name, d) for d in stored_datasets)
+                inventory.store.load_blocks([inventory.datasets[n] for n in ds_names if n in inventory.datasets and inventory.datasets[n].blocks is None])
+
                 for dataset_entry in source:
                     if 'block' not in dataset_entry:
                         continue
                     
                     ds_name = dataset_entry['name']
 
+                    new_dataset = False
+
                     try:
                         dataset = inventory.datasets[ds_name]
-                        new_dataset = False
                     except KeyError:
-                        dataset = inventory.store.load_dataset(ds_name, load_blocks = True, load_files = False)
-                        if dataset is None:
+                        try:
+                            dataset = stored_datasets[ds_name]
+                        except KeyError:
                             dataset = Dataset(ds_name, status = Dataset.STAT_PRODUCTION)
-                            inventory.datasets[ds_name] = dataset
                             new_dataset = True
                             counters['new_datasets'] += 1
 
-                    if dataset.blocks is None:
-                        inventory.store.load_blocks(dataset)
+                        inventory.datasets[ds_name] = dataset
 
                     dataset.is_open = (dataset_entry['is_open'] == 'y')
 
@@ -539,7 +545,7 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
                                 is_open = (block_entry['is_open'] == 'y')
                             )
 
-                            dataset.blocks.append(block)
+                            dataset.add_block(block)
                             dataset.size += block.size
                             dataset.num_files += block.num_files
                             if dataset.status == Dataset.STAT_VALID:
@@ -586,9 +592,9 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
                                     last_block_created = 0
                                 )
     
-                                dataset.replicas.append(dataset_replica)
+                                dataset.add_replica(dataset_replica)
 
-                                site.dataset_replicas.add(dataset_replica)
+                                site.add_dataset_replica(dataset_replica)
     
                             if replica_entry['time_update'] > dataset_replica.last_block_created:
                                 dataset_replica.last_block_created = replica_entry['time_update']
@@ -605,16 +611,13 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
                             if is_custodial:
                                 dataset_replica.is_custodial = True
     
-                            block_replica = BlockReplica(
+                            block_replica = dataset_replica.new_block_replica(
                                 block,
-                                site,
                                 group,
                                 is_complete, 
                                 is_custodial,
-                                size = replica_entry['bytes']
+                                replica_entry['bytes']
                             )
-    
-                            dataset_replica.block_replicas.append(block_replica)
 
                             site.add_block_replica(block_replica)
 
@@ -661,7 +664,7 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
             # check for potentially invalidated blocks
             blocks_with_replicas = set()
             for replica in dataset.replicas:
-                blocks_with_replicas.update([r.block for r in replica.block_replicas])
+                blocks_with_replicas.update([r.block for r in replica.iter_block_replicas()])
 
             if blocks_with_replicas != set(dataset.blocks):
                 counters['datasets_with_updated_blocklist'] += 1
@@ -674,6 +677,218 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
         logger.info(' %d datasets with updated blocks', counters['datasets_with_updated_blocks'])
         logger.info(' %d datasets with updated blocklist', counters['datasets_with_updated_blocklist'])
 
+    def supports_incremental_update(self): #override (ReplicaInfoSourceInterface)
+        return True
+
+    def update_replica_links(self, inventory, since): #override (ReplicaInfoSourceInterface)
+        """
+        Apply block replica changes since the given time to the inventory.
+        1. Call PhEDEx blockreplicas with update_since to obtain new and updated block replicas
+          1.1 Unknown dataset or block -> load from the store or create, as in make_replica_links
+          1.2 Block updated -> update block and set dataset.status to PRODUCTION
+          1.3 Replace the block replica if any of its attributes changed
+        2. Call PhEDEx deletions with complete_since to obtain block replicas deleted since then
+          2.1 Skip deletions of replicas that were recreated (appear in 1) or created after the deletion
+
+        @param inventory  InventoryManager instance
+        @param since      UNIX timestamp
+        @return  (list of new or updated block replicas, list of removed or replaced block replicas)
+        """
+
+        logger.info('update_replica_links  Fetching block replica changes since %s from PhEDEx', time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(since)))
+
+        updated_replicas = []
+        removed_replicas = []
+
+        source = self._make_phedex_request('blockreplicas', ['show_dataset=y', 'update_since=%d' % since])
+
+        # load all datasets and blocks of the update in bulk
+        ds_names = [dataset_entry['name'] for dataset_entry in source if 'block' in dataset_entry]
+        stored_datasets = inventory.store.load_datasets([n for n in ds_names if n not in inventory.datasets], load_blocks = True)
+        stored_datasets = dict((d.name, d) for d in stored_datasets)
+        inventory.prefetch_blocks([inventory.datasets[n] for n in ds_names if n in inventory.datasets])
+
+        for dataset_entry in source:
+            if 'block' not in dataset_entry:
+                continue
+
+            ds_name = dataset_entry['name']
+
+            try:
+                dataset = inventory.datasets[ds_name]
+            except KeyError:
+                try:
+                    dataset = stored_datasets[ds_name]
+                except KeyError:
+                    dataset = Dataset(ds_name, status = Dataset.STAT_PRODUCTION)
+                    dataset.blocks = []
+
+                inventory.datasets[ds_name] = dataset
+
+            if dataset.blocks is None:
+                dataset.blocks = []
+
+            if dataset.replicas is None:
+                dataset.replicas = []
+
+            dataset.is_open = (dataset_entry['is_open'] == 'y')
+
+            for block_entry in dataset_entry['block']:
+                try:
+                    block_name = Block.translate_name(block_entry['name'].replace(ds_name + '#', ''))
+                except:
+                    logger.error('Invalid block name %s in blockreplicas', ds_name)
+                    continue
+
+                block = dataset.find_block(block_name)
+
+                if block is None:
+                    block = Block(
+                        block_name,
+                        dataset = dataset,
+                        size = block_entry['bytes'],
+                        num_files = block_entry['files'],
+                        is_open = (block_entry['is_open'] == 'y')
+                    )
+
+                    dataset.add_block(block)
+                    dataset.size += block.size
+                    dataset.num_files += block.num_files
+                    if dataset.status == Dataset.STAT_VALID:
+                        dataset.status = Dataset.STAT_PRODUCTION # trigger DBS query
+
+                elif block.size != block_entry['bytes'] or block.num_files != block_entry['files'] or block.is_open != (block_entry['is_open'] == 'y'):
+                    block = dataset.update_block(block_name, block_entry['bytes'], block_entry['files'], (block_entry['is_open'] == 'y'))
+                    if dataset.status == Dataset.STAT_VALID:
+                        dataset.status = Dataset.STAT_PRODUCTION
+
+                for replica_entry in block_entry['replica']:
+                    try:
+                        site = inventory.sites[replica_entry['node']]
+                    except KeyError:
+                        continue
+
+                    if replica_entry['group'] is not None:
+                        try:
+                            group = inventory.groups[replica_entry['group']]
+                        except KeyError:
+                            continue
+                    else:
+                        group = None
+
+                    dataset_replica = dataset.find_replica(site)
+                    if dataset_replica is None:
+                        dataset_replica = DatasetReplica(
+                            dataset,
+                            site,
+                            is_complete = True,
+                            is_custodial = False,
+                            last_block_created = 0
+                        )
+
+                        dataset.add_replica(dataset_replica)
+                        site.add_dataset_replica(dataset_replica)
+
+                    if replica_entry['time_update'] > dataset_replica.last_block_created:
+                        dataset_replica.last_block_created = replica_entry['time_update']
+
+                    # PhEDEx 'complete' flag cannot be trusted; defining completeness in terms of size.
+                    is_complete = (replica_entry['bytes'] == block.size)
+                    is_custodial = (replica_entry['custodial'] == 'y')
+
+                    existing = site.find_block_replica(block)
+                    if existing is not None:
+                        if existing.group == group and existing.is_complete == is_complete and \
+                                existing.is_custodial == is_custodial and existing.size == replica_entry['bytes']:
+                            continue
+
+                        dataset_replica.remove_block_replica(existing)
+                        site.remove_block_replica(existing)
+                        removed_replicas.append(existing)
+
+                    block_replica = dataset_replica.new_block_replica(
+                        block,
+                        group,
+                        is_complete,
+                        is_custodial,
+                        replica_entry['bytes']
+                    )
+
+                    site.add_block_replica(block_replica)
+
+                    updated_replicas.append(block_replica)
+
+        updated_blocks = set((r.site, r.block.dataset, r.block.name) for r in updated_replicas)
+
+        source = self._make_phedex_request('deletions', ['complete_since=%d' % since])
+
+        for dataset_entry in source:
+            try:
+                dataset = inventory.datasets[dataset_entry['name']]
+            except KeyError:
+                continue
+
+            if dataset.replicas is None or dataset.blocks is None:
+                continue
+
+            # (block, deletion) pairs. A dataset-level deletion covers all blocks
+            deletions = []
+            for deletion_entry in dataset_entry.get('deletion', []):
+                deletions.extend((block, deletion_entry) for block in dataset.blocks)
+
+            for block_entry in dataset_entry.get('block', []):
+                try:
+                    block_name = Block.translate_name(block_entry['name'].replace(dataset.name + '#', ''))
+                except:
+                    logger.error('Invalid block name %s in deletions', dataset.name)
+                    continue
+
+                block = dataset.find_block(block_name)
+                if block is None:
+                    continue
+
+                deletions.extend((block, deletion_entry) for deletion_entry in block_entry.get('deletion', []))
+
+            for block, deletion_entry in deletions:
+                if deletion_entry.get('time_complete') is None:
+                    continue
+
+                try:
+                    site = inventory.sites[deletion_entry['node']]
+                except KeyError:
+                    continue
+
+                if (site, dataset, block.name) in updated_blocks:
+                    continue
+
+                dataset_replica = dataset.find_replica(site)
+                if dataset_replica is None or dataset_replica.last_block_created > deletion_entry['time_complete']:
+                    continue
+
+                block_replica = site.find_block_replica(block)
+                if block_replica is None:
+                    continue
+
+                dataset_replica.remove_block_replica(block_replica)
+                site.remove_block_replica(block_replica)
+
+                removed_replicas.append(block_replica)
+
+        # the dataset replica flags summarize the block replicas, as in make_replica_links
+        changed_dataset_replicas = set()
+        for block_replica in updated_replicas + removed_replicas:
+            dataset_replica = block_replica.block.dataset.find_replica(block_replica.site)
+            if dataset_replica is not None:
+                changed_dataset_replicas.add(dataset_replica)
+
+        for dataset_replica in changed_dataset_replicas:
+            dataset_replica.is_complete = all(r.is_complete for r in dataset_replica.iter_block_replicas())
+            dataset_replica.is_custodial = any(r.is_custodial for r in dataset_replica.iter_block_replicas())
+
+        logger.info('update_replica_links  %d new or updated, %d removed or replaced block replicas.', len(updated_replicas), len(removed_replicas))
+
+        return updated_replicas, removed_replicas
+
     def find_tape_copies(self, datasets): #override (ReplicaInfoSourceInterface)
         """
         Use 'subscriptions' query to check if all blocks of the dataset are on tape.
@@ -945,7 +1160,7 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
                                 num_files = block_entry['files'],
                                 is_open = (block_entry['is_open'] == 'y')
                             )
-                            dataset.blocks.append(block)
+                            dataset.add_block(block)
 
                             dataset.size += block.size
                             dataset.num_files += block.num_files
@@ -968,7 +1183,7 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
                     if dataset.files is None:
                         dataset.files = set()
                         for file_info in files:
-                            dataset.files.add(File.create(*file_info))
+                            dataset.add_file(File.create(*file_info))
 
                     else:
                         # file structure already exists for the dataset. compare to query results and update.
@@ -992,7 +1207,7 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
                             elif iknown == len(known_files):
                                 # all remaining files are new
                                 for file_info in files[isource:]:
-                                    dataset.files.add(File.create(*file_info))
+                                    dataset.add_file(File.create(*file_info))
                                 break
     
                             else:
@@ -1012,7 +1227,7 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
     
                                 elif pathcmp < 0:
                                     # new file
-                                    dataset.files.add(File.create(phed_name, block, phed_size))
+                                    dataset.add_file(File.create(phed_name, block, phed_size))
                                     isource += 1
     
                                 else:
@@ -1022,7 +1237,7 @@ class PhEDExDBSSSB(CopyInterface, DeletionInterface, SiteInfoSourceInterface, Re
     
                         for lfile in invalidated_files:
                             logger.info('Removing file %s from dataset %s', lfile.fullpath(), dataset.name)
-                            dataset.files.remove(lfile)
+                            dataset.remove_file(lfile)
 
 
         # set_constituent can take 10000 datasets at once, make it smaller and more parallel
@@ -1287,7 +1502,7 @@ if __name__ == '__main__':
                 block = Block(Block.translate_name(block_name), dataset, 0, 0, False)
                 # don't add the block to dataset (otherwise will become a dataset-level operation)
                 block_replica = BlockReplica(block, site, group, True, False, 0)
-                dataset_replica.block_replicas.append(block_replica)
+                dataset_replica.add_block_replica(block_replica)
 
         comments = ' '.join(args.options[iopt:])
 
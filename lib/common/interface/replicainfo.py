@@ -41,3 +41,21 @@ class ReplicaInfoSourceInterface(object):
         @param dataset_filt Limit to replicas of datasets matching the pattern.
         """
         pass
+
+    def supports_incremental_update(self):
+        """
+        Return True if update_replica_links is implemented.
+        """
+
+        return False
+
+    def update_replica_links(self, inventory, since):
+        """
+        Apply the changes to block replicas since the given time to the replica objects in the inventory.
+        Replica information must be loaded. Dataset replicas left with no block replicas are not unlinked.
+
+        @param inventory  InventoryManager instance
+        @param since      UNIX timestamp
+        @return  (list of new or updated block replicas, list of removed or replaced block replicas)
+        """
+        raise NotImplementedError('update_replica_links')
@@ -50,7 +50,11 @@ class LocalStoreInterface(object):
         finally:
             self.release_lock()
 
-    def set_last_update(self, tm = time.time()):
+    def set_last_update(self, tm = None):
+        # last_update also tags the inventory image - every write must move it forward
+        if tm is None:
+            tm = time.time()
+
         self.last_update = tm
 
         if config.read_only:
@@ -63,6 +67,30 @@ class LocalStoreInterface(object):
         finally:
             self.release_lock()
 
+    def get_replicas_last_update(self):
+        """
+        Return the time of the last successful update of the replica information (full or incremental).
+        """
+
+        logger.debug('_do_get_replicas_last_update()')
+
+        self.acquire_lock()
+        try:
+            return self._do_get_replicas_last_update()
+        finally:
+            self.release_lock()
+
+    def set_replicas_last_update(self, tm):
+        if config.read_only:
+            logger.debug('_do_set_replicas_last_update(%f)', tm)
+            return
+
+        self.acquire_lock()
+        try:
+            self._do_set_replicas_last_update(tm)
+        finally:
+            self.release_lock()
+
     def make_snapshot(self, clear = CLEAR_NONE, tag = ''):
         """
         Make a snapshot of the current state of the persistent inventory. Flag clear = True
@@ -118,6 +146,7 @@ class LocalStoreInterface(object):
         self.acquire_lock()
         try:
             self._do_clear()
+            self.set_last_update()
         finally:
             self.release_lock()
 
@@ -192,17 +221,18 @@ class LocalStoreInterface(object):
 
         return site_names
 
-    def load_data(self, site_filt = '*', dataset_filt = '/*/*/*', load_blocks = False, load_files = False, load_replicas = True):
+    def load_data(self, site_filt = '*', dataset_filt = '/*/*/*', load_blocks = False, load_files = False, load_replicas = True, lazy_blocks = False):
         """
         Return lists loaded from persistent storage. Argument site_filt can be a wildcard string or a list
-        of exact site names.
+        of exact site names. With lazy_blocks = True and load_replicas = True, blocks are loaded only for datasets
+        with replicas that are not full; other datasets are returned with blocks = None (see load_blocks).
         """
 
         logger.debug('_do_load_data()')
 
         self.acquire_lock()
         try:
-            site_list, group_list, dataset_list = self._do_load_data(site_filt, dataset_filt, load_blocks, load_files, load_replicas)
+            site_list, group_list, dataset_list = self._do_load_data(site_filt, dataset_filt, load_blocks, load_files, load_replicas, lazy_blocks)
         finally:
             self.release_lock()
 
@@ -223,29 +253,52 @@ class LocalStoreInterface(object):
 
         return dataset
 
-    def load_blocks(self, dataset):
+    def load_datasets(self, dataset_names, load_blocks = False, load_files = False):
         """
-        Load files for the given dataset.
+        Load a list of datasets and create Dataset objects. Datasets not in the store are skipped.
+        @param dataset_names  List of dataset names
+        @return List of datasets
         """
 
+        logger.debug('_do_load_datasets()')
+
+        self.acquire_lock()
+        try:
+            datasets = self._do_load_datasets(dataset_names, load_blocks, load_files)
+        finally:
+            self.release_lock()
+
+        return datasets
+
+    def load_blocks(self, datasets):
+        """
+        Load blocks for the given dataset or list of datasets.
+        """
+
+        if type(datasets) is Dataset:
+            datasets = [datasets]
+
         logger.debug('_do_load_blocks()')
 
         self.acquire_lock()
         try:
-            self._do_load_blocks(dataset)
+            self._do_load_blocks(datasets)
         finally:
             self.release_lock()
 
-    def load_files(self, dataset):
+    def load_files(self, datasets):
         """
-        Load files for the given dataset.
+        Load files for the given dataset or list of datasets. Blocks must be loaded.
         """
 
+        if type(datasets) is Dataset:
+            datasets = [datasets]
+
         logger.debug('_do_load_files()')
         
         self.acquire_lock()
         try:
-            self._do_load_files(dataset)
+            self._do_load_files(datasets)
         finally:
             self.release_lock()
 
@@ -387,9 +440,10 @@ class LocalStoreInterface(object):
         finally:
             self.release_lock()
 
-    def add_datasetreplicas(self, replicas):
+    def add_datasetreplicas(self, replicas, add_blockreplicas = True):
         """
         Insert a few replicas instead of saving the full list.
+        If add_blockreplicas is True, insert the block replicas of the dataset replicas too.
         """
 
         if config.read_only:
@@ -398,7 +452,7 @@ class LocalStoreInterface(object):
 
         self.acquire_lock()
         try:
-            self._do_add_datasetreplicas(replicas)
+            self._do_add_datasetreplicas(replicas, add_blockreplicas)
             self.set_last_update()
         finally:
             self.release_lock()
@@ -431,6 +485,7 @@ class LocalStoreInterface(object):
         self.acquire_lock()
         try:
             self._do_delete_dataset(dataset)
+            self.set_last_update()
         finally:
             self.release_lock()
 
@@ -446,6 +501,7 @@ class LocalStoreInterface(object):
         self.acquire_lock()
         try:
             self._do_delete_datasets(datasets)
+            self.set_last_update()
         finally:
             self.release_lock()
 
@@ -461,6 +517,7 @@ class LocalStoreInterface(object):
         self.acquire_lock()
         try:
             self._do_delete_block(block)
+            self.set_last_update()
         finally:
             self.release_lock()
 
@@ -496,6 +553,7 @@ class LocalStoreInterface(object):
         try:
             for site in sites:
                 self._do_delete_datasetreplicas(site, datasets_on_site[site], delete_blockreplicas)
+            self.set_last_update()
         finally:
             self.release_lock()
 
@@ -522,6 +580,7 @@ class LocalStoreInterface(object):
         self.acquire_lock()
         try:
             self._do_delete_blockreplicas(replica_list)
+            self.set_last_update()
         finally:
             self.release_lock()
 
@@ -545,6 +604,7 @@ class LocalStoreInterface(object):
         self.acquire_lock()
         try:
             self._do_set_dataset_status(dataset_name, status_str)
+            self.set_last_update()
         finally:
             self.release_lock()
 
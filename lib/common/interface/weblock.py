@@ -63,6 +63,8 @@ class WebReplicaLock(object):
 
             if content_type == WebReplicaLock.LIST_OF_DATASETS:
                 # simple list of datasets
+                self._prefetch_blocks(inventory, data)
+
                 for dataset_name in data:
                     if dataset_name is None:
                         logger.debug('Dataset name None found in %s', source.url_base)
@@ -84,12 +86,14 @@ class WebReplicaLock(object):
 
                     for replica in dataset.replicas:
                         if replica.site in locked_blocks:
-                            locked_blocks[replica.site].update(brep.block for brep in replica.block_replicas)
+                            locked_blocks[replica.site].update(brep.block for brep in replica.iter_block_replicas())
                         else:
-                            locked_blocks[replica.site] = set(brep.block for brep in replica.block_replicas)
+                            locked_blocks[replica.site] = set(brep.block for brep in replica.iter_block_replicas())
 
             elif content_type == WebReplicaLock.CMSWEB_LIST_OF_DATASETS:
                 # data['result'] -> simple list of datasets
+                self._prefetch_blocks(inventory, data['result'])
+
                 for dataset_name in data['result']:
                     if dataset_name is None:
                         logger.debug('Dataset name None found in %s', source.url_base)
@@ -111,12 +115,14 @@ class WebReplicaLock(object):
 
                     for replica in dataset.replicas:
                         if replica.site in locked_blocks:
-                            locked_blocks[replica.site].update(brep.block for brep in replica.block_replicas)
+                            locked_blocks[replica.site].update(brep.block for brep in replica.iter_block_replicas())
                         else:
-                            locked_blocks[replica.site] = set(brep.block for brep in replica.block_replicas)
+                            locked_blocks[replica.site] = set(brep.block for brep in replica.iter_block_replicas())
                 
             elif content_type == WebReplicaLock.SITE_TO_DATASETS:
                 # data = {site: {dataset: info}}
+                self._prefetch_blocks(inventory, (object_name.partition('#')[0] for objects in data.itervalues() for object_name in objects))
+
                 for site_name, objects in data.items():
                     try:
                         site = inventory.sites[site_name]
@@ -149,9 +155,6 @@ class WebReplicaLock(object):
                             logger.debug('Replica of %s is not at %s in %s', dataset_name, site_name, source.url_base)
                             continue
 
-                        if dataset.blocks is None:
-                            inventory.store.load_blocks(dataset)
-
                         if block_real_name is None:
                             blocks = list(dataset.blocks)
                         else:
@@ -172,6 +175,20 @@ class WebReplicaLock(object):
                         else:
                             locked_blocks[site] = set(blocks)
 
+    def _prefetch_blocks(self, inventory, dataset_names):
+        # load the blocks of all locked datasets of a source at once
+        datasets = []
+        for dataset_name in dataset_names:
+            try:
+                dataset = inventory.datasets[dataset_name]
+            except KeyError:
+                continue
+
+            if dataset.replicas is not None:
+                datasets.append(dataset)
+
+        inventory.prefetch_blocks(datasets)
+
 
 if __name__ == '__main__':
     # Unit test
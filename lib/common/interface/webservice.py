@@ -119,9 +119,12 @@ class RESTService(object):
         if method == GET and self._cache_lock is not None and cache_lifetime > 0:
             with self._cache_lock:
                 try:
+                    # connections come from the shared pool; close() returns it
                     db = MySQL(**config.webservice.cache_db_params)
-                    cache = db.query('SELECT UNIX_TIMESTAMP(`timestamp`), `content` FROM `webservice` WHERE `url` = %s', url)
-                    db.close()
+                    try:
+                        cache = db.query('SELECT UNIX_TIMESTAMP(`timestamp`), `content` FROM `webservice` WHERE `url` = %s', url)
+                    finally:
+                        db.close()
                 except:
                     logger.error('Connection to cache DB failed when fetching the timestamp for %s.', url)
                     cache = []
@@ -203,9 +206,11 @@ class RESTService(object):
                     with self._cache_lock:
                         try:
                             db = MySQL(**config.webservice.cache_db_params)
-                            db.query('DELETE FROM `webservice` WHERE `url` = %s', url)
-                            db.query(r"LOAD DATA LOCAL INFILE '%s' INTO TABLE `dynamocache`.`webservice` FIELDS TERMINATED BY ',' ENCLOSED BY '\''" % filename)
-                            db.close()
+                            try:
+                                db.query('DELETE FROM `webservice` WHERE `url` = %s', url)
+                                db.query(r"LOAD DATA LOCAL INFILE '%s' INTO TABLE `dynamocache`.`webservice` FIELDS TERMINATED BY ',' ENCLOSED BY '\''" % filename)
+                            finally:
+                                db.close()
                         except:
                             logger.error('Connection to cache DB failed when writing the response of %s.', url)
                             pass
@@ -1,10 +1,14 @@
 import logging
+import time
+import collections
 import fnmatch
 import re
 
 from common.interface.classes import default_interface
 from common.interface.store import LocalStoreInterface
-from common.dataformat import IntegrityError, Dataset, Site, DatasetReplica, BlockReplica
+from common.inventoryimage import InventoryImage
+from common.inventoryjournal import InventoryJournal
+from common.dataformat import IntegrityError, Dataset, File, Site, DatasetReplica, BlockReplica, BlockReplicaStore
 import common.configuration as config
 
 logger = logging.getLogger(__name__)
@@ -17,6 +21,59 @@ class ConsistencyError(Exception):
 # Create partitions
 Site.set_partitions(config.inventory.partitions)
 
+class LazyBlockLoader(object):
+    """
+    Loads the blocks of a dataset from the inventory when Dataset.blocks is first accessed. Blocks of other datasets
+    waiting to be loaded are fetched together, up to batch_size datasets per store query.
+    If max_datasets is positive, blocks of the datasets loaded earliest are dropped from memory (when no replica or file
+    refers to them) so that at most max_datasets datasets have blocks loaded through this object. Dropped blocks are
+    loaded again on the next access.
+    """
+
+    def __init__(self, inventory, batch_size, max_datasets = 0):
+        self._inventory = inventory
+        self._batch_size = max(batch_size, 1)
+        self._max_datasets = max_datasets
+
+        self._pending = collections.OrderedDict() # {dataset: None} for datasets whose blocks are not in memory
+        self._loaded = collections.deque() # datasets with blocks loaded through this object, earliest first
+
+    def add(self, dataset):
+        self._pending[dataset] = None
+
+    def num_pending(self):
+        return len(self._pending)
+
+    def load(self, dataset):
+        try:
+            self._pending.pop(dataset)
+        except KeyError:
+            # not managed by this loader
+            return
+
+        batch = [dataset]
+        while len(batch) < self._batch_size and len(self._pending) != 0:
+            pending = self._pending.popitem(last = False)[0]
+            # could have been loaded through InventoryManager.prefetch_blocks
+            if not pending.blocks_loaded():
+                batch.append(pending)
+
+        logger.debug('Loading blocks of %d datasets.', len(batch))
+
+        self._inventory.load_blocks(batch)
+
+        if self._max_datasets <= 0:
+            return
+
+        self._loaded.extend(batch)
+
+        num_candidates = len(self._loaded) - len(batch)
+        while len(self._loaded) > self._max_datasets and num_candidates > 0:
+            evicted = self._loaded.popleft()
+            num_candidates -= 1
+            if evicted.evict_blocks():
+                self._pending[evicted] = None
+
 class InventoryManager(object):
     """Bookkeeping class to bridge the communication between remote and local data sources."""
 
@@ -45,15 +102,26 @@ class InventoryManager(object):
         self.groups = {}
         self.datasets = {}
 
+        # whether the full replica information is in memory (required for incremental updates)
+        self.replicas_loaded = False
+
+        # changes to be written to the store with save_changes
+        self.journal = InventoryJournal()
+
+        # columnar backend of block replicas, if enabled in the configuration
+        self.block_replica_store = None
+        self._reset_block_replica_store()
+
         if load_data:
             self.load()
 
-    def load(self, load_blocks = True, load_files = False, load_replicas = True, dataset_filter = '/*/*/*'):
+    def load(self, load_blocks = True, load_files = False, load_replicas = True, dataset_filter = '/*/*/*', lazy_blocks = False):
         """
         Load information up to block level from local persistent storage to memory. The flag
         load_replicas can be used to determine whether dataset/block-site links should also be
         loaded; it is set to false when loading for an inventory update (link information is
-        volatile).
+        volatile). With lazy_blocks = True (only with load_blocks and load_replicas), blocks are
+        loaded only for datasets with partial replicas; the others are loaded on first access.
         """
 
         logger.info('Loading data from local persistent storage.')
@@ -61,24 +129,59 @@ class InventoryManager(object):
         self.sites = {}
         self.groups = {}
         self.datasets = {}
+
+        self.replicas_loaded = False
+
+        self._reset_block_replica_store()
+
+        lazy_blocks = lazy_blocks and load_blocks and load_replicas and not load_files
+        Dataset.set_block_loader(None)
         
         self.store.acquire_lock()
 
         try:
             site_names = self.store.get_site_list(include = config.inventory.included_sites, exclude = config.inventory.excluded_sites)
 
-            sites, groups, datasets = self.store.load_data(
-                site_filt = site_names,
-                dataset_filt = dataset_filter,
-                load_blocks = load_blocks,
-                load_files = load_files,
-                load_replicas = load_replicas
-            )
+            # the image only holds the default full load
+            use_image = config.inventory.image_path != '' and load_blocks and not load_files and load_replicas and dataset_filter == '/*/*/*' and not lazy_blocks
+
+            loaded = None
+            if use_image:
+                stamp = self.store.get_last_update()
+                loaded = InventoryImage.load(config.inventory.image_path, stamp, site_names)
+
+            if loaded is None:
+                sites, groups, datasets = self.store.load_data(
+                    site_filt = site_names,
+                    dataset_filt = dataset_filter,
+                    load_blocks = load_blocks,
+                    load_files = load_files,
+                    load_replicas = load_replicas,
+                    lazy_blocks = lazy_blocks
+                )
+            else:
+                sites, groups, datasets = loaded
+                self.store.last_update = stamp
 
             self.sites = dict((s.name, s) for s in sites)
             self.groups = dict((g.name, g) for g in groups)
             self.datasets = dict((d.name, d) for d in datasets)
 
+            if use_image and loaded is None:
+                self._save_image(site_names)
+
+            self.replicas_loaded = load_replicas and load_blocks and dataset_filter == '/*/*/*' and not lazy_blocks
+
+            if lazy_blocks:
+                loader = LazyBlockLoader(self, config.inventory.lazy_block_batch, config.inventory.lazy_block_max_datasets)
+                for dataset in self.datasets.itervalues():
+                    if dataset.blocks is None:
+                        loader.add(dataset)
+
+                Dataset.set_block_loader(loader)
+
+                logger.info('Blocks of %d datasets will be loaded on demand.', loader.num_pending())
+
             num_dataset_replicas = 0
             num_block_replicas = 0
 
@@ -88,15 +191,37 @@ class InventoryManager(object):
                         continue
     
                     num_dataset_replicas += len(dataset.replicas)
-                    num_block_replicas += sum(len(r.block_replicas) for r in dataset.replicas)
+                    if lazy_blocks:
+                        # do not trigger the loading
+                        num_block_replicas += sum(r.num_block_replicas() for r in dataset.replicas if not r.is_implicit())
+                    else:
+                        num_block_replicas += sum(r.num_block_replicas() for r in dataset.replicas)
 
         finally:
             self.store.release_lock()
 
-        logger.info('Data is loaded to memory. %d sites, %d groups, %d datasets, %d dataset replicas, %d block replicas.\n', len(self.sites), len(self.groups), len(self.datasets), num_dataset_replicas, num_block_replicas)
+        logger.info('Data is loaded to memory. %d sites, %d groups, %d datasets, %d dataset replicas, %d block replicas%s.\n', len(self.sites), len(self.groups), len(self.datasets), num_dataset_replicas, num_block_replicas, ' (excluding full replicas)' if lazy_blocks else '')
+
+    def update(self, dataset_filter = '/*/*/*', load_first = True, make_snapshot = True, incremental = False):
+        """
+        Query the dataSource and get updated information.
+        With incremental = True, only the replica changes since the last update are fetched and saved. A full update
+        is performed instead if there is no record of a previous update or if the update is limited by dataset_filter.
+        """
 
-    def update(self, dataset_filter = '/*/*/*', load_first = True, make_snapshot = True):
-        """Query the dataSource and get updated information."""
+        if incremental:
+            # checked before anything is locked or snapshotted
+            if not self.replica_source.supports_incremental_update():
+                logger.info('Replica source does not support incremental updates. Performing a full update.')
+            elif dataset_filter != '/*/*/*':
+                logger.info('Incremental update is not possible. Performing a full update.')
+            else:
+                since = self.store.get_replicas_last_update()
+                if since == 0:
+                    logger.info('No record of a previous update. Performing a full update.')
+                else:
+                    self._update_incremental(since, make_snapshot)
+                    return
 
         logger.info('Locking inventory.')
 
@@ -108,6 +233,8 @@ class InventoryManager(object):
                 logger.info('Making a snapshot of inventory.')
                 snapshot_tag = self.store.make_snapshot()
 
+            update_start = time.time()
+
             if load_first and len(self.sites) == 0:
                 logger.info('Loading data from local storage.')
                 self.load(load_blocks = False, load_files = False, load_replicas = False, dataset_filter = dataset_filter)
@@ -128,22 +255,18 @@ class InventoryManager(object):
             else:
                 self.replica_source.make_replica_links(self, dataset_filt = dataset_filter)
 
-            open_datasets = filter(lambda d: d.status == Dataset.STAT_PRODUCTION, self.datasets.values())
-            # Typically we enter this function with no file data loaded from store, so each open_dataset will have new File objects created.
-            # However this does not lead to any slowdown since we download the full file information for each dataset anyway.
-            self.dataset_source.set_dataset_details(open_datasets)
+            self._update_dataset_details(self.datasets.values())
 
-            for dataset in open_datasets:
-                if dataset.status != Dataset.STAT_PRODUCTION:
-                    # status changed
-                    continue
+            self.replica_source.find_tape_copies(self.datasets)
 
-                for cond in config.inventory.ignore_datasets:
-                    if cond(dataset):
-                        dataset.status = Dataset.STAT_IGNORED
-                        break
+            logger.info('Collapsing full dataset replicas.')
 
-            self.replica_source.find_tape_copies(self.datasets)
+            for dataset in self.datasets.itervalues():
+                if dataset.replicas is None:
+                    continue
+
+                for replica in dataset.replicas:
+                    replica.collapse_block_replicas()
 
             logger.info('Saving data.')
 
@@ -151,6 +274,92 @@ class InventoryManager(object):
             # Datasets and groups with no replicas are removed
             self.store.save_data(self.sites.values(), self.groups.values(), self.datasets.values())
 
+            if dataset_filter == '/*/*/*':
+                self.store.set_replicas_last_update(update_start)
+
+                if config.inventory.image_path != '' and not config.read_only:
+                    self._save_image(self.store.get_site_list(include = config.inventory.included_sites, exclude = config.inventory.excluded_sites))
+
+            # no File tuple from the update is in use any more
+            num_reclaimed = File.reclaim_directories()
+            logger.info('Reclaimed %d unused file directories.', num_reclaimed)
+
+            if make_snapshot:
+                logger.info('Removing the snapshot.')
+                self.store.remove_snapshot(snapshot_tag)
+
+        finally:
+            # Lock is released even in case of unexpected errors
+            self.store.release_lock(force = True)
+
+    def _update_incremental(self, since, make_snapshot):
+        """
+        Fetch the replica changes since the given time, apply them to the inventory in memory, and save only the changes.
+        """
+
+        logger.info('Locking inventory.')
+
+        self.store.acquire_lock()
+
+        try:
+            if make_snapshot:
+                logger.info('Making a snapshot of inventory.')
+                snapshot_tag = self.store.make_snapshot()
+
+            if not self.replicas_loaded:
+                logger.info('Loading data from local storage.')
+                self.load(load_blocks = True, load_files = False, load_replicas = True)
+
+            update_start = time.time()
+
+            self.site_source.get_site_list(self.sites, include = config.inventory.included_sites, exclude = config.inventory.excluded_sites)
+
+            self.site_source.set_site_status(self.sites)
+
+            self.site_source.get_group_list(self.groups, filt = config.inventory.included_groups)
+
+            updated_replicas, removed_replicas = self.replica_source.update_replica_links(self, since)
+
+            # dataset replicas with no block replicas left
+            removed_dataset_replicas = []
+            for block_replica in removed_replicas:
+                replica = block_replica.block.dataset.find_replica(block_replica.site)
+                if replica is not None and replica.num_block_replicas() == 0:
+                    self.unlink_datasetreplica(replica)
+                    removed_dataset_replicas.append(replica)
+
+            updated_dataset_replicas = set()
+            for block_replica in updated_replicas + removed_replicas:
+                replica = block_replica.block.dataset.find_replica(block_replica.site)
+                if replica is not None:
+                    updated_dataset_replicas.add(replica)
+
+            updated_datasets = dict((r.block.dataset.name, r.block.dataset) for r in updated_replicas + removed_replicas)
+
+            logger.info('%d datasets, %d dataset replicas updated. %d dataset replicas removed.', len(updated_datasets), len(updated_dataset_replicas), len(removed_dataset_replicas))
+
+            self._update_dataset_details(updated_datasets.values())
+
+            self.replica_source.find_tape_copies(updated_datasets)
+
+            for replica in updated_dataset_replicas:
+                replica.collapse_block_replicas()
+
+            # only the changed block replicas are written; the dataset replica rows are updated without their contents
+            self.journal.record_all(InventoryJournal.DATASET_UPDATED, updated_datasets.values())
+            # includes the previous versions of the updated replicas
+            self.journal.record_all(InventoryJournal.BLOCK_REPLICA_REMOVED, removed_replicas)
+            self.journal.record_all(InventoryJournal.REPLICA_REMOVED, removed_dataset_replicas)
+            self.journal.record_all(InventoryJournal.REPLICA_UPDATED, updated_dataset_replicas)
+            self.journal.record_all(InventoryJournal.BLOCK_REPLICA_ADDED, updated_replicas)
+
+            self.save_changes()
+
+            self.store.set_replicas_last_update(update_start)
+
+            if config.inventory.image_path != '' and not config.read_only:
+                self._save_image(self.store.get_site_list(include = config.inventory.included_sites, exclude = config.inventory.excluded_sites))
+
             if make_snapshot:
                 logger.info('Removing the snapshot.')
                 self.store.remove_snapshot(snapshot_tag)
@@ -159,23 +368,128 @@ class InventoryManager(object):
             # Lock is released even in case of unexpected errors
             self.store.release_lock(force = True)
 
-    def load_blocks(self, dataset):
+    def save_changes(self):
+        """
+        Write the changes recorded in the journal to the store, in batches of config.inventory.journal_batch_size
+        objects, and clear the journal. Datasets are written first, then replica removals, then replica additions.
+        REPLICA_REMOVED deletes only the dataset replica; its block replicas must be recorded as removed separately.
+        """
+
+        if len(self.journal) == 0:
+            return
+
+        logger.info('Saving changes: %s.', self.journal.summary())
+
+        journal = self.journal
+
+        def in_batches(objects, write):
+            batch_size = config.inventory.journal_batch_size
+            for start in xrange(0, len(objects), batch_size):
+                write(objects[start:start + batch_size])
+
+        # on failure, the journal is kept and can be saved again (the writes are idempotent)
+        self.store.acquire_lock()
+        try:
+            in_batches(journal.objects(InventoryJournal.DATASET_UPDATED), self.store.save_datasets)
+            in_batches(journal.objects(InventoryJournal.BLOCK_REPLICA_REMOVED), self.store.delete_blockreplicas)
+            in_batches(journal.objects(InventoryJournal.REPLICA_REMOVED), lambda batch: self.store.delete_datasetreplicas(batch, delete_blockreplicas = False))
+            in_batches(journal.objects(InventoryJournal.REPLICA_ADDED), self.store.add_datasetreplicas)
+            in_batches(journal.objects(InventoryJournal.REPLICA_UPDATED), lambda batch: self.store.add_datasetreplicas(batch, add_blockreplicas = False))
+            in_batches(journal.objects(InventoryJournal.BLOCK_REPLICA_ADDED), self.store.add_blockreplicas)
+        finally:
+            self.store.release_lock()
+
+        journal.clear()
+
+    def _save_image(self, site_names):
+        """
+        Write the inventory image tagged with the current last_update of the store. Must be called with the store lock held.
+        """
+
+        # every write to the store moves the stamp forward (see MySQLStore._do_set_last_update)
+        stamp = self.store.get_last_update()
+
+        sites = [site for site in self.sites.itervalues() if site.name in site_names]
+
+        try:
+            InventoryImage.save(config.inventory.image_path, stamp, site_names, sites, self.groups.values(), self.datasets.itervalues())
+        except (IOError, OSError) as ex:
+            # the image is only a cache
+            logger.warning('Failed to save inventory image: %s', str(ex))
+
+    def _update_dataset_details(self, datasets):
+        open_datasets = filter(lambda d: d.status == Dataset.STAT_PRODUCTION, datasets)
+        # Typically we enter this function with no file data loaded from store, so each open_dataset will have new File objects created.
+        # However this does not lead to any slowdown since we download the full file information for each dataset anyway.
+        self.dataset_source.set_dataset_details(open_datasets)
+
+        for dataset in open_datasets:
+            if dataset.status != Dataset.STAT_PRODUCTION:
+                # status changed
+                continue
+
+            for cond in config.inventory.ignore_datasets:
+                if cond(dataset):
+                    dataset.status = Dataset.STAT_IGNORED
+                    break
+
+    def load_blocks(self, datasets):
+        """
+        Load blocks of a dataset or a list of datasets. Try InventoryStore first, and for datasets with no record,
+        query the DatasetInfoSource.
+        """
+
+        if type(datasets) is Dataset:
+            datasets = [datasets]
+
+        self.store.load_blocks(datasets)
+
+        missing = [d for d in datasets if d.blocks is None]
+        if len(missing) != 0:
+            self.dataset_source.set_dataset_details(missing)
+
+    def load_files(self, datasets):
+        """
+        Load files of a dataset or a list of datasets. Try InventoryStore first, and for datasets with no record,
+        query the DatasetInfoSource. Blocks must be loaded.
+        """
+
+        if type(datasets) is Dataset:
+            datasets = [datasets]
+
+        self.store.load_files(datasets)
+
+        missing = [d for d in datasets if d.files is None]
+        if len(missing) != 0:
+            self.dataset_source.set_dataset_details(missing)
+
+    def prefetch_blocks(self, datasets):
         """
-        Load blocks of a dataset. Try InventoryStore first, and if no record is found, query the DatasetInfoSource.
+        Load the blocks of the datasets that do not have blocks in memory, with a few bulk queries.
         """
 
-        self.store.load_blocks(dataset)
-        if dataset.blocks is None:
-            self.dataset_source.set_dataset_details([dataset])
+        missing = [d for d in datasets if not d.blocks_loaded()]
+        if len(missing) == 0:
+            return
+
+        logger.debug('Prefetching blocks of %d datasets.', len(missing))
+        self.load_blocks(missing)
 
-    def load_files(self, dataset):
+    def prefetch_files(self, datasets):
         """
-        Load blocks of a dataset. Try InventoryStore first, and if no record is found, query the DatasetInfoSource.
+        Load the blocks and files of the datasets that do not have them in memory, with a few bulk queries.
         """
 
-        self.store.load_files(dataset)
-        if dataset.files is None:
-            self.dataset_source.set_dataset_details([dataset])
+        datasets = list(datasets)
+
+        self.prefetch_blocks(datasets)
+
+        missing = [d for d in datasets if d.files is None]
+        if len(missing) == 0:
+            return
+
+        logger.debug('Prefetching files of %d datasets.', len(missing))
+        self.load_files(missing)
 
     def unlink_datasetreplica(self, replica):
         """
@@ -187,20 +501,26 @@ class InventoryManager(object):
         site = replica.site
 
         # Remove block replicas from the site
-        for block_replica in replica.block_replicas:
-            site.remove_block_replica(block_replica)
+        site.remove_block_replicas(replica)
 
-        site.dataset_replicas.remove(replica)
-        dataset.replicas.remove(replica)
+        site.remove_dataset_replica(replica)
+        dataset.remove_replica(replica)
 
     def unlink_all_replicas(self):
         for dataset in self.datasets.values():
             dataset.replicas = None
 
         for site in self.sites.values():
-            site.dataset_replicas.clear()
+            site.dataset_replicas = set()
             site.clear_block_replicas()
 
+        self.replicas_loaded = False
+
+        # datasets still waiting for lazy block loading are left without blocks
+        Dataset.set_block_loader(None)
+
+        self._reset_block_replica_store()
+
     def add_dataset_to_site(self, dataset, site, group = None, blocks = None):
         """
         Create a new DatasetReplica object and return.
@@ -212,18 +532,17 @@ class InventoryManager(object):
 
         new_replica = DatasetReplica(dataset, site)
 
-        dataset.replicas.append(new_replica)
-        site.dataset_replicas.add(new_replica)
+        dataset.add_replica(new_replica)
+        site.add_dataset_replica(new_replica)
 
-        if dataset.blocks is None:
-            self.load_blocks(dataset)
+        # normally done in bulk beforehand with prefetch_blocks
+        self.prefetch_blocks([dataset])
 
         if blocks is None:
             blocks = dataset.blocks
 
         for block in blocks:
-            block_replica = BlockReplica(block, site, group, is_complete = False, is_custodial = False, size = 0)
-            new_replica.block_replicas.append(block_replica)
+            block_replica = new_replica.new_block_replica(block, group, is_complete = False, is_custodial = False, size = 0)
             site.add_block_replica(block_replica)
 
         return new_replica
@@ -245,15 +564,27 @@ class InventoryManager(object):
         if drep is None:
             drep = DatasetReplica(dataset, site)
     
-            dataset.replicas.append(drep)
-            site.dataset_replicas.add(drep)
+            dataset.add_replica(drep)
+            site.add_dataset_replica(drep)
 
-        new_replica = BlockReplica(block, site, group, is_complete = False, is_custodial = False, size = 0)    
-        drep.block_replicas.append(new_replica)
+        new_replica = drep.new_block_replica(block, group, is_complete = False, is_custodial = False, size = 0)
         site.add_block_replica(new_replica)
 
         return new_replica
 
+    def _reset_block_replica_store(self):
+        """
+        Block replicas are kept either as BlockReplica tuples or as rows of a BlockReplicaStore, depending on
+        config.inventory.columnar_block_replicas. The store is recreated whenever the replicas are rebuilt.
+        """
+
+        if config.inventory.columnar_block_replicas:
+            self.block_replica_store = BlockReplicaStore()
+        else:
+            self.block_replica_store = None
+
+        DatasetReplica.set_block_replica_store(self.block_replica_store)
+
     def scan_datasets(self, dataset_filter = '/*/*/*'):
         """
         Checks the information of existing datasets and save changes. Intended for an independent daemon process.
@@ -290,6 +621,7 @@ if __name__ == '__main__':
     parser.add_argument('--site', '-e', metavar = 'SITE', dest = 'sites', nargs = '+', default = ['@disk'], help = 'Site names or aggregate names (@disk, @tape, @all) to include.')
     parser.add_argument('--no-load', '-L', action = 'store_true', dest = 'no_load',  help = 'Do not load the existing inventory when updating.')
     parser.add_argument('--no-snapshot', '-S', action = 'store_true', dest = 'no_snapshot',  help = 'Do not make a snapshot of existing inventory when updating.')
+    parser.add_argument('--incremental', '-N', action = 'store_true', dest = 'incremental',  help = 'Only fetch and save the replica changes since the last update.')
     parser.add_argument('--single-thread', '-T', action = 'store_true', dest = 'singleThread', help = 'Do not parallelize (for debugging).')
     parser.add_argument('--log-level', '-l', metavar = 'LEVEL', dest = 'log_level', default = '', help = 'Logging level.')
 
@@ -336,7 +668,7 @@ if __name__ == '__main__':
         icmd += 1
     
         if command == 'update':
-            manager.update(dataset_filter = args.dataset, load_first = not args.no_load, make_snapshot = not args.no_snapshot)
+            manager.update(dataset_filter = args.dataset, load_first = not args.no_load, make_snapshot = not args.no_snapshot, incremental = args.incremental)
     
         elif command == 'scan':
             manager.scan_datasets(dataset_filter = args.dataset)
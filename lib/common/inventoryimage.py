@@ -0,0 +1,197 @@
+import os
+import time
+import marshal
+import logging
+
+from common.dataformat import Dataset, Block, Site, Group, DatasetReplica
+
+logger = logging.getLogger(__name__)
+
+class InventoryImage(object):
+    """
+    Binary image of the inventory (sites, groups, datasets, blocks, and replicas) used to skip the store queries when
+    starting a process. The image is a sequence of marshalled tuples of plain values, tagged with the last_update stamp
+    of the store and the list of loaded sites. It is only valid while the store stamp is unchanged.
+    The image holds what MySQLStore.load_data returns for a full load of blocks and replicas: datasets and blocks without
+    replicas at the loaded sites are not included.
+    """
+
+    VERSION = 1
+
+    @staticmethod
+    def save(path, stamp, site_names, sites, groups, datasets):
+        """
+        Write the image to path (via a temporary file so that readers never see a partial image).
+        @param path        Image file path
+        @param stamp       Store last_update the inventory corresponds to
+        @param site_names  List of site names the inventory was loaded for
+        @param sites       List of sites
+        @param groups      List of groups
+        @param datasets    List of datasets
+        """
+
+        start = time.time()
+
+        site_list = list(sites)
+        group_list = list(groups)
+
+        site_indices = dict((site, idx) for idx, site in enumerate(site_list))
+        group_indices = dict((group, idx) for idx, group in enumerate(group_list))
+        group_indices[None] = -1
+
+        site_data = []
+        for site in site_list:
+            quotas = tuple((name, site.partition_quota(partition)) for name, partition in Site.partitions.iteritems())
+            site_data.append((site.name, site.host, site.storage_type, site.backend, site.storage, site.cpu, site.status, quotas))
+
+        group_data = [(group.name, group.olevel.__name__) for group in group_list]
+
+        dataset_data = []
+        for dataset in datasets:
+            if dataset.blocks is None or not dataset.replicas:
+                continue
+
+            replica_data = []
+            block_indices = {} # {block name: index in the image}
+            block_data = []
+
+            def block_index(block):
+                try:
+                    return block_indices[block.name]
+                except KeyError:
+                    block_indices[block.name] = len(block_data)
+                    block_data.append((block.name, block.size, block.num_files, block.is_open))
+                    return block_indices[block.name]
+
+            for replica in dataset.replicas:
+                try:
+                    site_index = site_indices[replica.site]
+                except KeyError:
+                    # not a loaded site
+                    continue
+
+                if replica.is_implicit():
+                    # full replica owned by one group - no block replica list
+                    for block in dataset.blocks:
+                        block_index(block)
+
+                    replica_data.append((site_index, replica.is_complete, replica.is_custodial, replica.last_block_created, group_indices[replica.implicit_group()], None))
+                    continue
+
+                block_replica_data = []
+                for block_replica in replica.block_replicas:
+                    block_replica_data.append((block_index(block_replica.block), group_indices[block_replica.group], block_replica.is_complete, block_replica.is_custodial, block_replica.size))
+
+                if len(block_replica_data) != 0:
+                    replica_data.append((site_index, replica.is_complete, replica.is_custodial, replica.last_block_created, 0, block_replica_data))
+
+            if len(replica_data) == 0:
+                continue
+
+            dataset_data.append((dataset.name, dataset.status, dataset.on_tape, dataset.data_type, dataset.software_version, dataset.last_update, dataset.is_open, block_data, replica_data))
+
+        tmp_path = '%s.%d' % (path, os.getpid())
+        with open(tmp_path, 'wb') as image:
+            marshal.dump((InventoryImage.VERSION, stamp, list(site_names)), image, 2)
+            marshal.dump(site_data, image, 2)
+            marshal.dump(group_data, image, 2)
+            marshal.dump(dataset_data, image, 2)
+
+        os.rename(tmp_path, path)
+
+        logger.info('Saved inventory image with %d datasets to %s in %.1f seconds.', len(dataset_data), path, time.time() - start)
+
+    @staticmethod
+    def load(path, stamp, site_names):
+        """
+        Restore the inventory from the image at path.
+        @param path        Image file path
+        @param stamp       Current last_update of the store
+        @param site_names  List of site names to load
+        @return (site list, group list, dataset list) or None if the image does not exist or is not valid
+        """
+
+        start = time.time()
+
+        try:
+            image = open(path, 'rb')
+        except IOError:
+            return None
+
+        with image:
+            try:
+                version, image_stamp, image_site_names = marshal.load(image)
+            except (EOFError, ValueError, TypeError):
+                logger.warning('Inventory image %s is corrupt.', path)
+                return None
+
+            if version != InventoryImage.VERSION:
+                logger.info('Inventory image %s has version %s (expected %d).', path, str(version), InventoryImage.VERSION)
+                return None
+
+            if image_stamp != stamp or sorted(image_site_names) != sorted(site_names):
+                logger.info('Inventory image %s is outdated.', path)
+                return None
+
+            site_data = marshal.load(image)
+            group_data = marshal.load(image)
+            dataset_data = marshal.load(image)
+
+        site_list = []
+        for name, host, storage_type, backend, storage, cpu, status, quotas in site_data:
+            site = Site(name, host = host, storage_type = storage_type, backend = backend, storage = storage, cpu = cpu, status = status)
+            for partition_name, quota in quotas:
+                try:
+                    site.set_partition_quota(Site.partitions[partition_name], quota)
+                except KeyError:
+                    pass
+
+            site_list.append(site)
+
+        group_list = []
+        for name, olname in group_data:
+            if olname == 'Dataset':
+                olevel = Dataset
+            else:
+                olevel = Block
+
+            group_list.append(Group(name, olevel))
+
+        group_map = group_list + [None] # index -1 -> None
+
+        dataset_list = []
+        for name, status, on_tape, data_type, software_version, last_update, is_open, block_data, replica_data in dataset_data:
+            dataset = Dataset(name, status = status, on_tape = on_tape, data_type = data_type, software_version = software_version, last_update = last_update, is_open = is_open)
+
+            blocks = [Block(block_name, dataset, size, num_files, block_is_open) for block_name, size, num_files, block_is_open in block_data]
+            dataset.blocks = blocks
+            dataset.size = sum(b.size for b in blocks)
+            dataset.num_files = sum(b.num_files for b in blocks)
+
+            dataset.replicas = []
+
+            for site_index, is_complete, is_custodial, last_block_created, group_index, block_replica_data in replica_data:
+                site = site_list[site_index]
+
+                replica = DatasetReplica(dataset, site, is_complete = is_complete, is_custodial = is_custodial, last_block_created = last_block_created)
+                dataset.add_replica(replica)
+                site.add_dataset_replica(replica)
+
+                if block_replica_data is None:
+                    replica.set_full(group_map[group_index])
+                    site.add_full_replica(replica)
+                    continue
+
+                for block_index, group_index, b_is_complete, b_is_custodial, size in block_replica_data:
+                    block_replica = replica.new_block_replica(blocks[block_index], group_map[group_index], b_is_complete, b_is_custodial, size)
+                    site.add_block_replica(block_replica)
+
+                # blocks without replicas are not in the image; the replica may have become full
+                if replica.is_complete:
+                    replica.collapse_block_replicas()
+
+            dataset_list.append(dataset)
+
+        logger.info('Restored %d sites, %d groups, %d datasets from inventory image in %.1f seconds.', len(site_list), len(group_list), len(dataset_list), time.time() - start)
+
+        return site_list, group_list, dataset_list
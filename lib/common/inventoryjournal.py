@@ -0,0 +1,62 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class InventoryJournal(object):
+    """
+    Changes made to the inventory in memory that are yet to be written to the store, as typed records
+    (change type, object). Objects are also modified for planning (e.g. trial deletions and copies), so changes are
+    recorded explicitly where they become final. InventoryManager.save_changes writes the journal out in batches.
+    Repeated records of the same object are merged, and a removal cancels an earlier addition or update of the same
+    replica (and an addition cancels an earlier removal).
+    DATASET_UPDATED covers new datasets too (the dataset is inserted or updated with its blocks).
+    REPLICA_ADDED covers the dataset replica and all its block replicas, while REPLICA_UPDATED covers only the dataset
+    replica itself (completion, custodial flag); its changed block replicas are recorded separately.
+    """
+
+    DATASET_UPDATED, REPLICA_ADDED, REPLICA_UPDATED, REPLICA_REMOVED, BLOCK_REPLICA_ADDED, BLOCK_REPLICA_REMOVED = range(6)
+
+    change_names = ['dataset updated', 'replica added', 'replica updated', 'replica removed', 'block replica added', 'block replica removed']
+
+    # {change: change types of earlier records it cancels}
+    _cancels = {
+        REPLICA_ADDED: (REPLICA_REMOVED,),
+        REPLICA_REMOVED: (REPLICA_ADDED, REPLICA_UPDATED),
+        BLOCK_REPLICA_ADDED: (BLOCK_REPLICA_REMOVED,),
+        BLOCK_REPLICA_REMOVED: (BLOCK_REPLICA_ADDED,)
+    }
+
+    def __init__(self):
+        # [{object: sequence number}] for each change type
+        self._records = [{} for _ in self.change_names]
+        self._sequence = 0
+
+    def __len__(self):
+        return sum(len(records) for records in self._records)
+
+    def record(self, change, obj):
+        for cancelled in InventoryJournal._cancels.get(change, ()):
+            self._records[cancelled].pop(obj, None)
+
+        records = self._records[change]
+        if obj not in records:
+            records[obj] = self._sequence
+            self._sequence += 1
+
+    def record_all(self, change, objects):
+        for obj in objects:
+            self.record(change, obj)
+
+    def objects(self, change):
+        """
+        Return the list of objects recorded with the change type, in the order of recording.
+        """
+
+        records = self._records[change]
+        return sorted(records.iterkeys(), key = records.get)
+
+    def clear(self):
+        self.__init__()
+
+    def summary(self):
+        return ', '.join('%d %s' % (len(records), name) for name, records in zip(self.change_names, self._records) if len(records) != 0)
@@ -6,6 +6,7 @@ import logging
 
 from common.dataformat import Dataset, DatasetReplica, Block, BlockReplica, Site
 import common.configuration as config
+from common.inventoryjournal import InventoryJournal
 import dealer.configuration as dealer_config
 
 logger = logging.getLogger(__name__)
@@ -109,6 +110,9 @@ class Dealer(object):
             else:
                 candidates.append((request, None))
 
+        # blocks of the candidate datasets are needed to create new replicas
+        self.inventory_manager.prefetch_blocks([item for item, destination in candidates if type(item) is Dataset])
+
         # now go through all candidates
         for item, destination in candidates:
             if type(item) is Dataset:
@@ -204,7 +208,11 @@ class Dealer(object):
     
             for operation_id, (approved, op_replicas) in copy_mapping.items():
                 if approved and not is_test:
-                    self.inventory_manager.store.add_datasetreplicas(op_replicas)
+                    for rep in op_replicas:
+                        if type(rep) is DatasetReplica:
+                            self.inventory_manager.journal.record(InventoryJournal.REPLICA_ADDED, rep)
+                        else:
+                            self.inventory_manager.journal.record(InventoryJournal.BLOCK_REPLICA_ADDED, rep)
     
                 size = sum([r.size(physical = False) for r in op_replicas]) # this is not group size but the total size on disk
 
@@ -217,6 +225,9 @@ class Dealer(object):
 
                 self.history.make_copy_entry(run_number, site, operation_id, approved, [r.dataset for r in op_replicas], size)
 
+            # write the approved copies of the site in batches
+            self.inventory_manager.save_changes()
+
 
 if __name__ == '__main__':
 
@@ -12,6 +12,7 @@ from common.dataformat import Dataset, Block, Site, DatasetReplica, BlockReplica
 from policy import Dismiss, Delete, DeleteOwner, Keep, Protect, Policy
 import detox.configuration as detox_config
 from common.misc import timer, parallel_exec, sigint
+from common.inventoryjournal import InventoryJournal
 
 logger = logging.getLogger(__name__)
 
@@ -214,6 +215,9 @@ class Detox(object):
                 if policy.stop_condition.match(site):
                     target_sites.remove(site)
 
+        # write the owner reassignments made during the iterations
+        self.inventory_manager.save_changes()
+
         kept = {}
         # remaining replicas not in protected or deleted are kept
         for replica, decision, condition in eval_results:
@@ -301,18 +305,19 @@ class Detox(object):
 
         new_replicas = []
         for old_replica in block_replicas:
-            dataset_replica.block_replicas.remove(old_replica)
+            dataset_replica.remove_block_replica(old_replica)
             site.remove_block_replica(old_replica)
 
             new_replica = old_replica.clone(group = new_owner)
 
-            dataset_replica.block_replicas.append(new_replica)
+            dataset_replica.add_block_replica(new_replica)
             site.add_block_replica(new_replica, partitions = [partition])
             
             new_replicas.append(new_replica)
 
         if not is_test:
-            self.inventory_manager.store.add_blockreplicas(new_replicas)
+            # written with the other changes after the iterations
+            self.inventory_manager.journal.record_all(InventoryJournal.BLOCK_REPLICA_ADDED, new_replicas)
 
     def commit_deletions(self, run_number, policy, deletion_list, is_test, comment, auto_approval):
         sites = set(r.site for r in deletion_list)
@@ -324,6 +329,8 @@ class Detox(object):
 
         deleted_replicas = []
 
+        journal = self.inventory_manager.journal
+
         # now schedule deletion for each site
         for site in sorted(sites):
             if site.storage_type == Site.TYPE_MSS:
@@ -389,11 +396,10 @@ class Detox(object):
             for deletion_id, (approved, replicas) in deletion_mapping.items():
                 if approved and not is_test:
                     for replica in replicas:
-                        self.inventory_manager.store.delete_blockreplicas(replica.block_replicas)
+                        journal.record_all(InventoryJournal.BLOCK_REPLICA_REMOVED, replica.block_replicas)
                         if replica not in policy.untracked_replicas:
                             # this replica was fully in the partition
-                            # second arg is False because block replicas must be all gone by now
-                            self.inventory_manager.store.delete_datasetreplica(replica, delete_blockreplicas = False)
+                            journal.record(InventoryJournal.REPLICA_REMOVED, replica)
                             deleted_replicas.append(replica)
 
                 size = sum([r.size() for r in replicas])
@@ -402,6 +408,9 @@ class Detox(object):
                 total_size += size
                 num_deleted += len(replicas)
 
+            # write the approved deletions of the site in batches
+            self.inventory_manager.save_changes()
+
             sigint.unblock()
 
             logger.info('Done deleting %d replicas (%.1f TB) from %s.', num_deleted, total_size * 1.e-12, site.name)
@@ -231,7 +231,7 @@ class Policy(object):
                 if site.partition_quota(self.partition) == 0.:
                     self.untracked_replicas[replica] = replica.block_replicas
                     replica.block_replicas = []
-                    dataset.replicas.pop(ir)
+                    dataset.remove_replica(replica)
                     continue
 
                 block_replicas = []                    
@@ -263,7 +263,7 @@ class Policy(object):
                         self.untracked_replicas[replica] = not_in_partition
 
                 if len(replica.block_replicas) == 0:
-                    dataset.replicas.pop(ir)
+                    dataset.remove_replica(replica)
                 else:
                     all_replicas.add(replica)
                     ir += 1
@@ -284,13 +284,13 @@ class Policy(object):
             site = replica.site
 
             if replica not in dataset.replicas:
-                dataset.replicas.append(replica)
+                dataset.add_replica(replica)
 
             if replica not in site.dataset_replicas:
-                site.dataset_replicas.add(replica)
+                site.add_dataset_replica(replica)
 
             for block_replica in block_replicas:
-                replica.block_replicas.append(block_replica)
+                replica.add_block_replica(block_replica)
                 site.add_block_replica(block_replica)
 
     def evaluate(self, replica):
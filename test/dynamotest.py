@@ -0,0 +1,317 @@
+"""
+Common setup of the unit tests. Importing this module
+ - puts lib/ on the path and sets the environment read by common.configuration,
+ - installs a stub MySQLdb backed by an in-memory server (FakeServer), so that the MySQL interfaces can be tested
+   without a database,
+ - defines the storage partitions used in the tests.
+Run the tests from the repository root with
+  python -m unittest discover -s test
+"""
+
+import os
+import sys
+import re
+import ast
+import types
+import tempfile
+
+_base = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+sys.path.insert(0, _base + '/lib')
+
+_tmpdir = tempfile.mkdtemp(prefix = 'dynamotest_')
+os.environ.setdefault('DYNAMO_BASE', _base)
+os.environ.setdefault('DYNAMO_DATADIR', _tmpdir)
+os.environ.setdefault('X509_USER_PROXY', _tmpdir + '/x509')
+
+class FakeTable(object):
+    """
+    Table of the fake server. All values are kept as strings (or None), as MySQL converts them to the column type.
+    """
+
+    def __init__(self, columns, num_keys):
+        self.columns = list(columns)
+        self.num_keys = num_keys
+        self.rows = {} # {key: row dict}
+
+    def key(self, row):
+        if self.num_keys == 0:
+            # table without a unique key
+            return len(self.rows)
+
+        return tuple(row[c] for c in self.columns[:self.num_keys])
+
+    def contents(self):
+        return sorted(tuple(row[c] for c in self.columns) for row in self.rows.itervalues())
+
+class FakeServer(object):
+    """
+    Minimal in-memory server understanding the statements issued by MySQL.insert_many and MySQL.load_many.
+    """
+
+    def __init__(self):
+        self.tables = {}
+        self.statements = []
+        # error number returned for LOAD DATA LOCAL INFILE, or None
+        self.load_data_error = None
+
+    def create_table(self, name, columns, num_keys = 1):
+        self.tables[name] = FakeTable(columns, num_keys)
+
+server = FakeServer()
+
+def reset_server():
+    global server
+    server = FakeServer()
+    return server
+
+def _literal(value):
+    # parsed back with ast.literal_eval
+    if type(value) is bool:
+        return '1' if value else '0'
+    else:
+        return repr(value)
+
+def _stored(value):
+    if value is None:
+        return None
+    elif type(value) is unicode:
+        return value.encode('utf-8')
+    elif type(value) is float:
+        return repr(value)
+    else:
+        return str(value)
+
+def _unescape_tsv(field):
+    if field == '\\N':
+        return None
+
+    escapes = {'t': '\t', 'n': '\n', '\\': '\\', '0': '\0'}
+    chars = []
+    it = iter(field)
+    for char in it:
+        if char == '\\':
+            char = escapes[next(it)]
+        chars.append(char)
+
+    return ''.join(chars)
+
+class FakeCursor(object):
+    def __init__(self, connection):
+        self.connection = connection
+        self.description = None
+        self.lastrowid = 0
+        self.rowcount = 0
+        self._result = []
+
+    def execute(self, sql, args = ()):
+        if self.connection.closed:
+            raise OperationalError(2006, 'MySQL server has gone away')
+
+        if args:
+            sql = sql % tuple(_literal(a) for a in args)
+
+        server.statements.append(sql)
+
+        self.description = None
+        self._result = []
+        self.rowcount = self.connection.execute(sql, self)
+
+    def fetchall(self):
+        result = self._result
+        self._result = []
+        return tuple(result)
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        pass
+
+class FakeConnection(object):
+    def __init__(self, **parameters):
+        self.parameters = parameters
+        self.closed = False
+        self.temporary_tables = {}
+        self.locked_tables = []
+        self.warnings = []
+        self.num_rollbacks = 0
+
+    def cursor(self, cursorclass = None):
+        return FakeCursor(self)
+
+    def ping(self):
+        if self.closed:
+            raise OperationalError(2006, 'MySQL server has gone away')
+
+    def close(self):
+        self.closed = True
+
+    def rollback(self):
+        if self.closed:
+            raise OperationalError(2006, 'MySQL server has gone away')
+
+        self.num_rollbacks += 1
+
+    def _table(self, name):
+        try:
+            return self.temporary_tables[name]
+        except KeyError:
+            return server.tables[name]
+
+    def _write(self, table, fields, values, on_duplicate):
+        row = dict((c, None) for c in table.columns)
+        row.update(zip(fields, values))
+        key = table.key(row)
+
+        if key not in table.rows:
+            table.rows[key] = row
+        elif on_duplicate == 'update':
+            table.rows[key].update(zip(fields, values))
+        elif on_duplicate == 'warn':
+            self.warnings.append(('Warning', 1062, 'Duplicate entry \'%s\' for key \'PRIMARY\'' % '-'.join(map(str, key))))
+        else:
+            raise IntegrityError(1062, 'Duplicate entry \'%s\' for key \'PRIMARY\'' % '-'.join(map(str, key)))
+
+    def execute(self, sql, cursor):
+        if sql == 'SHOW WARNINGS':
+            cursor.description = (('Level',), ('Code',), ('Message',))
+            cursor._result = list(self.warnings)
+            return len(self.warnings)
+
+        self.warnings = []
+
+        fields_pattern = r'\(([^)]*)\)'
+
+        def field_names(fields_str):
+            return re.findall('`([^`]+)`', fields_str)
+
+        update = ' ON DUPLICATE KEY UPDATE ' in sql
+
+        match = re.match(r'INSERT INTO `(\w+)` ' + fields_pattern + r' VALUES (.*?)(?: ON DUPLICATE KEY UPDATE .*)?$', sql, re.S)
+        if match:
+            table = self._table(match.group(1))
+            fields = field_names(match.group(2))
+            rows = ast.literal_eval('[' + match.group(3) + ']')
+            for values in rows:
+                if type(values) is not tuple:
+                    values = (values,)
+                self._write(table, fields, [_stored(v) for v in values], 'update' if update else 'error')
+
+            return len(rows)
+
+        match = re.match(r'INSERT INTO `(\w+)` ' + fields_pattern + r' SELECT (.*) FROM `(\w+)`', sql)
+        if match:
+            table = self._table(match.group(1))
+            fields = field_names(match.group(2))
+            source = self._table(match.group(4))
+            for row in source.rows.itervalues():
+                self._write(table, fields, [row[f] for f in fields], 'update' if update else 'error')
+
+            return len(source.rows)
+
+        match = re.match(r'CREATE TEMPORARY TABLE `(\w+)` SELECT (.*) FROM `(\w+)` LIMIT 0$', sql)
+        if match:
+            # no keys are copied: every loaded row is kept
+            fields = field_names(match.group(2))
+            table = FakeTable(fields, 0)
+            self.temporary_tables[match.group(1)] = table
+            return 0
+
+        match = re.match(r'DROP TEMPORARY TABLE IF EXISTS `(\w+)`$', sql)
+        if match:
+            self.temporary_tables.pop(match.group(1), None)
+            return 0
+
+        match = re.match(r'LOCK TABLES (.*)$', sql)
+        if match:
+            self.locked_tables = re.findall('`([^`]+)`', match.group(1))
+            return 0
+
+        if sql == 'UNLOCK TABLES':
+            self.locked_tables = []
+            return 0
+
+        match = re.match(r"LOAD DATA LOCAL INFILE '([^']+)' INTO TABLE `(\w+)` " + fields_pattern + '$', sql)
+        if match:
+            if server.load_data_error is not None:
+                raise OperationalError(server.load_data_error, 'The used command is not allowed with this MySQL version')
+
+            table = self._table(match.group(2))
+            fields = field_names(match.group(3))
+            num_rows = 0
+            with open(match.group(1)) as source:
+                for line in source:
+                    values = [_unescape_tsv(f) for f in line[:-1].split('\t')]
+                    if len(values) != len(fields):
+                        self.warnings.append(('Warning', 1262, 'Row %d was truncated' % (num_rows + 1)))
+                        values = (values + [None] * len(fields))[:len(fields)]
+
+                    # LOCAL implies IGNORE
+                    self._write(table, fields, values, 'warn')
+                    num_rows += 1
+
+            return num_rows
+
+        match = re.match(r'SELECT (.*) FROM `(\w+)`$', sql)
+        if match:
+            table = self._table(match.group(2))
+            fields = field_names(match.group(1))
+            cursor.description = tuple((f,) for f in fields)
+            cursor._result = sorted(tuple(row[f] for f in fields) for row in table.rows.itervalues())
+            return len(cursor._result)
+
+        raise ProgrammingError(1064, 'Statement not understood by the fake server: ' + sql)
+
+# The stub module
+
+class Error(StandardError): pass
+class InterfaceError(Error): pass
+class DatabaseError(Error): pass
+class DataError(DatabaseError): pass
+class OperationalError(DatabaseError): pass
+class IntegrityError(DatabaseError): pass
+class InternalError(DatabaseError): pass
+class ProgrammingError(DatabaseError): pass
+
+def _escape(obj, conversions):
+    if type(obj) in (tuple, list):
+        return tuple(_literal(v) for v in obj)
+    else:
+        return _literal(obj)
+
+MySQLdb = types.ModuleType('MySQLdb')
+MySQLdb.__dict__.update(
+    Error = Error,
+    InterfaceError = InterfaceError,
+    DatabaseError = DatabaseError,
+    DataError = DataError,
+    OperationalError = OperationalError,
+    IntegrityError = IntegrityError,
+    InternalError = InternalError,
+    ProgrammingError = ProgrammingError,
+    connect = FakeConnection,
+    escape = _escape,
+    escape_string = lambda string: string.replace('\\', '\\\\').replace('\'', '\\\'')
+)
+
+MySQLdb.converters = types.ModuleType('MySQLdb.converters')
+MySQLdb.converters.conversions = {}
+MySQLdb.converters.escape_sequence = _escape
+
+MySQLdb.cursors = types.ModuleType('MySQLdb.cursors')
+MySQLdb.cursors.SSCursor = FakeCursor
+
+sys.modules['MySQLdb'] = MySQLdb
+sys.modules['MySQLdb.converters'] = MySQLdb.converters
+sys.modules['MySQLdb.cursors'] = MySQLdb.cursors
+
+# Partitions must be defined before any Site is created
+
+from common.dataformat import Site
+
+if len(Site.partitions) == 0:
+    Site.set_partitions([
+        ('All', lambda r: True),
+        ('A', lambda r: r.group is not None and r.group.name == 'A')
+    ])
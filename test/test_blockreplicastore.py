@@ -0,0 +1,156 @@
+import unittest
+
+import dynamotest
+
+from common.dataformat import Dataset, Block, Site, Group, DatasetReplica, BlockReplica, BlockReplicaStore
+
+class BlockReplicaStoreTest(unittest.TestCase):
+    """
+    Block replicas kept as rows of a BlockReplicaStore must behave like lists of BlockReplica tuples.
+    """
+
+    def setUp(self):
+        self.store = BlockReplicaStore()
+        DatasetReplica.set_block_replica_store(self.store)
+
+        self.group = Group('A')
+        self.other_group = Group('B')
+
+        self.dataset = Dataset('/A/B/RECO')
+        self.dataset.blocks = []
+        self.dataset.replicas = []
+        for i in range(1, 5):
+            block = Block(i, self.dataset, 10 * i, 1, False)
+            self.dataset.add_block(block)
+            self.dataset.size += block.size
+
+        self.site = Site('T2_XX_Test')
+
+        self.replica = DatasetReplica(self.dataset, self.site, is_complete = True)
+        self.dataset.add_replica(self.replica)
+        self.site.add_dataset_replica(self.replica)
+
+        for block in self.dataset.blocks[:3]:
+            block_replica = self.replica.new_block_replica(block, self.group, True, False, block.size - 1)
+            self.site.add_block_replica(block_replica)
+
+    def tearDown(self):
+        DatasetReplica.set_block_replica_store(None)
+
+    def occupancy(self):
+        return self.site._occupancy_projected[:], self.site._occupancy_physical[:]
+
+    def expected(self):
+        return [BlockReplica(block, self.site, self.group, True, False, block.size - 1) for block in self.dataset.blocks[:3]]
+
+    def test_rows(self):
+        self.assertTrue(self.replica.is_columnar())
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(list(self.replica.block_replicas), self.expected())
+        self.assertEqual(self.replica.block_replicas[1], self.expected()[1])
+        self.assertEqual(self.replica.block_replicas[-1:], self.expected()[-1:])
+        self.assertIn(self.expected()[0], self.replica.block_replicas)
+        self.assertNotIn(self.expected()[0].clone(size = 0), self.replica.block_replicas)
+
+        self.assertEqual(self.replica.size(), 57)
+        self.assertEqual(self.replica.size(physical = False), 60)
+        self.assertEqual(self.occupancy(), ([60, 60], [57, 57]))
+
+        # the site holds no entry per block replica
+        self.assertEqual(len(self.site._block_replicas), 0)
+
+    def test_find(self):
+        block = self.dataset.blocks[1]
+        self.assertEqual(self.site.find_block_replica(block), self.expected()[1])
+        self.assertEqual(self.site.find_block_replica(block.name), self.expected()[1])
+        self.assertEqual(self.replica.find_block_replica(block), self.expected()[1])
+        self.assertIsNone(self.site.find_block_replica(self.dataset.blocks[3]))
+
+        other_site = Site('T2_YY_Test')
+        self.assertIsNone(other_site.find_block_replica(block))
+
+    def test_remove_and_reuse(self):
+        block_replica = self.site.find_block_replica(self.dataset.blocks[0])
+        self.replica.remove_block_replica(block_replica)
+        self.site.remove_block_replica(block_replica)
+
+        self.assertEqual(len(self.store), 2)
+        self.assertEqual(len(self.store._block), 3)
+        self.assertIsNone(self.site.find_block_replica(self.dataset.blocks[0]))
+        self.assertEqual(self.occupancy(), ([50, 50], [48, 48]))
+
+        with self.assertRaises(ValueError):
+            self.replica.remove_block_replica(block_replica)
+
+        # the released row is reused
+        block_replica = self.replica.new_block_replica(self.dataset.blocks[3], self.other_group, False, True, 5)
+        self.site.add_block_replica(block_replica)
+
+        self.assertEqual(len(self.store), 3)
+        self.assertEqual(len(self.store._block), 3)
+        self.assertEqual(self.site.find_block_replica(self.dataset.blocks[3]), BlockReplica(self.dataset.blocks[3], self.site, self.other_group, False, True, 5))
+
+    def test_release_on_delete(self):
+        detached = self.replica.block_replicas
+
+        # lists of tuples are converted to rows
+        self.site.remove_block_replicas(self.replica)
+        self.replica.block_replicas = self.expected()[:1]
+        self.site.add_block_replica(self.expected()[0])
+
+        self.assertEqual(len(self.store), 4)
+        # rows of the detached list stay valid while it is referenced
+        self.assertEqual(list(detached), self.expected())
+
+        del detached
+
+        self.assertEqual(len(self.store), 1)
+        self.assertEqual(list(self.replica.block_replicas), self.expected()[:1])
+
+        self.replica.unlink()
+
+        self.assertEqual(self.occupancy(), ([0, 0], [0, 0]))
+        self.assertEqual(len(self.store), 0)
+
+    def test_block_changes(self):
+        new_block = self.dataset.update_block(self.dataset.blocks[0].name, 15, 1, False)
+
+        self.assertEqual(self.site.find_block_replica(new_block), BlockReplica(new_block, self.site, self.group, True, False, 9))
+        self.assertEqual(self.occupancy(), ([65, 65], [57, 57]))
+        self.assertEqual(len(self.store), 3)
+
+        self.dataset.remove_block(new_block)
+
+        self.assertIsNone(self.site.find_block_replica(new_block))
+        self.assertEqual(self.occupancy(), ([50, 50], [48, 48]))
+        self.assertEqual(len(self.store), 2)
+
+    def test_collapse(self):
+        self.site.remove_block_replicas(self.replica)
+        self.replica.block_replicas = []
+        for block in self.dataset.blocks:
+            self.site.add_block_replica(self.replica.new_block_replica(block, self.group, True, False, block.size))
+
+        self.assertTrue(self.replica.collapse_block_replicas())
+        self.assertEqual(len(self.store), 0)
+        self.assertEqual(self.occupancy(), ([100, 100], [100, 100]))
+
+        block_replica = self.site.find_block_replica(self.dataset.blocks[2])
+
+        self.assertTrue(self.replica.is_columnar())
+        self.assertEqual(block_replica, BlockReplica(self.dataset.blocks[2], self.site, self.group, True, False, 30))
+        self.assertEqual(len(self.store), 4)
+        self.assertEqual(self.occupancy(), ([100, 100], [100, 100]))
+
+    def test_set_block_replicas(self):
+        # used by detox to restrict the site to a partition
+        block_replicas = self.expected()[:2]
+        self.replica.block_replicas = block_replicas
+        self.site.set_block_replicas(block_replicas)
+
+        self.assertEqual(len(self.site._block_replicas), 0)
+        self.assertEqual(self.occupancy(), ([30, 30], [28, 28]))
+        self.assertIsNone(self.site.find_block_replica(self.dataset.blocks[2]))
+
+if __name__ == '__main__':
+    unittest.main()
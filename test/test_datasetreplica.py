@@ -0,0 +1,152 @@
+import unittest
+
+import dynamotest
+
+from common.dataformat import Dataset, Block, Site, Group, DatasetReplica
+
+class ImplicitReplicaTest(unittest.TestCase):
+    """
+    Full single-owner dataset replicas in the implicit representation (DatasetReplica.set_full).
+    """
+
+    def setUp(self):
+        self.group = Group('A')
+        self.other_group = Group('B')
+
+        self.dataset = Dataset('/A/B/RECO')
+        self.dataset.blocks = []
+        self.dataset.replicas = []
+        for i in range(1, 5):
+            block = Block(i, self.dataset, 10 * i, 1, False)
+            self.dataset.add_block(block)
+            self.dataset.size += block.size
+
+        self.site = Site('T2_XX_Test')
+
+        self.replica = DatasetReplica(self.dataset, self.site, is_complete = True)
+        self.dataset.add_replica(self.replica)
+        self.site.add_dataset_replica(self.replica)
+
+    def make_explicit(self, group = None):
+        for block in self.dataset.blocks:
+            block_replica = self.replica.new_block_replica(block, group or self.group, True, False, block.size)
+            self.site.add_block_replica(block_replica)
+
+    def occupancy(self):
+        return self.site._occupancy_projected[:], self.site._occupancy_physical[:]
+
+    def test_full_replica_accounting(self):
+        self.replica.set_full(self.group)
+        self.site.add_full_replica(self.replica)
+
+        self.assertTrue(self.replica.is_implicit())
+        self.assertTrue(self.replica.is_full())
+        self.assertFalse(self.replica.is_partial())
+        self.assertEqual(self.replica.num_block_replicas(), 4)
+        self.assertEqual(self.replica.size(), 100)
+        self.assertEqual(self.replica.size(self.group), 100)
+        self.assertEqual(self.replica.size(self.other_group), 0)
+        self.assertEqual(self.occupancy(), ([100, 100], [100, 100]))
+        # nothing is created per block
+        self.assertEqual(len(self.site._block_replicas), 0)
+
+        sizes = [r.size for r in self.replica.iter_block_replicas()]
+        self.assertEqual(sizes, [10, 20, 30, 40])
+        self.assertTrue(self.replica.is_implicit())
+
+    def test_collapse(self):
+        self.make_explicit()
+        explicit_occupancy = self.occupancy()
+
+        self.assertTrue(self.replica.collapse_block_replicas())
+
+        self.assertTrue(self.replica.is_implicit())
+        self.assertEqual(self.replica.implicit_group(), self.group)
+        self.assertEqual(len(self.site._block_replicas), 0)
+        self.assertEqual(self.occupancy(), explicit_occupancy)
+
+    def test_no_collapse(self):
+        # two owners
+        self.make_explicit()
+        block_replica = self.site.find_block_replica(self.dataset.blocks[0])
+        self.replica.remove_block_replica(block_replica)
+        self.site.remove_block_replica(block_replica)
+        block_replica = block_replica.clone(group = self.other_group)
+        self.replica.add_block_replica(block_replica)
+        self.site.add_block_replica(block_replica)
+
+        self.assertFalse(self.replica.collapse_block_replicas())
+        self.assertFalse(self.replica.is_implicit())
+
+        # incomplete block replica
+        block_replica = self.site.find_block_replica(self.dataset.blocks[0])
+        self.replica.remove_block_replica(block_replica)
+        self.site.remove_block_replica(block_replica)
+        block_replica = block_replica.clone(group = self.group, is_complete = False, size = 1)
+        self.replica.add_block_replica(block_replica)
+        self.site.add_block_replica(block_replica)
+
+        self.assertFalse(self.replica.collapse_block_replicas())
+
+        # missing block
+        self.replica.remove_block_replica(block_replica)
+        self.site.remove_block_replica(block_replica)
+
+        self.assertFalse(self.replica.collapse_block_replicas())
+        self.assertTrue(self.replica.is_partial())
+
+    def test_materialize_on_access(self):
+        self.make_explicit()
+        explicit_occupancy = self.occupancy()
+        self.replica.collapse_block_replicas()
+
+        block = self.dataset.blocks[2]
+        block_replica = self.site.find_block_replica(block)
+
+        self.assertFalse(self.replica.is_implicit())
+        self.assertEqual(block_replica.block, block)
+        self.assertEqual(block_replica.group, self.group)
+        self.assertTrue(block_replica.is_complete)
+        self.assertEqual(len(self.site._block_replicas), 4)
+        self.assertEqual(len(self.replica.block_replicas), 4)
+        self.assertEqual(self.occupancy(), explicit_occupancy)
+
+    def test_block_changes(self):
+        self.make_explicit()
+        self.replica.collapse_block_replicas()
+
+        # a new block is not at the site; the replica is materialized before the block list changes
+        block = Block(9, self.dataset, 5, 1, True)
+        self.dataset.add_block(block)
+        self.dataset.size += block.size
+
+        self.assertFalse(self.replica.is_implicit())
+        self.assertFalse(self.replica.is_full())
+        self.assertEqual(self.replica.num_block_replicas(), 4)
+        self.assertEqual(self.occupancy(), ([100, 100], [100, 100]))
+
+        self.dataset.remove_block(block)
+        self.dataset.size -= block.size
+
+        self.assertTrue(self.replica.collapse_block_replicas())
+
+        self.dataset.remove_block(self.dataset.blocks[0])
+        self.dataset.size -= 10
+
+        self.assertFalse(self.replica.is_implicit())
+        self.assertEqual(self.replica.num_block_replicas(), 3)
+        self.assertEqual(self.occupancy(), ([90, 90], [90, 90]))
+
+    def test_unlink(self):
+        self.replica.set_full(self.group)
+        self.site.add_full_replica(self.replica)
+
+        self.site.remove_block_replicas(self.replica)
+        self.replica.unlink()
+
+        self.assertIsNone(self.dataset.find_replica(self.site))
+        self.assertIsNone(self.site.find_dataset_replica(self.dataset))
+        self.assertEqual(self.occupancy(), ([0, 0], [0, 0]))
+
+if __name__ == '__main__':
+    unittest.main()
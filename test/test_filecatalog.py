@@ -0,0 +1,73 @@
+import unittest
+import random
+
+import dynamotest
+
+from common.dataformat import Dataset, Block, File, FileCatalog
+
+class FileCatalogTest(unittest.TestCase):
+    """
+    FileCatalog keeps the rows of each block indexed; the index must follow the rows moved by removals.
+    """
+
+    def setUp(self):
+        self.dataset = Dataset('/A/B/RECO')
+        self.blocks = [Block(i, self.dataset, 10, 1, False) for i in range(1, 5)]
+
+        self.catalog = FileCatalog()
+        self.files = []
+        for i in range(40):
+            lfile = File.create('/store/data/%d/file%d.root' % (i % 3, i), self.blocks[i % 4], i)
+            self.catalog.add(lfile)
+            self.files.append(lfile)
+
+    def check(self, files):
+        self.assertEqual(sorted(self.catalog), sorted(files))
+        for block in self.blocks:
+            self.assertEqual(sorted(self.catalog.block_files(block)), sorted(f for f in files if f.block is block))
+
+        # blocks without files are dropped
+        blocks = set(f.block.name for f in files)
+        self.assertEqual(sorted(b.name for b in self.catalog._blocks), sorted(blocks))
+        self.assertEqual(len(self.catalog._block_rows), len(blocks))
+        self.assertEqual(sum(len(rows) for rows in self.catalog._block_rows), len(files))
+
+    def test_remove_block(self):
+        self.catalog.remove_block(self.blocks[1])
+        files = [f for f in self.files if f.block is not self.blocks[1]]
+        self.check(files)
+
+        self.catalog.remove_block(self.blocks[0])
+        files = [f for f in files if f.block is not self.blocks[0]]
+        self.check(files)
+
+        # removing an unknown block does nothing
+        self.catalog.remove_block(self.blocks[0])
+        self.check(files)
+
+    def test_remove_files(self):
+        rng = random.Random(1)
+        files = list(self.files)
+        rng.shuffle(files)
+
+        while len(files) != 0:
+            self.catalog.remove(files.pop())
+            self.check(files)
+
+        self.assertEqual(self.catalog._block_ids, {})
+
+    def test_move_to_block(self):
+        # a file added again with another block changes its block
+        lfile = self.files[0].clone(block = self.blocks[3])
+        self.catalog.add(lfile)
+        files = [lfile] + self.files[1:]
+        self.check(files)
+
+        for lfile in self.files[4::4]:
+            self.catalog.add(lfile.clone(block = self.blocks[1]))
+
+        files = [f if f.block is not self.blocks[0] else f.clone(block = self.blocks[1]) for f in files]
+        self.check(files)
+
+if __name__ == '__main__':
+    unittest.main()
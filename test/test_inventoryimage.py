@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import dynamotest
+
+from common.dataformat import Dataset, Block, Site, Group, DatasetReplica
+from common.inventoryimage import InventoryImage
+
+class InventoryImageTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = self.tmpdir + '/inventory.img'
+
+        self.site1 = Site('T1_XX_Test', host = 'host.example', storage = 10.)
+        self.site2 = Site('T2_XX_Test')
+        self.site1.set_partition_quota(Site.partitions['A'], 5)
+
+        self.group_a = Group('A')
+        self.group_b = Group('B', Dataset)
+
+        dataset = self.dataset = Dataset('/A/B/RECO', status = Dataset.STAT_VALID, software_version = (1, 2, 3, 'x'), last_update = 1000, is_open = False)
+        dataset.blocks = []
+        dataset.replicas = []
+        for i in range(3):
+            block = Block(long(i + 1), dataset, 100 * (i + 1), 2, i == 2)
+            dataset.add_block(block)
+            dataset.size += block.size
+            dataset.num_files += block.num_files
+
+        # implicit full replica
+        replica = DatasetReplica(dataset, self.site1, is_complete = True, is_custodial = True, last_block_created = 2000)
+        dataset.add_replica(replica)
+        self.site1.add_dataset_replica(replica)
+        replica.set_full(self.group_a)
+        self.site1.add_full_replica(replica)
+
+        # partial replica with an incomplete block replica without owner
+        replica = DatasetReplica(dataset, self.site2, is_complete = False)
+        dataset.add_replica(replica)
+        self.site2.add_dataset_replica(replica)
+        block_replica = replica.new_block_replica(dataset.blocks[0], None, False, False, 50)
+        self.site2.add_block_replica(block_replica)
+        block_replica = replica.new_block_replica(dataset.blocks[1], self.group_b, True, False, 200)
+        self.site2.add_block_replica(block_replica)
+
+        # not in the image (no replica at the loaded sites)
+        self.orphan = Dataset('/X/Y/RAW')
+
+        self.site_names = [self.site1.name, self.site2.name]
+
+        InventoryImage.save(self.path, 1234, self.site_names, [self.site1, self.site2], [self.group_a, self.group_b], [self.dataset, self.orphan])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_validity(self):
+        self.assertIsNone(InventoryImage.load(self.path, 1235, self.site_names))
+        self.assertIsNone(InventoryImage.load(self.path, 1234, self.site_names[:1]))
+        self.assertIsNone(InventoryImage.load(self.tmpdir + '/missing.img', 1234, self.site_names))
+        self.assertIsNotNone(InventoryImage.load(self.path, 1234, list(reversed(self.site_names))))
+
+    def test_round_trip(self):
+        sites, groups, datasets = InventoryImage.load(self.path, 1234, self.site_names)
+
+        sites = dict((s.name, s) for s in sites)
+        groups = dict((g.name, g) for g in groups)
+
+        self.assertEqual(sorted(sites), sorted(self.site_names))
+        self.assertEqual(sorted(groups), ['A', 'B'])
+        self.assertIs(groups['B'].olevel, Dataset)
+
+        site1 = sites[self.site1.name]
+        site2 = sites[self.site2.name]
+        self.assertEqual(site1.host, 'host.example')
+        self.assertEqual(site1.storage, 10.)
+        self.assertEqual(site1.partition_quota(Site.partitions['A']), 5)
+
+        self.assertEqual([d.name for d in datasets], [self.dataset.name])
+        dataset = datasets[0]
+        for attr in ('size', 'num_files', 'status', 'on_tape', 'data_type', 'software_version', 'last_update', 'is_open'):
+            self.assertEqual(getattr(dataset, attr), getattr(self.dataset, attr), attr)
+
+        block_data = lambda b: (b.name, b.size, b.num_files, b.is_open)
+        self.assertEqual(map(block_data, dataset.blocks), map(block_data, self.dataset.blocks))
+        self.assertTrue(all(b.dataset is dataset for b in dataset.blocks))
+
+        replica = dataset.find_replica(site1)
+        self.assertTrue(replica.is_implicit())
+        self.assertIs(replica.implicit_group(), groups['A'])
+        self.assertTrue(replica.is_custodial)
+        self.assertEqual(replica.last_block_created, 2000)
+        self.assertIs(site1.find_dataset_replica(dataset), replica)
+
+        replica = dataset.find_replica(site2)
+        self.assertFalse(replica.is_implicit())
+        self.assertFalse(replica.is_complete)
+        self.assertEqual([(r.block.name, r.group, r.is_complete, r.size) for r in replica.block_replicas], [(1, None, False, 50), (2, groups['B'], True, 200)])
+        self.assertIs(site2.find_block_replica(dataset.blocks[1]), replica.block_replicas[1])
+
+        for site, original in ((site1, self.site1), (site2, self.site2)):
+            for physical in (True, False):
+                self.assertEqual(site.storage_occupancy(physical = physical), original.storage_occupancy(physical = physical))
+
+if __name__ == '__main__':
+    unittest.main()
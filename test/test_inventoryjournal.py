@@ -0,0 +1,107 @@
+import unittest
+
+import dynamotest
+
+from common.dataformat import Dataset, Block, Site, Group, DatasetReplica, BlockReplica
+from common.inventoryjournal import InventoryJournal
+
+class InventoryJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.journal = InventoryJournal()
+
+        self.dataset = Dataset('/A/B/RECO')
+        self.dataset.blocks = []
+        self.dataset.replicas = []
+        self.blocks = [Block(i, self.dataset, 10, 1, False) for i in range(1, 4)]
+        for block in self.blocks:
+            self.dataset.add_block(block)
+
+        self.site = Site('T2_XX_Test')
+        self.group = Group('A')
+
+        self.replica = DatasetReplica(self.dataset, self.site)
+        self.block_replicas = [BlockReplica(block, self.site, self.group, True, False, 10) for block in self.blocks]
+
+    def test_merge(self):
+        self.journal.record(InventoryJournal.DATASET_UPDATED, self.dataset)
+        self.journal.record(InventoryJournal.DATASET_UPDATED, self.dataset)
+        self.journal.record_all(InventoryJournal.BLOCK_REPLICA_ADDED, self.block_replicas)
+        self.journal.record_all(InventoryJournal.BLOCK_REPLICA_ADDED, reversed(self.block_replicas))
+
+        self.assertEqual(len(self.journal), 4)
+        self.assertEqual(self.journal.objects(InventoryJournal.DATASET_UPDATED), [self.dataset])
+        # order of the first record
+        self.assertEqual(self.journal.objects(InventoryJournal.BLOCK_REPLICA_ADDED), self.block_replicas)
+
+    def test_equal_block_replicas(self):
+        # block replicas are tuples; an equal copy is the same change
+        self.journal.record(InventoryJournal.BLOCK_REPLICA_ADDED, self.block_replicas[0])
+        self.journal.record(InventoryJournal.BLOCK_REPLICA_ADDED, self.block_replicas[0].clone())
+
+        self.assertEqual(len(self.journal), 1)
+
+        self.journal.record(InventoryJournal.BLOCK_REPLICA_ADDED, self.block_replicas[0].clone(size = 5))
+
+        self.assertEqual(len(self.journal), 2)
+
+    def test_block_replica_cancellation(self):
+        self.journal.record(InventoryJournal.BLOCK_REPLICA_ADDED, self.block_replicas[0])
+        self.journal.record(InventoryJournal.BLOCK_REPLICA_REMOVED, self.block_replicas[0])
+
+        self.assertEqual(self.journal.objects(InventoryJournal.BLOCK_REPLICA_ADDED), [])
+        self.assertEqual(self.journal.objects(InventoryJournal.BLOCK_REPLICA_REMOVED), self.block_replicas[:1])
+
+        self.journal.record(InventoryJournal.BLOCK_REPLICA_ADDED, self.block_replicas[0])
+
+        self.assertEqual(self.journal.objects(InventoryJournal.BLOCK_REPLICA_ADDED), self.block_replicas[:1])
+        self.assertEqual(self.journal.objects(InventoryJournal.BLOCK_REPLICA_REMOVED), [])
+
+        # replacing a replica: the old version is removed, the new one added
+        new_replica = self.block_replicas[1].clone(is_complete = False, size = 5)
+        self.journal.record(InventoryJournal.BLOCK_REPLICA_REMOVED, self.block_replicas[1])
+        self.journal.record(InventoryJournal.BLOCK_REPLICA_ADDED, new_replica)
+
+        self.assertEqual(self.journal.objects(InventoryJournal.BLOCK_REPLICA_REMOVED), self.block_replicas[1:2])
+        self.assertEqual(self.journal.objects(InventoryJournal.BLOCK_REPLICA_ADDED), [self.block_replicas[0], new_replica])
+
+    def test_replica_cancellation(self):
+        self.journal.record(InventoryJournal.REPLICA_ADDED, self.replica)
+        self.journal.record(InventoryJournal.REPLICA_UPDATED, self.replica)
+        self.journal.record(InventoryJournal.REPLICA_REMOVED, self.replica)
+
+        # the removal cancels both the addition and the update
+        self.assertEqual(self.journal.objects(InventoryJournal.REPLICA_ADDED), [])
+        self.assertEqual(self.journal.objects(InventoryJournal.REPLICA_UPDATED), [])
+        self.assertEqual(self.journal.objects(InventoryJournal.REPLICA_REMOVED), [self.replica])
+
+        # an update does not cancel a removal
+        self.journal.record(InventoryJournal.REPLICA_UPDATED, self.replica)
+
+        self.assertEqual(self.journal.objects(InventoryJournal.REPLICA_REMOVED), [self.replica])
+        self.assertEqual(self.journal.objects(InventoryJournal.REPLICA_UPDATED), [self.replica])
+
+        self.journal.record(InventoryJournal.REPLICA_ADDED, self.replica)
+
+        self.assertEqual(self.journal.objects(InventoryJournal.REPLICA_REMOVED), [])
+        self.assertEqual(self.journal.objects(InventoryJournal.REPLICA_ADDED), [self.replica])
+
+    def test_replica_and_block_replicas_are_independent(self):
+        self.journal.record(InventoryJournal.REPLICA_REMOVED, self.replica)
+        self.journal.record_all(InventoryJournal.BLOCK_REPLICA_ADDED, self.block_replicas)
+
+        self.assertEqual(self.journal.objects(InventoryJournal.REPLICA_REMOVED), [self.replica])
+        self.assertEqual(len(self.journal.objects(InventoryJournal.BLOCK_REPLICA_ADDED)), 3)
+
+    def test_clear(self):
+        self.journal.record(InventoryJournal.DATASET_UPDATED, self.dataset)
+        self.journal.record_all(InventoryJournal.BLOCK_REPLICA_REMOVED, self.block_replicas)
+
+        self.assertEqual(self.journal.summary(), '1 dataset updated, 3 block replica removed')
+
+        self.journal.clear()
+
+        self.assertEqual(len(self.journal), 0)
+        self.assertEqual(self.journal.summary(), '')
+
+if __name__ == '__main__':
+    unittest.main()
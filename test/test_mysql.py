@@ -0,0 +1,255 @@
+import unittest
+
+import dynamotest
+
+from common.interface.mysql import MySQL, MySQLConnectionPool
+import common.configuration as config
+
+import MySQLdb
+
+class BulkLoadTest(unittest.TestCase):
+    """
+    load_many (LOAD DATA LOCAL INFILE) must write the same rows and raise the same errors as insert_many.
+    """
+
+    fields = ('id', 'name', 'size', 'flag', 'comment')
+
+    rows = [
+        (1, 'plain', 10, True, None),
+        (2, 'tab\tand\nnewline', 1 << 40, False, 'back\\slash'),
+        (3, u'unicode \xe9', 0, True, 'quote \' and "double"'),
+        (4, '\\N', 2.5, False, ''),
+        (5, 'last', -1, True, 'NULL')
+    ]
+
+    def setUp(self):
+        self.server = dynamotest.reset_server()
+        for table in ('inserted', 'loaded'):
+            self.server.create_table(table, self.fields)
+
+        self.min_rows = config.mysql.bulk_load_min_rows
+        config.mysql.bulk_load_min_rows = 1
+
+        self.db = MySQL(db = 'test', bulk_load = True)
+
+    def tearDown(self):
+        self.db.close()
+        config.mysql.bulk_load_min_rows = self.min_rows
+
+    def contents(self, table):
+        return self.server.tables[table].contents()
+
+    def used_load_data(self):
+        return any(sql.startswith('LOAD DATA') for sql in self.server.statements)
+
+    def test_insert(self):
+        self.db.insert_many('inserted', self.fields, None, self.rows, do_update = False)
+        self.db.load_many('loaded', self.fields, None, self.rows, do_update = False)
+
+        self.assertTrue(self.used_load_data())
+        self.assertEqual(len(self.contents('loaded')), len(self.rows))
+        self.assertEqual(self.contents('loaded'), self.contents('inserted'))
+
+    def test_mapping(self):
+        mapping = lambda row: (row[0] * 10,) + row[1:]
+
+        self.db.insert_many('inserted', self.fields, mapping, self.rows)
+        self.db.load_many('loaded', self.fields, mapping, self.rows)
+
+        self.assertEqual(self.contents('loaded'), self.contents('inserted'))
+
+    def test_update(self):
+        self.db.insert_many('inserted', self.fields, None, self.rows[:3])
+        self.db.load_many('loaded', self.fields, None, self.rows[:3])
+
+        updates = [(2, 'updated', 0, True, None), (3, 'updated', 7, False, 'x'), (6, 'new', 1, False, None)]
+
+        self.db.insert_many('inserted', self.fields, None, updates, do_update = True)
+        self.db.load_many('loaded', self.fields, None, updates, do_update = True)
+
+        self.assertEqual(len(self.contents('loaded')), 4)
+        self.assertEqual(self.contents('loaded'), self.contents('inserted'))
+
+    def test_duplicates(self):
+        self.db.insert_many('inserted', self.fields, None, self.rows[:1])
+        self.db.load_many('loaded', self.fields, None, self.rows[:1])
+
+        with self.assertRaises(MySQLdb.IntegrityError):
+            self.db.insert_many('inserted', self.fields, None, self.rows[:2], do_update = False)
+
+        with self.assertRaises(MySQLdb.IntegrityError):
+            self.db.load_many('loaded', self.fields, None, self.rows[:2], do_update = False)
+
+    def test_conversion_warnings(self):
+        with self.assertRaises(MySQLdb.DataError):
+            self.db.load_many('loaded', self.fields, lambda row: row[:4], self.rows, do_update = False)
+
+    def test_short_list(self):
+        config.mysql.bulk_load_min_rows = len(self.rows) + 1
+
+        self.db.load_many('loaded', self.fields, None, self.rows, do_update = False)
+
+        self.assertFalse(self.used_load_data())
+        self.assertEqual(len(self.contents('loaded')), len(self.rows))
+
+    def test_not_allowed(self):
+        for errno in (1148, 3948, 2068):
+            self.server.tables['loaded'].rows.clear()
+            self.server.load_data_error = errno
+            db = MySQL(db = 'test', bulk_load = True)
+
+            db.load_many('loaded', self.fields, None, self.rows, do_update = False)
+
+            # fell back to INSERT and does not try again
+            self.assertFalse(db._bulk_load)
+            self.assertEqual(len(self.contents('loaded')), len(self.rows))
+
+            db.close()
+
+        self.server.load_data_error = 1045
+
+        with self.assertRaises(MySQLdb.OperationalError):
+            self.db.load_many('loaded', self.fields, None, self.rows, do_update = False)
+
+    def test_local_infile(self):
+        self.assertEqual(self.db._connection.parameters.get('local_infile'), 1)
+
+        db = MySQL(db = 'test')
+        try:
+            self.assertNotIn('local_infile', db._connection.parameters)
+            self.assertFalse(db._bulk_load)
+        finally:
+            db.close()
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self):
+        dynamotest.reset_server()
+        MySQL.pool.clear()
+
+        self.pool_size = config.mysql.pool_size
+        self.ping_interval = config.mysql.pool_ping_interval
+
+    def tearDown(self):
+        MySQL.pool.clear()
+
+        config.mysql.pool_size = self.pool_size
+        config.mysql.pool_ping_interval = self.ping_interval
+
+    def test_exclusive(self):
+        db1 = MySQL(db = 'test')
+        db2 = MySQL(db = 'test')
+
+        self.assertIsNot(db1._connection, db2._connection)
+
+        connection = db1._connection
+        db1.close()
+        db3 = MySQL(db = 'test')
+
+        # reused only after it was returned
+        self.assertIs(db3._connection, connection)
+        # a closed object checks out a connection again
+        self.assertIsNot(db1._connection, connection)
+
+        for db in (db1, db2, db3):
+            db.close()
+
+    def test_close_on_delete(self):
+        db = MySQL(db = 'test')
+        connection = db._connection
+        db.query('LOCK TABLES `test` WRITE')
+        del db
+
+        # the session may be in any state; the connection is not returned to the pool
+        self.assertTrue(connection.closed)
+
+        db = MySQL(db = 'test')
+        self.assertIsNot(db._connection, connection)
+        db.close()
+
+    def test_reset_on_checkin(self):
+        dynamotest.server.create_table('test', ['id'], 1)
+
+        db = MySQL(db = 'test')
+        connection = db._connection
+        db.query('LOCK TABLES `test` WRITE')
+        db.query('CREATE TEMPORARY TABLE `test_tmp` SELECT `id` FROM `test` LIMIT 0')
+        db.close()
+
+        self.assertEqual(connection.locked_tables, [])
+        self.assertEqual(connection.temporary_tables, {})
+        self.assertEqual(connection.num_rollbacks, 1)
+
+        db = MySQL(db = 'test')
+        self.assertIs(db._connection, connection)
+        db.close()
+
+    def test_close_with_open_stream(self):
+        dynamotest.server.create_table('test', ['id'], 1)
+
+        db = MySQL(db = 'test')
+        connection = db._connection
+        db.query('INSERT INTO `test` (`id`) VALUES (1),(2)')
+
+        stream = db.xquery('SELECT `id` FROM `test`')
+        next(stream)
+        db.close()
+
+        self.assertTrue(connection.closed)
+
+    def test_no_reconnect_in_lock(self):
+        db = MySQL(db = 'test')
+        connection = db._connection
+        db.query('LOCK TABLES `test` WRITE')
+        connection.close()
+
+        # a new connection would not hold the lock
+        with self.assertRaises(MySQLdb.OperationalError):
+            db.query('SHOW WARNINGS')
+
+        self.assertIs(db._connection, connection)
+
+        # releasing the lock is allowed to reconnect
+        db.query('UNLOCK TABLES')
+        self.assertIsNot(db._connection, connection)
+        db.query('SHOW WARNINGS')
+        db.close()
+
+    def test_pool_size(self):
+        config.mysql.pool_size = 1
+
+        dbs = [MySQL(db = 'test') for _ in range(3)]
+        connections = [db._connection for db in dbs]
+        for db in dbs:
+            db.close()
+
+        self.assertEqual([c.closed for c in connections], [False, True, True])
+
+    def test_dead_connection(self):
+        db = MySQL(db = 'test')
+        connection = db._connection
+        db.close()
+        connection.close()
+
+        config.mysql.pool_ping_interval = -1
+
+        db = MySQL(db = 'test')
+        self.assertIsNot(db._connection, connection)
+        self.assertFalse(db._connection.closed)
+        db.close()
+
+    def test_reconnect(self):
+        db = MySQL(db = 'test')
+        connection = db._connection
+        connection.close()
+
+        # query() reconnects after an OperationalError; the broken connection is not returned to the pool
+        db.query('SHOW WARNINGS')
+
+        self.assertIsNot(db._connection, connection)
+        db.close()
+
+        idle = MySQL.pool._idle[MySQLConnectionPool._key({'db': 'test'})]
+        self.assertNotIn(connection, [c for c, _ in idle])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import random
+
+import dynamotest
+
+from common.interface.mysqlstore import MySQLStore
+
+class CompareRowsTest(unittest.TestCase):
+    """
+    MySQLStore._compare_rows merges the sorted rows of a table with their new contents.
+    """
+
+    def setUp(self):
+        # _compare_rows does not use the connection
+        self.store = MySQLStore.__new__(MySQLStore)
+
+    def compare(self, current, new, num_keys = 2):
+        return self.store._compare_rows(iter(current), new, num_keys)
+
+    def reference(self, current, new, num_keys = 2):
+        current_rows = dict((row[:num_keys], row) for row in current)
+        new_rows = dict((row[:num_keys], row) for row in new)
+
+        upserts = [row for key, row in sorted(new_rows.iteritems()) if current_rows.get(key) != row]
+        deletions = [key for key in sorted(current_rows) if key not in new_rows]
+
+        return upserts, deletions
+
+    def test_identical(self):
+        rows = [(1, 1, 'full', 0), (1, 2, 'full', 1), (2, 1, 'incomplete', 0)]
+
+        self.assertEqual(self.compare(rows, list(rows)), ([], []))
+
+    def test_empty(self):
+        rows = [(1, 1, 'full', 0), (2, 1, 'full', 0)]
+
+        self.assertEqual(self.compare([], rows), (rows, []))
+        self.assertEqual(self.compare(rows, []), ([], [(1, 1), (2, 1)]))
+
+    def test_changes(self):
+        current = [(1, 1, 'full', 0), (1, 2, 'full', 0), (2, 1, 'full', 0), (4, 4, 'full', 0)]
+        new = [(0, 5, 'full', 0), (1, 2, 'incomplete', 0), (2, 1, 'full', 0), (3, 1, 'full', 1), (5, 5, 'full', 0)]
+
+        upserts, deletions = self.compare(current, new)
+
+        self.assertEqual(upserts, [(0, 5, 'full', 0), (1, 2, 'incomplete', 0), (3, 1, 'full', 1), (5, 5, 'full', 0)])
+        self.assertEqual(deletions, [(1, 1), (4, 4)])
+
+    def test_values_from_server(self):
+        # numeric keys come back from the server as longs; flags as ints for bool values
+        current = [(1L, 2L, 1, 0)]
+
+        self.assertEqual(self.compare(current, [(1, 2, True, False)]), ([], []))
+
+        upserts, deletions = self.compare([(1L, 2L, 1, 0), (3L, 2L, 1, 0)], [(1, 2, True, True)])
+
+        self.assertEqual(upserts, [(1, 2, True, True)])
+        self.assertEqual(deletions, [(3, 2)])
+        self.assertIs(type(deletions[0][0]), int)
+
+    def test_single_key(self):
+        current = [(1, 'a'), (2, 'b'), (3, 'c')]
+        new = [(2, 'b'), (3, 'x'), (4, 'd')]
+
+        self.assertEqual(self.compare(current, new, 1), ([(3, 'x'), (4, 'd')], [(1,)]))
+
+    def test_random(self):
+        rng = random.Random(12345)
+
+        for _ in range(50):
+            keys = sorted(set((rng.randint(0, 30), rng.randint(0, 5)) for _ in range(rng.randint(0, 60))))
+            current = [key + (rng.randint(0, 1),) for key in keys if rng.random() < 0.7]
+            new = [key + (rng.randint(0, 1),) for key in keys if rng.random() < 0.7]
+
+            self.assertEqual(self.compare(current, new), self.reference(current, new))
+
+if __name__ == '__main__':
+    unittest.main()